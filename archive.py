@@ -0,0 +1,42 @@
+"""
+بناء ملفات ZIP أثناء إرسالها دون حفظها على القرص.
+"""
+
+import zipfile
+
+
+class _ZipOutput:
+    """ملف للكتابة فقط يجمع ما يكتبه zipfile حتى يُرسل"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def zip_stream(files, compresslevel=None):
+    """
+    مولد لبايتات ملف ZIP من (اسم الملف، أجزاء المحتوى) بالترتيب.
+
+    الملف غير قابل للـ seek فيكتب zipfile حجم كل عنصر بعد محتواه، لذلك يُرسل كل
+    عنصر فور ضغطه دون معرفة الأحجام مسبقاً. compresslevel=1 يناسب المحتوى المضغوط
+    أصلاً (مثل الفيديو).
+    """
+    output = _ZipOutput()
+    with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=compresslevel) as archive:
+        for name, chunks in files:
+            with archive.open(name, 'w') as member:
+                for chunk in chunks:
+                    member.write(chunk)
+            yield output.drain()
+    yield output.drain()
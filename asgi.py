@@ -0,0 +1,437 @@
+"""
+وضع التشغيل غير المتزامن (ASGI).
+
+مسارات بث الوسائط (/download و /convert_to_mp3 و /trim_video) وبث التقدم (/events)
+تعمل مباشرة على حلقة asyncio: عمليات yt-dlp تُشغَّل عبر asyncio.create_subprocess_exec
+وتُنقل مخرجاتها عبر أنابيب غير حاجبة، فلا يحجز التحميل الطويل thread كاملاً ويستطيع
+عامل واحد خدمة مئات التحميلات المتزامنة. بقية المسارات تُمرَّر إلى تطبيق Flask.
+
+التشغيل:
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+"""
+
+import asyncio
+import io
+import json
+import mimetypes
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qsl
+
+import app as flask_app
+from app import (ACTIVE_STREAMS, MEDIA_BUSY_MESSAGE, MEDIA_CHUNK_SIZE, PROGRESS_EVENT_INTERVAL,
+                 PROGRESS_PENDING_TIMEOUT, STREAM_BYTES, RequestError, extraction_engine, finish_transfer, media_cache,
+                 media_process_limiter, media_producer, media_range, observe_request, prepare_audio_job,
+                 prepare_download_job, prepare_mp3_job, prepare_trim_job, progress_hub, report_cached_media,
+                 report_offloaded, report_stream_error, settled_job_state, start_transfer, stream_headers,
+                 update_download_progress)
+from process_manager import PRIORITY_NORMAL, AdmissionError, AsyncManagedProcess
+from progress import final_events, sse_stream_async
+
+# عدد الـ threads لتنفيذ مسارات Flask العادية (الطلبات القصيرة)
+WSGI_THREADS = int(os.environ.get('WSGI_THREADS', '16'))
+# عدد الـ threads لقراءة ملفات الوسائط من القرص؛ منفصلة عن الـ executor الافتراضي حتى لا ينتظر
+# تقديم الملفات المكتملة خلف أعمال أخرى فيه
+FILE_READ_THREADS = int(os.environ.get('FILE_READ_THREADS', '8'))
+
+# رسائل الأخطاء لكل مسار وسائط (نفس رسائل وضع Flask)
+MEDIA_ROUTES = {
+    '/download': (prepare_download_job, 'حدث خطأ أثناء التحميل'),
+    '/convert_to_mp3': (prepare_mp3_job, 'فشل في تحويل الصوت إلى MP3'),
+    '/convert_audio': (prepare_audio_job, 'فشل في تحويل الصوت'),
+    '/trim_video': (prepare_trim_job, 'فشل في تقطيع الفيديو'),
+}
+
+
+class WsgiBridge:
+    """
+    تشغيل تطبيق WSGI من ASGI على مجموعة threads، فتُنفَّذ الطلبات المتزامنة بالتوازي
+    وتُرسل أجزاء الاستجابة من الـ thread إلى الحلقة مع انتظار إرسال كل جزء.
+    """
+
+    def __init__(self, wsgi_app, max_workers):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='wsgi')
+
+    async def __call__(self, scope, receive, send):
+        body = await read_body(receive)
+        if body is None:
+            return
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.run, scope, body, send, loop)
+
+    def run(self, scope, body, send, loop):
+        def send_sync(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                   for name, value in headers]
+            return lambda data: None
+
+        result = self.wsgi_app(self.environ(scope, body), start_response)
+        try:
+            started = False
+            for chunk in result:
+                if not started:
+                    send_sync({'type': 'http.response.start', 'status': response['status'],
+                               'headers': response['headers']})
+                    started = True
+                if chunk:
+                    send_sync({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            if not started:
+                send_sync({'type': 'http.response.start', 'status': response['status'],
+                           'headers': response['headers']})
+            send_sync({'type': 'http.response.body', 'body': b''})
+        except OSError:
+            # انقطع العميل أثناء الإرسال
+            pass
+        finally:
+            close = getattr(result, 'close', None)
+            if close is not None:
+                close()
+
+    @staticmethod
+    def environ(scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1] or 80),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0],
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope['headers']:
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                name = 'HTTP_' + name
+            if name in environ:
+                value = environ[name] + ('; ' if name == 'HTTP_COOKIE' else ',') + value
+            environ[name] = value
+        return environ
+
+
+wsgi_application = WsgiBridge(flask_app.app, WSGI_THREADS)
+file_reader = ThreadPoolExecutor(max_workers=FILE_READ_THREADS, thread_name_prefix='file-read')
+media_cache.read_executor = file_reader
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+    elif scope['type'] == 'http' and scope['path'] in MEDIA_ROUTES:
+        await media_route(scope, receive, timed_send(scope, send))
+    elif scope['type'] == 'http' and scope['path'] == '/events':
+        await progress_events(scope, receive, timed_send(scope, send))
+    else:
+        await wsgi_application(scope, receive, send)
+
+
+def timed_send(scope, send):
+    """
+    تسجيل زمن الطلب حتى بدء الاستجابة لمسارات ASGI (مثل after_request في Flask،
+    الذي يقيس بقية المسارات عبر WsgiBridge)
+    """
+    started = time.perf_counter()
+
+    async def wrapper(message):
+        if message['type'] == 'http.response.start':
+            observe_request(scope['path'], scope['method'], message['status'], time.perf_counter() - started)
+        await send(message)
+
+    return wrapper
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            wsgi_application.executor.shutdown(wait=False)
+            extraction_engine.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+def request_headers(scope):
+    return {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+
+
+def query_params(scope):
+    return dict(parse_qsl(scope.get('query_string', b'').decode('utf-8')))
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+def client_id_from_scope(scope):
+    """معرف العميل من كوكي جلسة Flask (يُنشأ عند فتح الصفحة الرئيسية)"""
+    flask = flask_app.app
+    cookie = SimpleCookie(request_headers(scope).get('cookie', ''))
+    morsel = cookie.get(flask.config['SESSION_COOKIE_NAME'])
+    serializer = flask.session_interface.get_signing_serializer(flask)
+    if morsel is None or serializer is None:
+        return None
+    try:
+        return serializer.loads(morsel.value).get('client_id')
+    except Exception:
+        return None
+
+
+async def send_response(send, status, body, content_type='application/json', headers=None):
+    if isinstance(body, (dict, list)):
+        body = json.dumps(body, ensure_ascii=False)
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+        if not content_type.endswith('charset=utf-8'):
+            content_type += '; charset=utf-8'
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': encode_headers(dict(headers or {}, **{'Content-Type': content_type,
+                                                                  'Content-Length': str(len(body))}))})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def encode_headers(headers):
+    return [(name.lower().encode('latin-1'), str(value).encode('latin-1')) for name, value in headers.items()]
+
+
+async def wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+async def relay_until_disconnect(receive, relay):
+    """
+    تشغيل relay حتى ينتهي أو ينقطع العميل؛ عند الانقطاع يُلغى البث فتُغلق مولداته
+    (وتتوقف عملية yt-dlp إن لم يبقَ قراء آخرون). يعيد True إذا انقطع العميل.
+    """
+    relay_task = asyncio.ensure_future(relay)
+    disconnect_task = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await asyncio.wait({relay_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        disconnect_task.cancel()
+    if relay_task.done():
+        relay_task.result()
+        return False
+    relay_task.cancel()
+    try:
+        await relay_task
+    except asyncio.CancelledError:
+        pass
+    return True
+
+
+async def media_route(scope, receive, send):
+    prepare, error_message = MEDIA_ROUTES[scope['path']]
+    if scope['method'] == 'GET':
+        params = query_params(scope)
+        params.setdefault('download_id', str(uuid.uuid4()))
+    else:
+        body = await read_body(receive)
+        if body is None:
+            return
+        try:
+            params = json.loads(body or b'{}')
+        except ValueError:
+            await send_response(send, 400, {'error': 'بيانات الطلب غير صالحة.'})
+            return
+
+    # التجهيز قد يستخرج معلومات الفيديو، لذلك يعمل خارج حلقة الأحداث
+    try:
+        job = await asyncio.to_thread(prepare, params)
+    except RequestError as e:
+        if scope['method'] == 'GET':
+            await send_response(send, e.status, e.message, 'text/html')
+        else:
+            await send_response(send, e.status, {'error': e.message})
+        return
+    except Exception as e:
+        print(f"{error_message}: {e}")
+        if scope['method'] == 'GET':
+            update_download_progress(params['download_id'], 'error', 0, f'خطأ: {str(e)}')
+            await send_response(send, 500, f'{error_message}: {str(e)}', 'text/html')
+        else:
+            await send_response(send, 500, {'error': f'{error_message}: {str(e)}'})
+        return
+
+    await serve_media(scope, receive, send, client_id_from_scope(scope), **job)
+
+
+async def send_cached_file(scope, receive, send, cached, download_name, mimetype, download_id, etag):
+    """تقديم ملف مكتمل من الذاكرة المؤقتة مع دعم طلبات Range و If-Range"""
+    size = os.path.getsize(cached.path)
+    request = request_headers(scope)
+    byte_range = media_range(request.get('range'), request.get('if-range'), size, etag)
+    headers = stream_headers(download_name, download_id, etag, size, byte_range)
+    headers['Content-Type'] = mimetype or mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+    status = 206 if byte_range else 200
+    start, end = byte_range or (0, size - 1)
+    sent = STREAM_BYTES.labels(scope['path'])
+
+    async def relay():
+        loop = asyncio.get_running_loop()
+        await send({'type': 'http.response.start', 'status': status, 'headers': encode_headers(headers)})
+        with open(cached.path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await loop.run_in_executor(file_reader, f.read, min(MEDIA_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                sent.inc(len(chunk))
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': remaining > 0})
+        if remaining > 0:
+            await send({'type': 'http.response.body', 'body': b''})
+
+    await relay_until_disconnect(receive, relay())
+
+
+async def serve_media(scope, receive, send, client_id, download_id, cache_key, args, download_name,
+                      mimetype, expected_bytes=None, on_complete=None, error_label='Media stream error',
+                      limiter=media_process_limiter, priority=PRIORITY_NORMAL, redirect_url=None, resume=None,
+                      size=None):
+    """مثل serve_media في app.py لكن البث وعملية yt-dlp يعملان على حلقة asyncio"""
+    if redirect_url:
+        progress_hub.assign(download_id, client_id)
+        report_offloaded(download_id, on_complete, size or expected_bytes)
+        await send_response(send, 302, '', 'text/plain',
+                            headers={'Location': redirect_url, 'X-Download-Id': download_id,
+                                     'Cache-Control': 'no-store'})
+        return
+
+    cached = media_cache.get(cache_key)
+    if cached is not None:
+        progress_hub.assign(download_id, client_id)
+        report_cached_media(download_id, cached, on_complete)
+        await send_cached_file(scope, receive, send, cached, download_name, mimetype, download_id, cache_key)
+        return
+
+    reserved = False
+    if not media_cache.is_filling(cache_key):
+        try:
+            await limiter.acquire_async(priority)
+        except AdmissionError as e:
+            await send_response(send, 429, {'error': MEDIA_BUSY_MESSAGE},
+                                headers={'Retry-After': str(e.retry_after)})
+            return
+        reserved = True
+
+    def start_process():
+        return AsyncManagedProcess(extraction_engine.command(*args), limiter=limiter,
+                                   chunk_size=MEDIA_CHUNK_SIZE)
+
+    request = request_headers(scope)
+    byte_range = media_range(request.get('range'), request.get('if-range'), size, cache_key)
+    start, end = byte_range or (0, (size or 0) - 1)
+    chunks, started = media_cache.open_stream_async(
+        cache_key, media_producer(start_process, limiter, priority, resume, reserved), meta={'mimetype': mimetype},
+        start=start, resumable=resume is not None, size=size)
+    if reserved and not started:
+        limiter.release()
+    meter = start_transfer(download_id, expected_bytes if byte_range is None else end - start + 1, client_id)
+    sent = STREAM_BYTES.labels(scope['path'])
+    active = ACTIVE_STREAMS.labels(scope['path'])
+
+    async def relay():
+        headers = dict(stream_headers(download_name, download_id, cache_key, size, byte_range),
+                       **{'Content-Type': mimetype})
+        status = 206 if byte_range else 200
+        remaining = end - start + 1 if size else None
+        response_started = False
+        active.inc()
+        try:
+            async for chunk in chunks:
+                if not response_started:
+                    await send({'type': 'http.response.start', 'status': status, 'headers': encode_headers(headers)})
+                    response_started = True
+                if remaining is not None:
+                    chunk = chunk[:remaining]
+                    remaining -= len(chunk)
+                meter.add(len(chunk))
+                sent.inc(len(chunk))
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                if remaining == 0:
+                    break
+            if not response_started:
+                await send({'type': 'http.response.start', 'status': status, 'headers': encode_headers(headers)})
+            await send({'type': 'http.response.body', 'body': b''})
+            finish_transfer(download_id, meter)
+            if on_complete and (byte_range is None or end == size - 1):
+                on_complete(meter.bytes_sent if byte_range is None else size)
+        except Exception as e:
+            report_stream_error(download_id, meter, e, error_label)
+            if not response_started:
+                await send_response(send, 500, {'error': str(e)})
+            # بعد بدء الاستجابة لا يمكن إلا قطع الاتصال، فيعرف العميل أن الملف ناقص
+        finally:
+            active.dec()
+            await chunks.aclose()
+
+    if await relay_until_disconnect(receive, relay()):
+        update_download_progress(download_id, 'cancelled', meter.percent or 0, 'انقطع الاتصال', **meter.snapshot())
+
+
+async def progress_events(scope, receive, send):
+    """مثل /events في app.py دون حجز thread لكل مشترك"""
+    params = query_params(scope)
+    job_id = params.get('download_id') or params.get('batch_id')
+    headers = {'Content-Type': 'text/event-stream; charset=utf-8', 'Cache-Control': 'no-cache',
+               'X-Accel-Buffering': 'no'}
+    if job_id:
+        # القراءة من مخزن الأعمال قد تنتظر القرص، فلا تجري على الحلقة
+        state = await asyncio.to_thread(settled_job_state, job_id)
+        if state is not None:
+            await send({'type': 'http.response.start', 'status': 200, 'headers': encode_headers(headers)})
+            await send({'type': 'http.response.body', 'body': final_events(job_id, state).encode('utf-8')})
+            return
+        job_ids = [job_id]
+        pending_timeout = PROGRESS_PENDING_TIMEOUT
+    else:
+        client_id = client_id_from_scope(scope)
+        job_ids = lambda: progress_hub.jobs_for(client_id)
+        pending_timeout = None
+
+    async def relay():
+        await send({'type': 'http.response.start', 'status': 200, 'headers': encode_headers(headers)})
+        events = sse_stream_async(progress_hub, job_ids, min_interval=PROGRESS_EVENT_INTERVAL,
+                                  pending_timeout=pending_timeout)
+        try:
+            async for event in events:
+                await send({'type': 'http.response.body', 'body': event.encode('utf-8'), 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            await events.aclose()
+
+    await relay_until_disconnect(receive, relay())
@@ -0,0 +1,252 @@
+"""
+محرك التحميل المتعدد.
+
+مجموعة عمال مشتركة (حد عام للتزامن) تنفذ عناصر جميع الدفعات، مع حد تزامن لكل دفعة،
+وإعادة المحاولة مع تأخير متزايد، وإمكانية إلغاء الدفعة.
+"""
+
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from extractor import DownloadCancelledError
+
+
+class BatchItem:
+    """عنصر واحد داخل دفعة تحميل"""
+
+    def __init__(self, index, url):
+        self.index = index
+        self.url = url
+        self.status = 'queued'
+        self.downloaded_bytes = 0
+        self.total_bytes = None
+        self.attempts = 0
+        self.error = None
+        self.filepath = None
+
+    def to_dict(self):
+        return {
+            'index': self.index,
+            'url': self.url,
+            'status': self.status,
+            'downloaded_bytes': self.downloaded_bytes,
+            'total_bytes': self.total_bytes,
+            'attempts': self.attempts,
+            'error': self.error,
+            'filepath': self.filepath,
+        }
+
+
+class Batch:
+    """دفعة تحميل وحالتها المجمعة"""
+
+    FINISHED_STATES = ('completed', 'error', 'cancelled')
+
+    def __init__(self, urls, format_spec, concurrency, batch_id=None):
+        self.id = batch_id or str(uuid.uuid4())
+        self.items = [BatchItem(i, url) for i, url in enumerate(urls)]
+        self.format_spec = format_spec
+        self.concurrency = concurrency
+        self.cancel_event = threading.Event()
+        self.created_at = datetime.now().isoformat()
+        self.lock = threading.Lock()
+        self._pending = list(self.items)
+        self._running = 0
+        self.done = threading.Event()
+        self.finished_at = None
+
+    @property
+    def status(self):
+        states = [item.status for item in self.items]
+        if not all(state in self.FINISHED_STATES for state in states):
+            return 'cancelling' if self.cancel_event.is_set() else 'downloading'
+        if self.cancel_event.is_set():
+            return 'cancelled'
+        if 'completed' in states:
+            return 'completed'
+        return 'error'
+
+    def progress(self):
+        """
+        التقدم المجمع بالنسبة المئوية محسوباً من البايتات الفعلية.
+
+        العناصر المنتهية تُحتسب كاملة، والعناصر التي لم يُعرف حجمها بعد تأخذ
+        متوسط حجم العناصر المعروفة حتى لا يقفز الشريط عند اكتشاف حجمها.
+        """
+        known = [item.total_bytes for item in self.items if item.total_bytes]
+        if not known:
+            finished = sum(item.status in self.FINISHED_STATES for item in self.items)
+            return int(finished / len(self.items) * 100)
+        average = sum(known) / len(known)
+        done = total = 0
+        for item in self.items:
+            size = item.total_bytes or average
+            total += size
+            done += size if item.status in self.FINISHED_STATES else min(item.downloaded_bytes, size)
+        return int(done / total * 100)
+
+    def counts(self):
+        counts = {}
+        for item in self.items:
+            counts[item.status] = counts.get(item.status, 0) + 1
+        return counts
+
+    def to_dict(self):
+        return {
+            'batch_id': self.id,
+            'status': self.status,
+            'progress': self.progress(),
+            'total': len(self.items),
+            'counts': self.counts(),
+            'downloaded_bytes': sum(item.downloaded_bytes for item in self.items),
+            'created_at': self.created_at,
+            'items': [item.to_dict() for item in self.items],
+        }
+
+
+class BatchEngine:
+    """
+    جدولة عناصر الدفعات على مجموعة عمال مشتركة.
+
+    download_item(item, format_spec, on_progress, cancel_event) ينفذ تحميل عنصر واحد
+    ويعيد مسار الملف. on_update(batch) تُستدعى عند تغير حالة الدفعة (بمعدل محدود
+    أثناء التحميل)، و on_item_done(batch, item) عند اكتمال عنصر بنجاح.
+
+    الدفعات المنتهية تُحذف من الذاكرة بعد finished_ttl ثانية (تبقى آخر حالة لها عبر on_update).
+    """
+
+    def __init__(self, download_item, max_workers=4, batch_concurrency=2, max_retries=2,
+                 retry_backoff=2.0, on_update=None, on_item_done=None, update_interval=0.5,
+                 finished_ttl=None):
+        self.download_item = download_item
+        self.batch_concurrency = batch_concurrency
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.on_update = on_update
+        self.on_item_done = on_item_done
+        self.update_interval = update_interval
+        self.finished_ttl = finished_ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='batch')
+        self._batches = {}
+        self._lock = threading.Lock()
+
+    def submit(self, urls, format_spec='best', concurrency=None, batch_id=None):
+        concurrency = max(1, min(concurrency or self.batch_concurrency, len(urls)))
+        batch = Batch(urls, format_spec, concurrency, batch_id=batch_id)
+        with self._lock:
+            if self.finished_ttl is not None:
+                self._prune()
+            self._batches[batch.id] = batch
+        self._notify(batch)
+        for _ in range(concurrency):
+            self._schedule_next(batch)
+        return batch
+
+    def _prune(self):
+        cutoff = time.monotonic() - self.finished_ttl
+        for batch_id in [batch_id for batch_id, batch in self._batches.items()
+                         if batch.finished_at is not None and batch.finished_at < cutoff]:
+            del self._batches[batch_id]
+
+    def get(self, batch_id):
+        with self._lock:
+            return self._batches.get(batch_id)
+
+    def cancel(self, batch_id):
+        batch = self.get(batch_id)
+        if batch is None:
+            return None
+        batch.cancel_event.set()
+        with batch.lock:
+            for item in batch._pending:
+                item.status = 'cancelled'
+            batch._pending.clear()
+            if batch._running == 0:
+                self._finish(batch)
+        self._notify(batch)
+        return batch
+
+    def _schedule_next(self, batch):
+        with batch.lock:
+            if not batch._pending:
+                if batch._running == 0:
+                    self._finish(batch)
+                return
+            item = batch._pending.pop(0)
+            batch._running += 1
+        self._executor.submit(self._run_item, batch, item)
+
+    @staticmethod
+    def _finish(batch):
+        if batch.finished_at is None:
+            batch.finished_at = time.monotonic()
+        batch.done.set()
+
+    def _run_item(self, batch, item):
+        try:
+            self._download_with_retries(batch, item)
+        finally:
+            with batch.lock:
+                batch._running -= 1
+            self._notify(batch)
+            self._schedule_next(batch)
+
+    def _download_with_retries(self, batch, item):
+        last_report = [0.0]
+
+        def on_progress(downloaded, total):
+            item.downloaded_bytes = downloaded
+            if total:
+                item.total_bytes = total
+            now = time.monotonic()
+            if now - last_report[0] >= self.update_interval:
+                last_report[0] = now
+                self._notify(batch)
+
+        while True:
+            if batch.cancel_event.is_set():
+                item.status = 'cancelled'
+                return
+            item.attempts += 1
+            item.status = 'downloading'
+            item.downloaded_bytes = 0
+            self._notify(batch)
+            try:
+                item.filepath = self.download_item(item, batch.format_spec, on_progress, batch.cancel_event)
+                item.status = 'completed'
+                item.error = None
+                if item.total_bytes:
+                    item.downloaded_bytes = item.total_bytes
+                break
+            except DownloadCancelledError:
+                item.status = 'cancelled'
+                return
+            except Exception as e:
+                item.error = getattr(e, 'stderr', None) or str(e)
+                if item.attempts > self.max_retries:
+                    item.status = 'error'
+                    print(f"Batch item failed: {item.url}: {item.error}")
+                    return
+                item.status = 'retrying'
+                self._notify(batch)
+                # تأخير متزايد بين المحاولات، مع الاستجابة الفورية للإلغاء
+                if batch.cancel_event.wait(self.retry_backoff * 2 ** (item.attempts - 1)):
+                    item.status = 'cancelled'
+                    return
+
+        # فشل التسجيل (السجل أو مخزن الأعمال) لا يجعل العنصر المكتمل فاشلاً فيُعاد تحميله
+        if self.on_item_done:
+            try:
+                self.on_item_done(batch, item)
+            except Exception as e:
+                print(f"Batch item record error: {item.url}: {e}")
+
+    def _notify(self, batch):
+        if self.on_update:
+            try:
+                self.on_update(batch)
+            except Exception as e:
+                print(f"Batch update error: {e}")
@@ -0,0 +1,276 @@
+"""
+بيانات وهمية لقياس الأداء دون اتصال بالإنترنت.
+
+- معلومات فيديو ونتائج بحث وقوائم تشغيل ثابتة (ما يعادل مخرجات --dump-json)
+- خادم HTTP محلي يقدم وسائط مصطنعة بحجم محدد مع دعم Range
+
+تُقرأ الإعدادات من متغيرات البيئة حتى تشترك فيها أداة yt-dlp الوهمية ووحدة
+yt_dlp الوهمية وسكربت القياس:
+    FAKE_MEDIA_URL        عنوان خادم الوسائط المحلي
+    FAKE_MEDIA_SIZE       حجم الصيغة الكاملة بالبايت
+    FAKE_YTDLP_LATENCY    زمن الاستخراج المصطنع بالثواني
+    FAKE_PLAYLIST_SIZE    عدد عناصر قوائم التشغيل
+    FAKE_PRIVATE_EVERY    جعل كل عنصر رقم N في القوائم فيديو خاصاً يفشل استخراجه (0 للتعطيل)
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+MEDIA_URL = os.environ.get('FAKE_MEDIA_URL', 'http://127.0.0.1:8799')
+MEDIA_SIZE = int(os.environ.get('FAKE_MEDIA_SIZE', str(8 * 1024 * 1024)))
+LATENCY = float(os.environ.get('FAKE_YTDLP_LATENCY', '0.2'))
+PLAYLIST_SIZE = int(os.environ.get('FAKE_PLAYLIST_SIZE', '50'))
+PRIVATE_EVERY = int(os.environ.get('FAKE_PRIVATE_EVERY', '0'))
+
+VERSION = '2099.01.01-benchmark'
+DURATION = 600
+CHUNK_SIZE = 64 * 1024
+
+# (format_id, ext, vcodec, acodec, format_note, height, tbr, نسبة الحجم من الصيغة الكاملة)
+FORMATS = [
+    ('140', 'm4a', 'none', 'mp4a.40.2', 'medium', None, 128, 0.1),
+    ('251', 'webm', 'none', 'opus', 'medium', None, 160, 0.12),
+    ('134', 'mp4', 'avc1.4d401e', 'none', '360p', 360, 400, 0.3),
+    ('136', 'mp4', 'avc1.4d401f', 'none', '720p', 720, 1200, 0.8),
+    ('137', 'mp4', 'avc1.640028', 'none', '1080p', 1080, 2500, 1.6),
+    ('18', 'mp4', 'avc1.42001E', 'mp4a.40.2', '360p', 360, 500, 0.4),
+    ('22', 'mp4', 'avc1.64001F', 'mp4a.40.2', '720p', 720, 1300, 1.0),
+]
+
+YOUTUBE_ID = re.compile(r'(?:v=|youtu\.be/|shorts/)([0-9A-Za-z_-]{11})')
+
+
+def video_id_for(url):
+    match = YOUTUBE_ID.search(url)
+    if match:
+        return match.group(1)
+    return hashlib.sha1(url.encode('utf-8')).hexdigest()[:11]
+
+
+def video_url(video_id):
+    return f'https://www.youtube.com/watch?v={video_id}'
+
+
+class UnavailableVideo(Exception):
+    """فيديو خاص (رسالة الخطأ بنفس صيغة yt-dlp)"""
+
+
+def video_info(video_id):
+    """معلومات فيديو كاملة بنفس بنية مخرجات yt-dlp --dump-json"""
+    if video_id.startswith('xpriv'):
+        raise UnavailableVideo(f'ERROR: [youtube] {video_id}: Private video. Sign in if you\'ve been granted access')
+    formats = []
+    for format_id, ext, vcodec, acodec, note, height, tbr, ratio in FORMATS:
+        size = int(MEDIA_SIZE * ratio)
+        formats.append({
+            'format_id': format_id,
+            'ext': ext,
+            'vcodec': vcodec,
+            'acodec': acodec,
+            'format_note': note,
+            'height': height,
+            'resolution': f'{height}p' if height else 'audio only',
+            'fps': 30 if height else None,
+            'abr': tbr if vcodec == 'none' else None,
+            'tbr': tbr,
+            'filesize': size,
+            'protocol': 'https',
+            'url': f'{MEDIA_URL}/media/{video_id}/{format_id}?size={size}',
+        })
+    best = formats[-1]
+    return {
+        'id': video_id,
+        'title': f'Benchmark video {video_id}',
+        'duration': DURATION,
+        'thumbnail': f'{MEDIA_URL}/thumbnail/{video_id}.jpg',
+        'uploader': 'benchmark',
+        'webpage_url': video_url(video_id),
+        'original_url': video_url(video_id),
+        'extractor': 'youtube',
+        'extractor_key': 'Youtube',
+        '_type': 'video',
+        'formats': formats,
+        'format_id': best['format_id'],
+        'ext': best['ext'],
+        'subtitles': {'en': subtitle_tracks(video_id, 'en', 'English')},
+        'automatic_captions': {'ar': subtitle_tracks(video_id, 'ar', 'Arabic')},
+    }
+
+
+def subtitle_tracks(video_id, lang_code, name):
+    return [{'ext': ext, 'url': f'{MEDIA_URL}/subtitles/{video_id}.{lang_code}.{ext}', 'name': name}
+            for ext in ('json3', 'srt', 'vtt')]
+
+
+def subtitle_text(video_id, lang_code, ext):
+    """ملف ترجمة قصير بصيغة srt أو vtt"""
+    cue = f'Benchmark subtitle {video_id} ({lang_code})'
+    if ext == 'srt':
+        return f'1\n00:00:00,000 --> 00:00:05,000\n{cue}\n'
+    return f'WEBVTT\n\n00:00:00.000 --> 00:00:05.000\n{cue}\n'
+
+
+def flat_entries(url, items=None):
+    """
+    عناصر بحث (ytsearchN:query) أو قائمة تشغيل دون تفاصيل (--flat-playlist)،
+    مع نطاق اختياري بصيغة --playlist-items (start:end يبدأ من 1).
+    """
+    search = re.match(r'ytsearch(\d*):(.*)', url)
+    if search:
+        count = int(search.group(1) or 1)
+        prefix = 's' + hashlib.sha1(search.group(2).encode('utf-8')).hexdigest()[:4]
+    else:
+        count = PLAYLIST_SIZE
+        prefix = 'p' + hashlib.sha1(url.encode('utf-8')).hexdigest()[:4]
+    first, last = 1, count
+    if items:
+        start, _, end = items.partition(':')
+        first, last = int(start or 1), min(count, int(end) if end else count)
+    entries = []
+    for index in range(first - 1, last):
+        video_id = f'{prefix}{index:06d}'
+        if PRIVATE_EVERY and index % PRIVATE_EVERY == PRIVATE_EVERY - 1:
+            video_id = f'xpriv{index:06d}'
+        entries.append({
+            '_type': 'url',
+            'ie_key': 'Youtube',
+            'id': video_id,
+            'url': video_url(video_id),
+            'title': f'Benchmark video {video_id}',
+            'duration': DURATION,
+            'uploader': 'benchmark',
+            'view_count': 1000 + index,
+            'playlist_title': f'Benchmark playlist {prefix}',
+            'playlist_count': count,
+            'playlist_index': index + 1,
+            'thumbnails': [{'url': f'{MEDIA_URL}/thumbnail/{video_id}.jpg'}],
+        })
+    return entries
+
+
+def is_flat_source(url):
+    return url.startswith('ytsearch') or 'list=' in url
+
+
+def simulate_latency():
+    if LATENCY > 0:
+        time.sleep(LATENCY)
+
+
+def select_format(info, spec):
+    """اختيار مبسط للصيغة: معرف مباشر أو best/bestaudio/bestvideo مع بدائل /"""
+    formats = info.get('formats') or []
+    by_id = {f['format_id']: f for f in formats}
+    for alternative in (spec or 'best').split('/'):
+        # في الصيغ المدمجة (137+140) تُحمّل الأولى فقط
+        name = re.sub(r'\[.*?\]', '', alternative.split('+')[0]).strip()
+        if name in by_id:
+            return by_id[name]
+        if name in ('best', 'b', 'bv*+ba', 'worst'):
+            combined = [f for f in formats if f['vcodec'] != 'none' and f['acodec'] != 'none']
+            if combined:
+                return combined[0] if name == 'worst' else combined[-1]
+        if name in ('bestaudio', 'ba'):
+            audio = [f for f in formats if f['vcodec'] == 'none']
+            if audio:
+                return audio[-1]
+        if name in ('bestvideo', 'bv'):
+            video = [f for f in formats if f['acodec'] == 'none' and f['vcodec'] != 'none']
+            if video:
+                return video[-1]
+    return formats[-1] if formats else None
+
+
+def stream_format(video_format, on_chunk):
+    """تنزيل صيغة من خادم الوسائط المحلي وتمرير أجزائها إلى on_chunk"""
+    with urllib.request.urlopen(video_format['url']) as response:
+        while True:
+            chunk = response.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            on_chunk(chunk)
+
+
+def _pattern(video_id, format_id):
+    seed = hashlib.sha256(f'{video_id}/{format_id}'.encode('utf-8')).digest()
+    return (seed * (CHUNK_SIZE // len(seed)))[:CHUNK_SIZE]
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    """يقدم /media/<video_id>/<format_id>?size=N ببيانات ثابتة مشتقة من المعرفين"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        match = re.match(r'/media/([^/]+)/([^/]+)$', parts.path)
+        if not match:
+            body = b'\xff\xd8\xff' + b'\0' * 1024 if parts.path.startswith('/thumbnail/') else b'WEBVTT\n'
+            self._respond(200, body)
+            return
+        size = int(parse_qs(parts.query).get('size', [MEDIA_SIZE])[0])
+        start, end = 0, size - 1
+        status = 200
+        byte_range = re.match(r'bytes=(\d*)-(\d*)$', self.headers.get('Range', ''))
+        if byte_range and (byte_range.group(1) or byte_range.group(2)):
+            if byte_range.group(1):
+                start = int(byte_range.group(1))
+                end = min(int(byte_range.group(2)), size - 1) if byte_range.group(2) else size - 1
+            else:
+                start = max(0, size - int(byte_range.group(2)))
+            status = 206
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.end_headers()
+
+        pattern = _pattern(*match.groups())
+        position = start
+        try:
+            while position <= end:
+                offset = position % CHUNK_SIZE
+                chunk = pattern[offset:offset + min(CHUNK_SIZE - offset, end - position + 1)]
+                self.wfile.write(chunk)
+                position += len(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _respond(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_media_server(host='127.0.0.1', port=0):
+    """تشغيل خادم الوسائط في thread خلفي وإرجاع (الخادم، العنوان)"""
+    server = ThreadingHTTPServer((host, port), MediaHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://{host}:{server.server_address[1]}'
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='خادم وسائط مصطنعة لقياس الأداء')
+    parser.add_argument('--port', type=int, default=8799)
+    options = parser.parse_args()
+    server, url = start_media_server(port=options.port)
+    print(f'Serving synthetic media on {url}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+أداة yt-dlp وهمية لقياس الأداء دون اتصال بالإنترنت.
+
+تدعم الخيارات التي يستخدمها التطبيق: --version و --dump-json (مع --flat-playlist)
+و --print و -f و -o (ملف أو - للبث) و --load-info-json وقالب التقدم والترجمات
+(--skip-download مع --write-subs). بقية الخيارات (مثل -x و --external-downloader)
+تُقبل وتُتجاهل. تُستخدم عبر:
+    YT_DLP_BINARY=benchmarks/fake_yt_dlp.py EXTRACTION_MODE=subprocess
+"""
+
+import json
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_media
+
+# الخيارات التي تأخذ قيمة (تُتجاهل قيمتها إن لم تكن مستخدمة)
+VALUE_OPTIONS = {
+    '-f', '--format', '-o', '--output', '--load-info-json', '--print', '--progress-template',
+    '--audio-format', '--audio-quality', '--external-downloader', '--external-downloader-args',
+    '--download-sections', '--sub-lang', '--sub-langs', '--sub-format', '--convert-subs', '-P',
+    '--paths', '--playlist-items', '-I', '--retries', '--fragment-retries', '--concurrent-fragments',
+    '-N', '--limit-rate', '-r', '--proxy', '--user-agent', '--referer', '--cookies', '--ffmpeg-location',
+}
+
+
+def parse_args(argv):
+    options, flags, urls = {}, set(), []
+    prints = []
+    args = iter(argv)
+    for arg in args:
+        if arg in VALUE_OPTIONS:
+            value = next(args, '')
+            if arg == '--print':
+                prints.append(value)
+            else:
+                options[arg] = value
+        elif arg.startswith('-') and arg != '-':
+            flags.add(arg)
+        else:
+            urls.append(arg)
+    return options, flags, urls, prints
+
+
+def render(template, values):
+    """تطبيق قالب yt-dlp بسيط مثل %(title)s [%(id)s].%(ext)s"""
+    def replace(match):
+        value = values
+        for part in match.group(1).split('.'):
+            value = value.get(part) if isinstance(value, dict) else None
+        return 'NA' if value is None else str(value)
+    return re.sub(r'%\(([^)]+)\)s', replace, template)
+
+
+def load_info(options, urls):
+    if '--load-info-json' in options:
+        with open(options['--load-info-json'], encoding='utf-8') as f:
+            return json.load(f)
+    fake_media.simulate_latency()
+    return fake_media.video_info(fake_media.video_id_for(urls[0]))
+
+
+def write_subtitles(info, options, flags):
+    """كتابة ملفات الترجمة المطلوبة بجوار مسار الإخراج (<الاسم>.<اللغة>.<الصيغة>)"""
+    sections = [('subtitles', '--write-subs'), ('automatic_captions', '--write-auto-subs')]
+    available = {}
+    for section, flag in reversed(sections):
+        if flag in flags:
+            available.update(info.get(section) or {})
+    pattern = options.get('--sub-langs') or options.get('--sub-lang') or 'en'
+    sub_format = options.get('--sub-format') or 'vtt'
+    base = render(options.get('-o') or '%(title)s [%(id)s].%(ext)s', dict(info, ext=''))
+    os.makedirs(os.path.dirname(base) or '.', exist_ok=True)
+    for lang_code in available:
+        if any(re.fullmatch(lang, lang_code) for lang in pattern.split(',')):
+            with open(f'{base}{lang_code}.{sub_format}', 'w', encoding='utf-8') as f:
+                f.write(fake_media.subtitle_text(info['id'], lang_code, sub_format))
+
+
+def main(argv):
+    options, flags, urls, prints = parse_args(argv)
+    if '--version' in flags:
+        print(fake_media.VERSION)
+        return 0
+    if not urls and '--load-info-json' not in options:
+        print('ERROR: You must provide at least one URL.', file=sys.stderr)
+        return 2
+
+    if '--dump-json' in flags or '-j' in flags:
+        fake_media.simulate_latency()
+        if '--flat-playlist' in flags and fake_media.is_flat_source(urls[0]):
+            items = options.get('--playlist-items') or options.get('-I')
+            for entry in fake_media.flat_entries(urls[0], items):
+                print(json.dumps(entry), flush=True)
+        else:
+            print(json.dumps(fake_media.video_info(fake_media.video_id_for(urls[0]))))
+        return 0
+
+    info = load_info(options, urls)
+    if '--skip-download' in flags:
+        if '--write-subs' in flags or '--write-auto-subs' in flags:
+            write_subtitles(info, options, flags)
+        return 0
+    video_format = fake_media.select_format(info, options.get('-f') or options.get('--format'))
+    values = dict(info, **video_format)
+
+    output = options.get('-o') or options.get('--output')
+    simulate = output is None or (prints and '--no-simulate' not in flags)
+    if simulate:
+        for template in prints:
+            print(render(template.split(':', 1)[1] if re.match(r'\w+:', template) else template, values))
+        return 0
+
+    if output == '-':
+        out = sys.stdout.buffer
+        fake_media.stream_format(video_format, out.write)
+        out.flush()
+        return 0
+
+    filepath = render(output, values)
+    os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+    progress_template = options.get('--progress-template', '')
+    progress_template = progress_template.split(':', 1)[1] if progress_template.startswith('download:') else ''
+    total = video_format.get('filesize')
+    downloaded = [0]
+
+    with open(filepath, 'wb') as f:
+        def write(chunk):
+            f.write(chunk)
+            downloaded[0] += len(chunk)
+            if progress_template:
+                print(render(progress_template, {'progress': {
+                    'downloaded_bytes': downloaded[0], 'total_bytes': total, 'total_bytes_estimate': None}}),
+                    flush=True)
+        fake_media.stream_format(video_format, write)
+
+    for template in prints:
+        if template.startswith('after_move:'):
+            print(render(template.split(':', 1)[1], dict(values, filepath=filepath)))
+    return 0
+
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main(sys.argv[1:]))
+    except fake_media.UnavailableVideo as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    except BrokenPipeError:
+        sys.exit(1)
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+قياس أداء التطبيق وتحمّله دون اتصال بالإنترنت.
+
+يشغّل خادم وسائط محلياً وخادم التطبيق (Flask أو ASGI) بأداة yt-dlp وهمية، ثم ينفذ
+سيناريوهات الحمل ويطبع النتائج بصيغة JSON لمقارنتها بين الإصدارات:
+
+- info:     عدد طلبات /get_video_info في الثانية وزمن الاستجابة
+- download: معدل نقل /download ووقت وصول أول بايت
+- streams:  الذاكرة وعدد الـ threads مع عدد كبير من التحميلات البطيئة المتزامنة
+- batch:    زمن اكتمال /batch_download
+
+مثال:
+    python benchmarks/run.py --server asgi --mode subprocess --output results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+
+import fake_media
+
+SCENARIOS = ('info', 'download', 'streams', 'batch')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentiles(values):
+    """p50 و p95 و p99 بالملي ثانية"""
+    if not values:
+        return None
+    values = sorted(values)
+
+    def pick(p):
+        return round(values[min(len(values) - 1, int(len(values) * p))] * 1000, 1)
+    return {'p50': pick(0.5), 'p95': pick(0.95), 'p99': pick(0.99),
+            'mean': round(statistics.mean(values) * 1000, 1)}
+
+
+def process_memory(pid):
+    """ذاكرة الخادم (RSS) وعدد الـ threads والعمليات الفرعية، من /proc (لينكس فقط)"""
+    def read_status(process_id):
+        fields = {}
+        with open(f'/proc/{process_id}/status') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                fields[key] = value.strip()
+        return fields
+
+    try:
+        status = read_status(pid)
+    except OSError:
+        return None
+    children = []
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                child = read_status(entry)
+            except OSError:
+                continue
+            if child.get('PPid') == str(pid):
+                children.append(int(child.get('VmRSS', '0 kB').split()[0]))
+    return {'rss_kb': int(status.get('VmRSS', '0 kB').split()[0]), 'threads': int(status.get('Threads', 0)),
+            'children': len(children), 'children_rss_kb': sum(children)}
+
+
+class AppServer:
+    """خادم التطبيق في عملية منفصلة داخل مجلد عمل مؤقت"""
+
+    def __init__(self, server, mode, env, log_path=None):
+        self.port = free_port()
+        self.base_url = f'http://127.0.0.1:{self.port}'
+        self.workdir = tempfile.mkdtemp(prefix='yt-bench-')
+        python_path = [REPO_DIR]
+        if mode == 'inprocess':
+            python_path.insert(0, os.path.join(BENCHMARKS_DIR, 'stub'))
+        env = dict(os.environ, **env, EXTRACTION_MODE=mode,
+                   YT_DLP_BINARY=os.path.join(BENCHMARKS_DIR, 'fake_yt_dlp.py'),
+                   PYTHONPATH=os.pathsep.join(python_path))
+        if server == 'asgi':
+            command = [sys.executable, '-m', 'uvicorn', 'asgi:application', '--port', str(self.port),
+                       '--log-level', 'warning']
+        else:
+            command = [sys.executable, '-c',
+                       f'from app import app; app.run(port={self.port}, threaded=True, debug=False)']
+        self.log = open(log_path, 'w', encoding='utf-8') if log_path else subprocess.DEVNULL
+        self.process = subprocess.Popen(command, cwd=self.workdir, env=env,
+                                        stdout=self.log, stderr=self.log)
+
+    def wait_ready(self, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError('app server exited during startup')
+            try:
+                requests.get(self.base_url + '/cache_stats', timeout=1)
+                return
+            except requests.RequestException:
+                time.sleep(0.2)
+        raise RuntimeError('app server did not start')
+
+    def memory(self):
+        return process_memory(self.process.pid)
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        if self.log is not subprocess.DEVNULL:
+            self.log.close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def run_concurrently(count, concurrency, task):
+    """تشغيل task(i) count مرة بتزامن محدد، وإرجاع (النتائج، الأخطاء، المدة)"""
+    results, errors = [], []
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(task, i) for i in range(count)]:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                errors.append(str(e))
+    return results, errors, time.monotonic() - started
+
+
+def scenario_info(base_url, options):
+    """طلبات معلومات على عدد محدود من الفيديوهات (مزيج من الاستخراج والذاكرة المؤقتة)"""
+    session = requests.Session()
+
+    def request_info(i):
+        url = fake_media.video_url(f'info{i % options.videos:07d}')
+        started = time.monotonic()
+        response = session.post(base_url + '/get_video_info', json={'url': url}, timeout=60)
+        response.raise_for_status()
+        return time.monotonic() - started
+
+    latencies, errors, elapsed = run_concurrently(options.requests, options.concurrency, request_info)
+    return {'requests': options.requests, 'distinct_videos': options.videos, 'concurrency': options.concurrency,
+            'errors': len(errors), 'seconds': round(elapsed, 3), 'rps': round(len(latencies) / elapsed, 1),
+            'latency_ms': percentiles(latencies), 'first_error': errors[0] if errors else None}
+
+
+def scenario_download(base_url, options):
+    """تحميلات كاملة لفيديوهات مختلفة (كل تحميل يشغّل عملية yt-dlp)"""
+    def download(i):
+        url = fake_media.video_url(f'down{i:07d}')
+        started = time.monotonic()
+        with requests.get(base_url + '/download', params={'url': url, 'itag': '22', 'title': f'video{i}'},
+                          stream=True, timeout=120) as response:
+            response.raise_for_status()
+            first_byte = None
+            size = 0
+            for chunk in response.iter_content(64 * 1024):
+                if first_byte is None:
+                    first_byte = time.monotonic() - started
+                size += len(chunk)
+        return size, first_byte, time.monotonic() - started
+
+    results, errors, elapsed = run_concurrently(options.downloads, options.concurrency, download)
+    total_bytes = sum(size for size, _, _ in results)
+    return {'downloads': options.downloads, 'concurrency': options.concurrency, 'errors': len(errors),
+            'bytes': total_bytes, 'seconds': round(elapsed, 3),
+            'throughput_mb_s': round(total_bytes / elapsed / 1024 ** 2, 1),
+            'ttfb_ms': percentiles([first_byte for _, first_byte, _ in results if first_byte is not None]),
+            'duration_ms': percentiles([duration for _, _, duration in results]),
+            'first_error': errors[0] if errors else None}
+
+
+def scenario_streams(base_url, options, server):
+    """تحميلات بطيئة متزامنة تبقى مفتوحة، مع قياس ذاكرة الخادم أثناءها"""
+    stop = threading.Event()
+    peak = {}
+
+    def sample():
+        while not stop.wait(0.5):
+            memory = server.memory()
+            if memory:
+                for key, value in memory.items():
+                    peak[key] = max(peak.get(key, 0), value)
+
+    def slow_stream(i):
+        url = fake_media.video_url(f'strm{i:07d}')
+        received = 0
+        deadline = None
+        with requests.get(base_url + '/download', params={'url': url, 'itag': '22', 'title': f'stream{i}'},
+                          stream=True, timeout=120) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(16 * 1024):
+                # المدة تُحتسب من أول بايت حتى لا يدخل فيها زمن تشغيل yt-dlp
+                deadline = deadline or time.monotonic() + options.stream_seconds
+                received += len(chunk)
+                if time.monotonic() >= deadline:
+                    break
+                time.sleep(len(chunk) / options.stream_rate)
+        return received
+
+    baseline = server.memory()
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    received, errors, elapsed = run_concurrently(options.streams, options.streams, slow_stream)
+    stop.set()
+    sampler.join()
+    result = {'streams': options.streams, 'errors': len(errors), 'seconds': round(elapsed, 3),
+              'bytes': sum(received), 'baseline': baseline, 'peak': peak or None,
+              'first_error': errors[0] if errors else None}
+    if baseline and peak:
+        result['rss_per_stream_kb'] = round((peak['rss_kb'] - baseline['rss_kb']) / max(1, options.streams), 1)
+    return result
+
+
+def scenario_batch(base_url, options):
+    """زمن اكتمال دفعة تحميل كاملة حتى آخر عنصر"""
+    urls = [fake_media.video_url(f'btch{i:07d}') for i in range(options.batch_size)]
+    started = time.monotonic()
+    response = requests.post(base_url + '/batch_download', json={'urls': urls, 'format': '18',
+                                                                 'concurrency': options.concurrency}, timeout=30)
+    response.raise_for_status()
+    batch_id = response.json()['batch_id']
+    while True:
+        status = requests.get(f'{base_url}/batch_status/{batch_id}', timeout=30).json()
+        if status['status'] not in ('downloading', 'cancelling'):
+            break
+        if time.monotonic() - started > options.batch_timeout:
+            requests.post(f'{base_url}/batch_cancel/{batch_id}', timeout=30)
+            status['status'] = 'timeout'
+            break
+        time.sleep(0.1)
+    elapsed = time.monotonic() - started
+    return {'items': options.batch_size, 'concurrency': options.concurrency, 'status': status['status'],
+            'counts': status.get('counts'), 'seconds': round(elapsed, 3),
+            'items_per_second': round(options.batch_size / elapsed, 2),
+            'bytes': status.get('downloaded_bytes')}
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='قياس أداء التطبيق دون اتصال')
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS,
+                        help='السيناريو المطلوب (يمكن تكراره، الافتراضي: الكل)')
+    parser.add_argument('--server', choices=('flask', 'asgi'), default='flask')
+    parser.add_argument('--mode', choices=('subprocess', 'inprocess'), default='subprocess')
+    parser.add_argument('--latency', type=float, default=0.2, help='زمن الاستخراج المصطنع بالثواني')
+    parser.add_argument('--media-size', type=int, default=8 * 1024 * 1024, help='حجم الصيغة الكاملة بالبايت')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--videos', type=int, default=20, help='عدد الفيديوهات المختلفة في سيناريو info')
+    parser.add_argument('--downloads', type=int, default=16)
+    parser.add_argument('--streams', type=int, default=32)
+    parser.add_argument('--stream-seconds', type=float, default=5.0)
+    parser.add_argument('--stream-rate', type=float, default=256 * 1024, help='بايت/ثانية لكل تحميل بطيء')
+    parser.add_argument('--batch-size', type=int, default=10)
+    parser.add_argument('--batch-timeout', type=float, default=300)
+    parser.add_argument('--max-media-processes', type=int, default=64)
+    parser.add_argument('--output', help='ملف حفظ النتائج (الافتراضي: الطباعة)')
+    parser.add_argument('--server-log', help='ملف لحفظ مخرجات خادم التطبيق')
+    options = parser.parse_args()
+
+    media_server, media_url = fake_media.start_media_server()
+    env = {
+        'FAKE_MEDIA_URL': media_url,
+        'FAKE_MEDIA_SIZE': str(options.media_size),
+        'FAKE_YTDLP_LATENCY': str(options.latency),
+        'MAX_MEDIA_PROCESSES': str(options.max_media_processes),
+        'MEDIA_QUEUE_SIZE': str(options.streams * 2),
+        'MEDIA_QUEUE_TIMEOUT': '60',
+    }
+    server = AppServer(options.server, options.mode, env, options.server_log)
+    results = {}
+    try:
+        server.wait_ready()
+        for name in options.scenario or SCENARIOS:
+            print(f'Running {name} scenario...', file=sys.stderr)
+            if name == 'info':
+                results[name] = scenario_info(server.base_url, options)
+            elif name == 'download':
+                results[name] = scenario_download(server.base_url, options)
+            elif name == 'streams':
+                results[name] = scenario_streams(server.base_url, options, server)
+            elif name == 'batch':
+                results[name] = scenario_batch(server.base_url, options)
+    finally:
+        server.stop()
+        media_server.shutdown()
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'server': options.server,
+            'extraction_mode': options.mode,
+            'latency': options.latency,
+            'media_size': options.media_size,
+        },
+        'scenarios': results,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if options.output:
+        with open(options.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
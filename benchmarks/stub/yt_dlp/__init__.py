@@ -0,0 +1,75 @@
+"""
+وحدة yt_dlp وهمية لقياس أداء وضع الاستخراج داخل العملية (inprocess) دون اتصال.
+
+تُفعَّل بإضافة مجلد benchmarks/stub إلى بداية PYTHONPATH، وتوفر من واجهة YoutubeDL
+ما يستخدمه extractor.InProcessEngine فقط.
+"""
+
+import copy
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import fake_media
+
+from . import utils, version
+
+
+class YoutubeDL:
+    def __init__(self, params=None):
+        self.params = dict(params or {})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        pass
+
+    def get_info_extractor(self, ie_key):
+        return None
+
+    def extract_info(self, url, download=True, process=True):
+        fake_media.simulate_latency()
+        if self.params.get('extract_flat') and fake_media.is_flat_source(url):
+            entries = fake_media.flat_entries(url, self.params.get('playlist_items'))
+            if not process:
+                entries = iter(entries)
+            return {'_type': 'playlist', 'id': url, 'title': url, 'entries': entries}
+        try:
+            info = fake_media.video_info(fake_media.video_id_for(url))
+        except fake_media.UnavailableVideo as e:
+            raise utils.DownloadError(str(e)) from e
+        return self.process_ie_result(info, download=download)
+
+    def process_ie_result(self, info, download=True):
+        video_format = fake_media.select_format(info, self.params.get('format'))
+        info = dict(info, format_id=video_format['format_id'], ext=video_format['ext'])
+        if not download or self.params.get('skip_download'):
+            return info
+
+        values = dict(info, **video_format)
+        filepath = self.params['outtmpl'] % values
+        os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+        total = video_format.get('filesize')
+        downloaded = [0]
+
+        with open(filepath, 'wb') as f:
+            def write(chunk):
+                f.write(chunk)
+                downloaded[0] += len(chunk)
+                self._report('downloading', downloaded[0], total)
+            fake_media.stream_format(video_format, write)
+        self._report('finished', downloaded[0], total)
+        return dict(info, requested_downloads=[{'filepath': filepath}], filepath=filepath)
+
+    def _report(self, status, downloaded, total):
+        for hook in self.params.get('progress_hooks') or []:
+            hook({'status': status, 'downloaded_bytes': downloaded, 'total_bytes': total})
+
+    @staticmethod
+    def sanitize_info(info, remove_private_keys=False):
+        return copy.deepcopy(info)
@@ -0,0 +1,10 @@
+class YoutubeDLError(Exception):
+    pass
+
+
+class DownloadError(YoutubeDLError):
+    pass
+
+
+class DownloadCancelled(YoutubeDLError):
+    pass
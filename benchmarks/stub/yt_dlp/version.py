@@ -0,0 +1 @@
+from fake_media import VERSION as __version__  # noqa: F401
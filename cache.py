@@ -0,0 +1,162 @@
+"""
+أدوات التخزين المؤقت في الذاكرة.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    ذاكرة مؤقتة محدودة الحجم (LRU) مع انتهاء صلاحية لكل عنصر (TTL).
+
+    آمنة للاستخدام من عدة threads، وتحتفظ بعدادات الإصابة والإخفاق والإخلاء.
+    """
+
+    def __init__(self, maxsize=256, ttl=1800, on_evict=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        evicted = None
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expires_at = item
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self.expirations += 1
+                evicted = (key, value)
+            self.misses += 1
+        self._notify_evicted([evicted] if evicted else [])
+        return default
+
+    def set(self, key, value, ttl=None):
+        evicted = []
+        with self._lock:
+            if key in self._data:
+                old_value, _ = self._data.pop(key)
+                if old_value is not value:
+                    evicted.append((key, old_value))
+            self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            while len(self._data) > self.maxsize:
+                old_key, (old_value, _) = self._data.popitem(last=False)
+                evicted.append((old_key, old_value))
+                self.evictions += 1
+        self._notify_evicted(evicted)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+        if item is None:
+            return default
+        self._notify_evicted([(key, item[0])])
+        return item[0]
+
+    def clear(self):
+        with self._lock:
+            items = [(key, value) for key, (value, _) in self._data.items()]
+            self._data.clear()
+        self._notify_evicted(items)
+
+    def expire(self):
+        """حذف العناصر المنتهية الصلاحية الآن (وإلا لا تُحذف إلا عند قراءتها أو إخلائها)"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [(key, value) for key, (value, expires_at) in self._data.items() if expires_at <= now]
+            for key, _ in expired:
+                del self._data[key]
+            self.expirations += len(expired)
+        self._notify_evicted(expired)
+
+    def _notify_evicted(self, items):
+        if self.on_evict:
+            for key, value in items:
+                self.on_evict(key, value)
+
+    def __contains__(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            return item is not None and item[1] > time.monotonic()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """عدادات الذاكرة المؤقتة"""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    دمج الطلبات المتزامنة المتطابقة: أول مستدعٍ ينفذ الدالة، ومن يصل بنفس المفتاح
+    أثناء التنفيذ ينتظر ويحصل على نفس النتيجة (أو نفس الخطأ).
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self):
+        with self._lock:
+            in_flight = len(self._calls)
+        return {'in_flight': in_flight, 'executed': self.executed, 'coalesced': self.coalesced}
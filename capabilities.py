@@ -0,0 +1,143 @@
+"""
+سجل قدرات البيئة.
+
+يفحص إصدار yt-dlp، ووجود ffmpeg و ffprobe والمرمزات التي يحتاجها التحويل، وقابلية
+الكتابة في مجلد التحميلات والمساحة الحرة فيه. يُحسب السجل عند بدء التشغيل ويُحدَّث في
+thread خلفي، فتُجاب فحوص الصحة والجاهزية من الذاكرة دون تشغيل أي عملية.
+
+دوال الفحص مستقلة عن التطبيق حتى يستخدمها test_connection.py أيضاً.
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+# المرمزات التي يستخدمها تحويل الصوت والقطع الدقيق
+REQUIRED_ENCODERS = ('libmp3lame', 'libopus', 'aac', 'flac', 'libx264')
+
+CHECK_TIMEOUT = 15
+
+
+def _run(command):
+    return subprocess.run(command, capture_output=True, text=True, check=True,
+                          encoding='utf-8', errors='replace', timeout=CHECK_TIMEOUT)
+
+
+def check_version(command):
+    """تشغيل أمر إصدار (مثل yt-dlp --version) وإرجاع أول سطر من مخرجاته"""
+    try:
+        output = _run(command).stdout.strip()
+    except FileNotFoundError:
+        return {'ok': False, 'error': 'not installed'}
+    except (subprocess.SubprocessError, OSError) as e:
+        return {'ok': False, 'error': str(e)}
+    return {'ok': True, 'version': output.splitlines()[0] if output else ''}
+
+
+def check_ffmpeg(ffmpeg='ffmpeg', ffprobe='ffprobe'):
+    """وجود ffmpeg و ffprobe والمرمزات المطلوبة المتاحة في ffmpeg"""
+    result = check_version([ffmpeg, '-hide_banner', '-version'])
+    result['ffprobe'] = check_version([ffprobe, '-hide_banner', '-version'])['ok']
+    encoders = set()
+    if result['ok']:
+        try:
+            # كل سطر بعد العنوان: "<الخصائص> <الاسم> <الوصف>"
+            for line in _run([ffmpeg, '-hide_banner', '-encoders']).stdout.splitlines():
+                parts = line.split()
+                if len(parts) > 1:
+                    encoders.add(parts[1])
+        except (subprocess.SubprocessError, OSError):
+            pass
+    result['encoders'] = {name: name in encoders for name in REQUIRED_ENCODERS}
+    return result
+
+
+def check_folder(folder, min_free_bytes=0):
+    """قابلية الكتابة في المجلد والمساحة الحرة فيه"""
+    try:
+        os.makedirs(folder, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=folder, prefix='.probe-'):
+            pass
+        writable = True
+    except OSError:
+        writable = False
+    try:
+        free_bytes = shutil.disk_usage(folder).free
+    except OSError:
+        free_bytes = None
+    return {
+        'ok': writable and free_bytes is not None and free_bytes >= min_free_bytes,
+        'writable': writable,
+        'free_bytes': free_bytes,
+        'min_free_bytes': min_free_bytes,
+    }
+
+
+def default_checks(yt_dlp='yt-dlp', ffmpeg='ffmpeg', ffprobe='ffprobe', folder='downloads', min_free_bytes=0):
+    """فحوص البيئة الأساسية: الاسم -> دالة تعيد قاموساً فيه ok"""
+    return {
+        'yt_dlp': lambda: check_version([yt_dlp, '--version']),
+        'ffmpeg': lambda: check_ffmpeg(ffmpeg, ffprobe),
+        'downloads': lambda: check_folder(folder, min_free_bytes),
+    }
+
+
+class CapabilityRegistry:
+    """
+    نتائج آخر تشغيل للفحوص، تُحدَّث كل interval ثانية في الخلفية.
+
+    required أسماء الفحوص التي يجب أن تنجح حتى يكون التطبيق جاهزاً لاستقبال الطلبات؛
+    بقية الفحوص (مثل ffmpeg) تعطل ميزات محددة فقط.
+    """
+
+    def __init__(self, checks, interval=300, required=()):
+        self.checks = checks
+        self.interval = interval
+        self.required = tuple(required)
+        self._results = {}
+        self._checked_at = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def refresh(self):
+        results = {}
+        for name, check in self.checks.items():
+            try:
+                results[name] = check()
+            except Exception as e:
+                results[name] = {'ok': False, 'error': str(e)}
+        with self._lock:
+            self._results = results
+            self._checked_at = time.time()
+        return results
+
+    def start(self):
+        """فحص أولي الآن ثم تحديث دوري في الخلفية"""
+        self.refresh()
+        if self.interval and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='capabilities', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.refresh()
+
+    def stop(self):
+        self._stop.set()
+
+    def get(self, name):
+        with self._lock:
+            return self._results.get(name) or {'ok': False, 'error': 'not checked'}
+
+    def ready(self):
+        """(جاهز؟، أسماء الفحوص المطلوبة التي فشلت)"""
+        failing = [name for name in self.required if not self.get(name).get('ok')]
+        return not failing, failing
+
+    def snapshot(self):
+        with self._lock:
+            return {'checked_at': self._checked_at, 'checks': dict(self._results)}
@@ -0,0 +1,398 @@
+"""
+محرك استخراج المعلومات عبر yt-dlp.
+
+توفر هذه الوحدة واجهة موحدة تستخدمها جميع المسارات في app.py:
+- InProcessEngine: يستخدم yt_dlp.YoutubeDL داخل العملية مع مجموعة نسخ جاهزة مسبقاً
+- SubprocessEngine: يشغّل أداة yt-dlp كعملية منفصلة (الوضع الاحتياطي)
+"""
+
+import copy
+import itertools
+import json
+import os
+import queue
+import re
+import subprocess
+import tempfile
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit, urlunsplit
+
+from tracing import span
+
+YOUTUBE_ID_PATTERN = re.compile(
+    r'(?:youtube(?:-nocookie)?\.com/(?:watch\?(?:.*&)?v=|embed/|shorts/|live/|v/|e/)|youtu\.be/)'
+    r'([0-9A-Za-z_-]{11})'
+)
+
+
+class ExtractionError(Exception):
+    """خطأ أثناء الاستخراج يحمل رسالة yt-dlp الأصلية في stderr"""
+
+    def __init__(self, message, stderr=''):
+        super().__init__(message)
+        self.stderr = stderr or message
+
+
+class DownloadCancelledError(ExtractionError):
+    """أُلغي التحميل بطلب من المستخدم"""
+
+
+def normalize_video_id(url):
+    """
+    مفتاح موحد للفيديو بغض النظر عن شكل الرابط.
+
+    روابط يوتيوب (watch, youtu.be, shorts, embed...) تتحول إلى youtube:<id>،
+    وبقية الروابط تُوحّد بإزالة الفراغات والجزء # وتصغير النطاق.
+    """
+    url = (url or '').strip()
+    match = YOUTUBE_ID_PATTERN.search(url)
+    if match:
+        return f'youtube:{match.group(1)}'
+    parts = urlsplit(url)
+    return 'url:' + urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, parts.query, ''))
+
+
+def normalize_playlist_id(url):
+    """مفتاح موحد لقائمة التشغيل (youtube-playlist:<list> أو الرابط الموحد)"""
+    url = (url or '').strip()
+    match = re.search(r'[?&]list=([0-9A-Za-z_-]+)', url)
+    if match and 'youtu' in url:
+        return f'youtube-playlist:{match.group(1)}'
+    return normalize_video_id(url)
+
+
+def get_startupinfo():
+    """إخفاء نافذة الطرفية عند تشغيل العمليات على ويندوز"""
+    startupinfo = None
+    if os.name == 'nt':
+        startupinfo = subprocess.STARTUPINFO()
+        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    return startupinfo
+
+
+class ExtractionEngine:
+    """الواجهة المشتركة بين محركات الاستخراج"""
+
+    mode = None
+
+    def __init__(self, binary='yt-dlp'):
+        self.binary = binary
+
+    def version(self):
+        raise NotImplementedError
+
+    def extract_info(self, url):
+        """استخراج معلومات فيديو واحد كاملة (ما يعادل --dump-json)"""
+        raise NotImplementedError
+
+    def extract_flat(self, url):
+        """استخراج عناصر قائمة تشغيل أو بحث دون تفاصيل (ما يعادل --flat-playlist)"""
+        return list(self.iter_flat(url))
+
+    def iter_flat(self, url, start=None, end=None):
+        """
+        مولد لعناصر قائمة التشغيل من start إلى end (ترقيم يبدأ من 1 كما في --playlist-items)،
+        يعيد كل عنصر فور قراءته دون انتظار تعداد القائمة كاملة.
+        """
+        raise NotImplementedError
+
+    def iter_search(self, query, limit):
+        """مولد لأول limit نتيجة بحث في يوتيوب، كل نتيجة فور استخراجها"""
+        return self.iter_flat(f'ytsearch{limit}:{query}')
+
+    def format_extension(self, url, format_spec, info=None):
+        """
+        معرفة امتداد الملف الناتج عن اختيار صيغة معينة (ما يعادل --print %(ext)s -f).
+        عند تمرير info (معلومات مستخرجة مسبقاً) تُختار الصيغة منها دون إعادة الاستخراج.
+        """
+        raise NotImplementedError
+
+    def download(self, url, format_spec, outtmpl, on_progress=None, cancel_event=None, info=None):
+        """
+        تحميل الفيديو إلى ملف وإرجاع مساره.
+
+        on_progress(downloaded_bytes, total_bytes) تُستدعى أثناء التحميل، وتعيين
+        cancel_event يوقف التحميل برفع DownloadCancelledError. عند تمرير info
+        (معلومات مستخرجة مسبقاً) لا يُعاد استخراج الفيديو.
+        """
+        raise NotImplementedError
+
+    def command(self, *args):
+        """بناء أمر yt-dlp لسطر الأوامر (يُستخدم لبث الوسائط)"""
+        return [self.binary, *args]
+
+    def run(self, args):
+        """تشغيل yt-dlp حتى النهاية وإرجاع النتيجة، مع تحويل الفشل إلى ExtractionError"""
+        try:
+            return subprocess.run(self.command(*args), capture_output=True, text=True, check=True,
+                                  encoding='utf-8', startupinfo=get_startupinfo())
+        except subprocess.CalledProcessError as e:
+            raise ExtractionError('yt-dlp failed', e.stderr) from e
+
+    def popen(self, args, **kwargs):
+        """تشغيل yt-dlp كعملية منفصلة مع إرجاع مخرجاتها كأنبوب"""
+        kwargs.setdefault('stdout', subprocess.PIPE)
+        kwargs.setdefault('stderr', subprocess.PIPE)
+        return subprocess.Popen(self.command(*args), startupinfo=get_startupinfo(), **kwargs)
+
+    def close(self):
+        pass
+
+
+class SubprocessEngine(ExtractionEngine):
+    """تشغيل yt-dlp عبر سطر الأوامر لكل طلب"""
+
+    mode = 'subprocess'
+
+    def version(self):
+        try:
+            return self.run(['--version']).stdout.strip()
+        except FileNotFoundError as e:
+            raise ExtractionError('yt-dlp غير مثبت') from e
+
+    def extract_info(self, url):
+        # مراحل منفصلة في التتبع: بدء العملية، ثم الاستخراج حتى خروجها، ثم تحليل JSON
+        with span('process_spawn'):
+            process = self.popen(['--dump-json', '--no-warnings', url], text=True, encoding='utf-8')
+        with span('extract'):
+            stdout, stderr = process.communicate()
+        if process.returncode != 0:
+            raise ExtractionError('yt-dlp failed', stderr)
+        with span('json_parse', bytes=len(stdout)):
+            return json.loads(stdout)
+
+    def iter_flat(self, url, start=None, end=None):
+        args = ['--dump-json', '--flat-playlist', '--no-warnings']
+        if start is not None:
+            args += ['--playlist-items', f'{start}:{end or ""}']
+        process = self.popen([*args, url], text=True, encoding='utf-8', errors='replace')
+        stderr_lines = []
+        stderr_reader = threading.Thread(target=lambda: stderr_lines.extend(process.stderr), daemon=True)
+        stderr_reader.start()
+        try:
+            # قراءة سطر بسطر: كل سطر عنصر JSON مستقل
+            for line in process.stdout:
+                line = line.strip()
+                if line:
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+            process.wait()
+            stderr_reader.join()
+            if process.returncode != 0:
+                raise ExtractionError('yt-dlp failed', ''.join(stderr_lines))
+        finally:
+            # إغلاق المولد مبكراً يوقف التعداد
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            process.stdout.close()
+
+    def format_extension(self, url, format_spec, info=None):
+        with self._info_source(url, info) as source:
+            result = self.run(['--print', '%(ext)s', '-f', format_spec, *source])
+        return result.stdout.strip()
+
+    @staticmethod
+    @contextmanager
+    def _info_source(url, info=None):
+        """وسائط المصدر: الرابط، أو ملف JSON مؤقت للمعلومات المستخرجة مسبقاً"""
+        if info is None:
+            yield [url]
+            return
+        info_file = tempfile.NamedTemporaryFile('w', suffix='.info.json', delete=False, encoding='utf-8')
+        try:
+            with info_file:
+                json.dump(info, info_file)
+            yield ['--load-info-json', info_file.name]
+        finally:
+            os.remove(info_file.name)
+
+    PROGRESS_TEMPLATE = ('download:PROGRESS %(progress.downloaded_bytes)s '
+                         '%(progress.total_bytes)s %(progress.total_bytes_estimate)s')
+
+    def download(self, url, format_spec, outtmpl, on_progress=None, cancel_event=None, info=None):
+        with self._info_source(url, info) as source:
+            args = ['-f', format_spec, '-o', outtmpl, '--newline', '--progress',
+                    '--progress-template', self.PROGRESS_TEMPLATE,
+                    '--no-simulate', '--print', 'after_move:filepath', '--no-warnings', *source]
+            process = self.popen(args, text=True, encoding='utf-8', errors='replace')
+            stderr_lines = []
+            stderr_reader = threading.Thread(target=lambda: stderr_lines.extend(process.stderr), daemon=True)
+            stderr_reader.start()
+            if cancel_event is not None:
+                threading.Thread(target=self._kill_on_cancel, args=(process, cancel_event), daemon=True).start()
+
+            filepath = None
+            for line in process.stdout:
+                line = line.strip()
+                if line.startswith('PROGRESS '):
+                    if on_progress:
+                        downloaded, total, estimate = (line.split() + ['NA'] * 3)[1:4]
+                        total = total if total != 'NA' else estimate
+                        on_progress(int(float(downloaded)) if downloaded != 'NA' else 0,
+                                    int(float(total)) if total != 'NA' else None)
+                elif line:
+                    filepath = line
+            process.wait()
+            stderr_reader.join()
+
+        if cancel_event is not None and cancel_event.is_set():
+            raise DownloadCancelledError('تم إلغاء التحميل')
+        if process.returncode != 0:
+            raise ExtractionError('yt-dlp failed', ''.join(stderr_lines))
+        return filepath
+
+    @staticmethod
+    def _kill_on_cancel(process, cancel_event):
+        while process.poll() is None:
+            if cancel_event.wait(0.5):
+                process.kill()
+                return
+
+
+class InProcessEngine(ExtractionEngine):
+    """
+    استخراج داخل العملية باستخدام yt_dlp.YoutubeDL.
+
+    نسخة YoutubeDL ليست آمنة للاستخدام من عدة threads في نفس الوقت، لذلك نحتفظ
+    بمجموعة نسخ جاهزة ويستعير كل طلب نسخة واحدة حصرياً ثم يعيدها.
+    """
+
+    mode = 'inprocess'
+
+    DEFAULT_OPTIONS = {
+        'quiet': True,
+        'no_warnings': True,
+        'noprogress': True,
+        'skip_download': True,
+    }
+
+    def __init__(self, binary='yt-dlp', pool_size=4, options=None):
+        super().__init__(binary)
+        import yt_dlp
+        self._yt_dlp = yt_dlp
+        self._options = dict(self.DEFAULT_OPTIONS, **(options or {}))
+        self._pool = queue.LifoQueue()
+        self.pool_size = pool_size
+        for _ in range(pool_size):
+            self._pool.put(self._create_instance())
+
+    def _create_instance(self):
+        ydl = self._yt_dlp.YoutubeDL(dict(self._options))
+        # تحميل مستخرج يوتيوب مسبقاً حتى لا يدفع أول طلب تكلفة الاستيراد
+        ydl.get_info_extractor('Youtube')
+        return ydl
+
+    @contextmanager
+    def _instance(self, **overrides):
+        with span('instance_wait'):
+            ydl = self._pool.get()
+        saved = {key: ydl.params.get(key) for key in overrides}
+        ydl.params.update(overrides)
+        try:
+            yield ydl
+        finally:
+            ydl.params.update(saved)
+            self._pool.put(ydl)
+
+    def version(self):
+        return self._yt_dlp.version.__version__
+
+    def _extract(self, url, **overrides):
+        with self._instance(**overrides) as ydl:
+            try:
+                with span('extract'):
+                    info = ydl.extract_info(url, download=False)
+            except self._yt_dlp.utils.YoutubeDLError as e:
+                raise ExtractionError('yt-dlp failed', str(e)) from e
+            with span('sanitize'):
+                return ydl.sanitize_info(info)
+
+    def extract_info(self, url):
+        return self._extract(url)
+
+    def iter_flat(self, url, start=None, end=None):
+        # process=False يعيد عناصر القائمة كمولد يجلب صفحاتها عند الحاجة، فيُعاد كل عنصر
+        # فور وصوله بدل انتظار النطاق كاملاً. المولد يستخدم نسخة YoutubeDL طوال عمره،
+        # لذلك تُنشأ له نسخة مستقلة بدل حجز نسخة من المجموعة حتى يُغلق
+        params = dict(self._options, extract_flat='in_playlist')
+        with self._yt_dlp.YoutubeDL(params) as ydl:
+            try:
+                info = ydl.extract_info(url, download=False, process=False)
+                if info.get('_type') != 'playlist':
+                    yield ydl.sanitize_info(ydl.process_ie_result(info, download=False))
+                    return
+                # playlist_items لا يُطبق دون process، فيُقتطع النطاق هنا (الترقيم يبدأ من 1)
+                first = (start or 1) - 1
+                entries = info.get('entries') or []
+                if hasattr(entries, 'getslice'):
+                    entries = entries.getslice(first, end)
+                else:
+                    entries = itertools.islice(entries, first, end)
+                for entry in entries:
+                    if entry:
+                        entry = ydl.sanitize_info(entry)
+                        entry.setdefault('playlist_title', info.get('title'))
+                        entry.setdefault('playlist_count', info.get('playlist_count'))
+                        yield entry
+            except self._yt_dlp.utils.YoutubeDLError as e:
+                raise ExtractionError('yt-dlp failed', str(e)) from e
+
+    def format_extension(self, url, format_spec, info=None):
+        if info is None:
+            info = self.extract_info(url)
+        # خيار format يُقرأ عند إنشاء YoutubeDL فقط، فتغييره في نسخة من المجموعة لا أثر له؛
+        # لذلك تُختار الصيغة من المعلومات المستخرجة بنسخة مستقلة دون تنزيل
+        params = dict(self._options, format=format_spec)
+        with self._yt_dlp.YoutubeDL(params) as ydl:
+            try:
+                return ydl.process_ie_result(copy.deepcopy(info), download=False).get('ext')
+            except self._yt_dlp.utils.YoutubeDLError as e:
+                raise ExtractionError('yt-dlp failed', str(e)) from e
+
+    def download(self, url, format_spec, outtmpl, on_progress=None, cancel_event=None, info=None):
+        utils = self._yt_dlp.utils
+
+        def progress_hook(status):
+            if cancel_event is not None and cancel_event.is_set():
+                raise utils.DownloadCancelled('cancelled')
+            if on_progress and status.get('status') in ('downloading', 'finished'):
+                on_progress(status.get('downloaded_bytes') or 0,
+                            status.get('total_bytes') or status.get('total_bytes_estimate'))
+
+        # نسخة مستقلة لكل تحميل لأن خيارات الإخراج تختلف من تحميل لآخر
+        params = dict(self._options, format=format_spec, outtmpl=outtmpl,
+                      skip_download=False, progress_hooks=[progress_hook])
+        with self._yt_dlp.YoutubeDL(params) as ydl:
+            try:
+                if info is not None:
+                    result = ydl.process_ie_result(copy.deepcopy(info), download=True)
+                else:
+                    result = ydl.extract_info(url, download=True)
+            except utils.YoutubeDLError as e:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise DownloadCancelledError('تم إلغاء التحميل') from e
+                raise ExtractionError('yt-dlp failed', str(e)) from e
+
+        downloads = result.get('requested_downloads') or [{}]
+        return downloads[0].get('filepath') or result.get('filepath')
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def create_engine(mode='inprocess', binary='yt-dlp', pool_size=4):
+    """إنشاء محرك الاستخراج حسب الإعداد، مع الرجوع لوضع العملية المنفصلة عند الحاجة"""
+    if mode == 'inprocess':
+        try:
+            return InProcessEngine(binary=binary, pool_size=pool_size)
+        except ImportError:
+            print("yt_dlp module not importable, falling back to subprocess engine")
+    return SubprocessEngine(binary=binary)
@@ -0,0 +1,229 @@
+"""
+فهرس صيغ الفيديو واختيار الصيغة في الخادم.
+
+- build_format_index: يحوّل صيغ yt-dlp مرة واحدة لكل فيديو إلى سجلات بحقول رقمية
+  (الارتفاع، الإطارات، معدل البت، الحجم) وعائلة الترميز، مرتبة من الأفضل
+- FormatIndex.select: اختيار صيغة بتعبير مختصر يشبه تعبيرات yt-dlp، مثل:
+    best[height<=720][vcodec=h264][filesize<200M]
+    bestaudio[acodec=opus]
+    best[height<=1080]/best          (بدائل بالترتيب)
+  best يشمل الصيغ المدمجة وأزواج (فيديو فقط + صوت فقط)، bestvideo الفيديو فقط،
+  bestaudio الصوت فقط، و worst و worstvideo و worstaudio بالترتيب المعاكس.
+"""
+
+import re
+from collections import namedtuple
+
+# بادئات ترميزات yt-dlp -> اسم العائلة
+CODEC_FAMILIES = (
+    ('avc', 'h264'), ('h264', 'h264'),
+    ('hvc1', 'h265'), ('hev1', 'h265'), ('h265', 'h265'), ('hevc', 'h265'),
+    ('vp09', 'vp9'), ('vp9', 'vp9'), ('vp8', 'vp8'),
+    ('av01', 'av1'), ('av1', 'av1'),
+    ('mp4a', 'aac'), ('aac', 'aac'),
+    ('opus', 'opus'), ('vorbis', 'vorbis'), ('mp3', 'mp3'), ('flac', 'flac'),
+    ('ac-3', 'ac3'), ('ec-3', 'eac3'),
+)
+
+# الحاوية الناتجة عن دمج الفيديو والصوت في yt-dlp
+MERGE_CONTAINERS = {('mp4', 'm4a'): 'mp4', ('webm', 'webm'): 'webm'}
+
+SIZE_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+
+# kind: av (فيديو + صوت) أو video أو audio. الحجم بالبايت، معدلات البت بالكيلوبت
+Format = namedtuple('Format', 'format_id kind ext note height fps tbr abr vcodec acodec size')
+
+# مرشح للاختيار: صيغة واحدة أو زوج صيغ (format_ids) بخصائص الناتج
+Candidate = namedtuple('Candidate', 'format_ids ext height fps tbr abr vcodec acodec size rank')
+
+Selection = namedtuple('Selection', 'format_ids format_spec ext size')
+
+NUMERIC_FIELDS = {'height', 'fps', 'tbr', 'abr', 'filesize'}
+TEXT_FIELDS = {'ext', 'vcodec', 'acodec'}
+
+SELECTOR_PATTERN = re.compile(r'(best|worst)(video|audio)?((?:\[[^\]]*\])*)')
+FILTER_PATTERN = re.compile(r'\[\s*(\w+)\s*(<=|>=|!=|<|>|=)\s*([^\]]+?)\s*\]')
+OPERATORS = {
+    '<': lambda a, b: a < b, '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b, '>=': lambda a, b: a >= b,
+    '=': lambda a, b: a == b, '!=': lambda a, b: a != b,
+}
+
+
+class SelectorError(ValueError):
+    """تعبير اختيار غير صالح"""
+
+
+def codec_family(codec):
+    if not codec or codec == 'none':
+        return None
+    codec = codec.lower()
+    for prefix, family in CODEC_FAMILIES:
+        if codec.startswith(prefix):
+            return family
+    return codec.split('.')[0]
+
+
+def _height(f):
+    if f.get('height'):
+        return int(f['height'])
+    # بعض المستخرجات لا تعطي height، فيُقرأ من الوصف (مثل 720p60) مرة واحدة عند بناء الفهرس
+    match = re.match(r'(\d+)p', f.get('format_note') or '') or re.search(r'x(\d+)', f.get('resolution') or '')
+    return int(match.group(1)) if match else None
+
+
+def _format_size(f, duration):
+    size = f.get('filesize') or f.get('filesize_approx')
+    if not size and duration and f.get('tbr'):
+        size = f['tbr'] * 1000 / 8 * duration
+    return int(size) if size else None
+
+
+def build_format_index(video_data):
+    """فهرس صيغ الفيديو من معلومات yt-dlp"""
+    duration = video_data.get('duration')
+    formats = []
+    for f in video_data.get('formats') or []:
+        has_video = f.get('vcodec') not in (None, 'none')
+        has_audio = f.get('acodec') not in (None, 'none')
+        if not has_video and not has_audio:
+            # صيغ الصور المصغرة (storyboards) وما شابهها
+            continue
+        formats.append(Format(
+            format_id=f['format_id'],
+            kind='av' if has_video and has_audio else 'video' if has_video else 'audio',
+            ext=f.get('ext'),
+            note=f.get('format_note') or f.get('resolution') or 'N/A',
+            height=_height(f) if has_video else None,
+            fps=f.get('fps') if has_video else None,
+            tbr=f.get('tbr'),
+            abr=f.get('abr') if has_audio else None,
+            vcodec=codec_family(f.get('vcodec')),
+            acodec=codec_family(f.get('acodec')),
+            size=_format_size(f, duration),
+        ))
+    return FormatIndex(formats)
+
+
+def _rank(fmt):
+    if fmt.kind == 'audio':
+        return (fmt.abr or fmt.tbr or 0,)
+    return (fmt.height or 0, fmt.fps or 0, fmt.tbr or 0)
+
+
+def _single(fmt):
+    return Candidate((fmt.format_id,), fmt.ext, fmt.height, fmt.fps, fmt.tbr, fmt.abr,
+                     fmt.vcodec, fmt.acodec, fmt.size, _rank(fmt))
+
+
+def _pair(video, audio):
+    size = video.size + audio.size if video.size and audio.size else None
+    tbr = (video.tbr or 0) + (audio.tbr or audio.abr or 0) or None
+    container = MERGE_CONTAINERS.get((video.ext, audio.ext))
+    # لنفس الفيديو يُفضل الصوت الذي يُدمج في نفس الحاوية على صوت أعلى جودة يحتاج mkv
+    return Candidate((video.format_id, audio.format_id), container or 'mkv',
+                     video.height, video.fps, tbr, audio.abr, video.vcodec, audio.acodec, size,
+                     _rank(video) + (container is not None,) + _rank(audio))
+
+
+def parse_size(value):
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)\s*([kmg]?)i?b?', value.strip().lower())
+    if not match:
+        raise SelectorError(f'invalid size: {value}')
+    return float(match.group(1)) * SIZE_UNITS[match.group(2)]
+
+
+def _parse_filter(field, op, value):
+    field = 'filesize' if field == 'size' else field
+    if field in NUMERIC_FIELDS:
+        number = parse_size(value) if field == 'filesize' else float(value.rstrip('p') if field == 'height' else value)
+        return field, op, number
+    if field in TEXT_FIELDS and op in ('=', '!='):
+        return field, op, value.lower() if field == 'ext' else codec_family(value)
+    raise SelectorError(f'unsupported filter: {field}{op}{value}')
+
+
+def parse_selector(selector):
+    """تحليل التعبير إلى بدائل [(best أو worst، النوع، [المرشحات])]"""
+    alternatives = []
+    for part in selector.split('/'):
+        match = SELECTOR_PATTERN.fullmatch(part.strip())
+        if not match:
+            raise SelectorError(f'invalid selector: {part}')
+        order, kind, filters = match.groups()
+        parsed = []
+        for raw in re.findall(r'\[[^\]]*\]', filters):
+            filter_match = FILTER_PATTERN.fullmatch(raw)
+            if not filter_match:
+                raise SelectorError(f'invalid filter: {raw}')
+            try:
+                parsed.append(_parse_filter(*filter_match.groups()))
+            except ValueError as e:
+                raise SelectorError(str(e)) from e
+        alternatives.append((order, kind, parsed))
+    return alternatives
+
+
+def _matches(candidate, filters):
+    for field, op, value in filters:
+        actual = getattr(candidate, 'size' if field == 'filesize' else field)
+        # الحقول غير المعروفة لا تطابق أي شرط (مثل yt-dlp بدون ?)
+        if actual is None or not OPERATORS[op](actual, value):
+            return False
+    return True
+
+
+class FormatIndex:
+    def __init__(self, formats):
+        self.formats = sorted(formats, key=_rank, reverse=True)
+        self.by_id = {fmt.format_id: fmt for fmt in self.formats}
+
+    def of_kind(self, kind):
+        return [fmt for fmt in self.formats if fmt.kind == kind]
+
+    def candidates(self, kind=None):
+        if kind == 'audio':
+            return [_single(fmt) for fmt in self.of_kind('audio')]
+        if kind == 'video':
+            return [_single(fmt) for fmt in self.of_kind('video')]
+        audio = self.of_kind('audio')
+        pairs = [_pair(video, a) for video in self.of_kind('video') for a in audio]
+        return [_single(fmt) for fmt in self.of_kind('av')] + pairs
+
+    def select(self, selector):
+        """أول بديل له صيغة مطابقة -> Selection، أو None إن لم تطابق أي صيغة"""
+        for order, kind, filters in parse_selector(selector):
+            matching = [c for c in self.candidates(kind) if _matches(c, filters)]
+            if not matching:
+                continue
+            # عند تساوي الجودة يُفضل الأصغر حجماً
+            if order == 'best':
+                chosen = max(matching, key=lambda c: (c.rank, -(c.size or 0)))
+            else:
+                chosen = min(matching, key=lambda c: (c.rank, c.size or 0))
+            return Selection(list(chosen.format_ids), '+'.join(chosen.format_ids), chosen.ext, chosen.size)
+        return None
+
+    def streams(self):
+        """الصيغ مقسمة إلى فئات ومرتبة من الأعلى، بالحقول المعروفة فقط"""
+        return {
+            'video_audio': [stream_summary(fmt) for fmt in self.of_kind('av')],
+            'video_only': [stream_summary(fmt) for fmt in self.of_kind('video')],
+            'audio_only': [stream_summary(fmt) for fmt in self.of_kind('audio')],
+        }
+
+
+def stream_summary(fmt):
+    summary = {
+        'itag': fmt.format_id,
+        'resolution': fmt.note,
+        'ext': fmt.ext,
+        'filesize': f'{fmt.size / 1024 / 1024:.2f} MB' if fmt.size else 'غير معروف',
+        'size': fmt.size,
+        'height': fmt.height,
+        'fps': fmt.fps,
+        'abr': fmt.abr,
+        'vcodec': fmt.vcodec,
+        'acodec': fmt.acodec,
+    }
+    return {key: value for key, value in summary.items() if value is not None}
@@ -0,0 +1,545 @@
+"""
+ذاكرة مؤقتة للوسائط على القرص، معنونة بالمحتوى.
+
+المفتاح مشتق من (معرف الفيديو، معرف الصيغة، خيارات المعالجة). أول طلب يبدأ عملية
+ملء واحدة تكتب البيانات إلى ملف .part بينما يقرأ منه العميل، والطلبات المتزامنة
+لنفس المفتاح تقرأ من نفس الملف أثناء كتابته. لا يصبح الملف متاحاً كملف مكتمل إلا
+بعد نجاح عملية الملء وإعادة تسميته، لذلك لا يُقدَّم ملف ناقص على أنه مكتمل أبداً.
+
+عمليات الملء القابلة للاستكمال (resumable) تُكمل الملف من آخر بايت مكتوب عند انقطاع
+المصدر، وتحفظ ما كُتب في ملف .partial عند الفشل أو انقطاع جميع القراء لتكمله عملية
+الملء التالية لنفس المفتاح بدل البدء من الصفر.
+
+open_stream تعمل بالـ threads (وضع Flask)، و open_stream_async على حلقة asyncio
+(وضع ASGI)، وكلاهما يشترك في نفس عمليات الملء الجارية.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def media_key(video_key, format_id, options=None):
+    """مفتاح ثابت للوسائط من الفيديو والصيغة وخيارات المعالجة"""
+    payload = json.dumps([video_key, format_id, options or {}], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class IncompleteMediaError(Exception):
+    """انتهى المصدر قبل الحجم المتوقع للملف"""
+
+
+class StalePartialError(Exception):
+    """الملف الجزئي المحفوظ لا يطابق المصدر الحالي فلا يمكن استكماله"""
+
+
+class CachedMedia:
+    """ملف مكتمل في الذاكرة المؤقتة"""
+
+    def __init__(self, path, meta):
+        self.path = path
+        self.meta = meta
+
+    @property
+    def size(self):
+        return self.meta.get('size', 0)
+
+
+class _Fill:
+    """عملية ملء جارية لمفتاح واحد"""
+
+    def __init__(self, part_path, data_path, resumable=False, size=None):
+        self.part_path = part_path
+        self.data_path = data_path
+        self.resumable = resumable
+        self.size = size
+        self.bytes_written = 0
+        self.done = False
+        self.error = None
+        self.readers = 0
+        self.abandoned = False
+        self.producer = None
+        self.condition = threading.Condition()
+        # يُضبط عند الإيقاف فينقطع انتظار إعادة المحاولة فوراً
+        self.stopped = threading.Event()
+        # دوال تُستدعى عند كل تقدم (لإيقاظ القراء على حلقة asyncio)
+        self.listeners = set()
+
+    def notify(self):
+        """إيقاظ القراء المنتظرين؛ يُستدعى مع الإمساك بـ condition"""
+        self.condition.notify_all()
+        for listener in list(self.listeners):
+            listener()
+
+    def abandon(self):
+        """إيقاف المنتج بعد انقطاع جميع القراء"""
+        self.abandoned = True
+        self.stopped.set()
+        cancel = getattr(self.producer, 'cancel', None)
+        if cancel is not None:
+            cancel()
+
+
+class MediaCache:
+    """
+    ذاكرة الوسائط على القرص مع حد أقصى للحجم (تُحذف الملفات الأقدم استخداماً أولاً).
+    retries: أقصى عدد لمحاولات استكمال عملية الملء الواحدة قبل اعتبارها فاشلة (تبقى البيانات
+    الجزئية لطلب لاحق)، وتتضاعف المهلة بينها بدءاً من retry_delay ثانية.
+    stale_part_age: عمر ملف .part (منذ آخر كتابة فيه) الذي يُعد بعده متروكاً من عملية توقفت.
+    read_executor: الـ executor لقراءة الملفات في المولدات غير المتزامنة (None: الافتراضي للحلقة).
+
+    الحجم الكلي وترتيب الاستخدام يُحفظان في الذاكرة: يُقرأ المجلد مرة واحدة عند البدء، ثم يُحدَّثان
+    عند كل ملء وقراءة وحذف. الملفات التي تضيفها عمليات أخرى تشترك في المجلد تدخل الفهرس عند أول قراءة لها.
+    """
+
+    def __init__(self, folder, max_bytes=10 * 1024 ** 3, chunk_size=64 * 1024, retries=3, retry_delay=1.0,
+                 stale_part_age=3600, read_executor=None):
+        self.folder = os.path.abspath(folder)
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.stale_part_age = stale_part_age
+        self.read_executor = read_executor
+        self._fills = {}
+        self._lock = threading.Lock()
+        # مسار الملف (.bin أو .partial) -> حجمه، من الأقدم استخداماً إلى الأحدث
+        self._index = OrderedDict()
+        self._index_lock = threading.Lock()
+        self._total = 0
+        self.hits = 0
+        self.misses = 0
+        self.fills = 0
+        self.attached = 0
+        self.resumes = 0
+        os.makedirs(self.folder, exist_ok=True)
+        self._scan()
+
+    def _path(self, key, suffix):
+        return os.path.join(self.folder, key[:2], key + suffix)
+
+    def _scan(self):
+        """بناء فهرس الملفات المكتملة والجزئية مرتبة بوقت آخر استخدام، وحذف ملفات .part المتروكة"""
+        entries = []
+        # ملفات .part من تشغيل سابق انقطع لا يمكن إكمالها (بخلاف ملفات .partial المحفوظة عمداً).
+        # المجلد مشترك بين العمليات (عمال gunicorn)، فلا يُحذف إلا ما لم يُكتب فيه منذ stale_part_age
+        # حتى لا تُحذف ملفات تملؤها عملية أخرى الآن
+        cutoff = time.time() - self.stale_part_age
+        for root, _, files in os.walk(self.folder):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if name.endswith('.part'):
+                        if os.path.getmtime(path) < cutoff:
+                            os.remove(path)
+                    elif name.endswith(('.bin', '.partial')):
+                        stat = os.stat(path)
+                        entries.append((stat.st_mtime, path, stat.st_size))
+                except OSError:
+                    pass
+        for _, path, size in sorted(entries):
+            self._track(path, size)
+
+    def _track(self, path, size):
+        """تسجيل الملف في الفهرس كأحدث ما استُخدم"""
+        with self._index_lock:
+            self._total += size - self._index.pop(path, 0)
+            self._index[path] = size
+
+    def _forget(self, path):
+        with self._index_lock:
+            self._total -= self._index.pop(path, 0)
+
+    def get(self, key):
+        """إرجاع الملف المكتمل إن وجد، مع التحقق من تطابق حجمه مع البيانات الوصفية"""
+        cached = self._lookup(key)
+        with self._lock:
+            if cached is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return cached
+
+    def _lookup(self, key):
+        data_path = self._path(key, '.bin')
+        try:
+            with open(self._path(key, '.json'), encoding='utf-8') as f:
+                meta = json.load(f)
+            if os.path.getsize(data_path) != meta.get('size'):
+                self._forget(data_path)
+                return None
+            # وقت التعديل يحفظ ترتيب الاستخدام لفحص المجلد عند البدء التالي
+            os.utime(data_path)
+        except (OSError, ValueError):
+            self._forget(data_path)
+            return None
+        self._track(data_path, meta['size'])
+        return CachedMedia(data_path, meta)
+
+    def is_filling(self, key):
+        with self._lock:
+            return key in self._fills
+
+    def open_stream(self, key, producer, meta=None, start=0, resumable=False, size=None):
+        """
+        فتح مولد يعيد بيانات الوسائط للمفتاح بدءاً من البايت start، ويعاد معه
+        ما إذا كانت عملية ملء جديدة قد بدأت.
+
+        إذا كان الملف مكتملاً يُقرأ من القرص، وإذا كانت هناك عملية ملء جارية يُقرأ
+        منها أثناء الكتابة، وإلا تبدأ عملية ملء جديدة بتشغيل producer() في thread
+        منفصل. producer() يعيد كائناً قابلاً للتكرار يرفع استثناء عند الفشل، ويمكن
+        أن يملك دالة cancel() تُستدعى عند انقطاع جميع القراء قبل الاكتمال.
+
+        resumable: يُستدعى producer(offset) ليعيد البيانات بدءاً من البايت offset، فيُستكمل
+        الملف بعد انقطاع المصدر (حتى retries مرة) وتُحفظ البيانات الجزئية لعملية الملء التالية. size هو الحجم
+        المتوقع إن كان معروفاً، فانتهاء المصدر قبله يُعد انقطاعاً لا اكتمالاً.
+        """
+        with self._lock:
+            fill = self._fills.get(key)
+            started = fill is None
+            if fill is None:
+                cached = self._lookup(key)
+                if cached is not None:
+                    return self._read_file(cached.path, start), False
+                self.fills += 1
+                fill = self._start_fill(key, producer, meta or {}, resumable, size)
+            else:
+                self.attached += 1
+            with fill.condition:
+                fill.readers += 1
+        return self._tail(fill, start), started
+
+    def fetch(self, key, producer, meta=None):
+        """
+        انتظار اكتمال الملف (موجود مسبقاً، أو من عملية ملء جارية أو جديدة) وإرجاعه
+        كـ CachedMedia، لمن يحتاج مسار الملف الكامل بدل بثه.
+        """
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+        chunks, _ = self.open_stream(key, producer, meta)
+        for _ in chunks:
+            pass
+        cached = self._lookup(key)
+        if cached is None:
+            raise OSError(f'media cache entry {key} disappeared after fill')
+        return cached
+
+    def open_stream_async(self, key, producer, meta=None, start=0, resumable=False, size=None):
+        """
+        مثل open_stream لكن المولد غير متزامن (async for) ويعمل على حلقة asyncio.
+
+        عملية الملء الجديدة تعمل كمهمة على نفس الحلقة، و producer() يعيد كائناً
+        قابلاً للتكرار غير المتزامن (مثل AsyncManagedProcess).
+        """
+        with self._lock:
+            fill = self._fills.get(key)
+            started = fill is None
+            if fill is None:
+                cached = self._lookup(key)
+                if cached is not None:
+                    return self._read_file_async(cached.path, start), False
+                self.fills += 1
+                fill = self._create_fill(key, resumable, size)
+                asyncio.ensure_future(self._run_fill_async(key, fill, producer, meta or {}))
+            else:
+                self.attached += 1
+            with fill.condition:
+                fill.readers += 1
+        return self._tail_async(fill, start), started
+
+    def _create_fill(self, key, resumable=False, size=None):
+        part_path = self._path(key, '.part')
+        os.makedirs(os.path.dirname(part_path), exist_ok=True)
+        fill = _Fill(part_path, self._path(key, '.bin'), resumable, size)
+        partial_path = self._path(key, '.partial')
+        if resumable and self._move(partial_path, part_path):
+            # استكمال ما حفظته عملية ملء سابقة انقطعت
+            self._forget(partial_path)
+            fill.bytes_written = os.path.getsize(part_path)
+        else:
+            # إنشاء الملف قبل تشغيل المنتج حتى يتمكن القراء من فتحه فوراً
+            open(part_path, 'wb').close()
+        self._fills[key] = fill
+        return fill
+
+    def _start_fill(self, key, producer, meta, resumable=False, size=None):
+        fill = self._create_fill(key, resumable, size)
+        thread = threading.Thread(target=self._run_fill, args=(key, fill, producer, meta), daemon=True)
+        thread.start()
+        return fill
+
+    def _run_fill(self, key, fill, producer, meta):
+        try:
+            failures = 0
+            while True:
+                try:
+                    fill.producer = producer(fill.bytes_written) if fill.resumable else producer()
+                    if fill.abandoned:
+                        fill.abandon()
+                    with open(fill.part_path, 'ab') as f:
+                        for chunk in fill.producer:
+                            self._write_chunk(fill, f, chunk)
+                    self._check_complete(fill)
+                    break
+                except Exception as e:
+                    failures += 1
+                    if not self._can_resume(fill, failures, e):
+                        raise
+                    if fill.stopped.wait(self._schedule_resume(fill, failures, e)):
+                        raise
+            self._commit_fill(key, fill, meta)
+        except BaseException as e:
+            self._fail_fill(key, fill, e)
+        finally:
+            self._end_fill(key, fill)
+
+    async def _run_fill_async(self, key, fill, producer, meta):
+        try:
+            failures = 0
+            while True:
+                try:
+                    # المنتج قد ينتظر مكاناً في limiter أو يستخرج الرابط من جديد، فلا يُستدعى على الحلقة
+                    if fill.resumable:
+                        fill.producer = await asyncio.to_thread(producer, fill.bytes_written)
+                    else:
+                        fill.producer = await asyncio.to_thread(producer)
+                    if fill.abandoned:
+                        fill.abandon()
+                    with open(fill.part_path, 'ab') as f:
+                        async for chunk in _iterate_async(fill.producer):
+                            self._write_chunk(fill, f, chunk)
+                    self._check_complete(fill)
+                    break
+                except Exception as e:
+                    failures += 1
+                    if not self._can_resume(fill, failures, e):
+                        raise
+                    if await asyncio.to_thread(fill.stopped.wait, self._schedule_resume(fill, failures, e)):
+                        raise
+            self._commit_fill(key, fill, meta)
+        except BaseException as e:
+            self._fail_fill(key, fill, e)
+        finally:
+            self._end_fill(key, fill)
+
+    def _write_chunk(self, fill, f, chunk):
+        if not chunk:
+            return
+        f.write(chunk)
+        f.flush()
+        with fill.condition:
+            fill.bytes_written += len(chunk)
+            fill.notify()
+
+    def _check_complete(self, fill):
+        # منتج أُلغي قد ينهي التكرار دون خطأ، وما كُتب حتى الإلغاء ليس ملفاً مكتملاً
+        if fill.abandoned:
+            raise IncompleteMediaError(f'fill abandoned after {fill.bytes_written} bytes')
+        if fill.size and fill.bytes_written > fill.size:
+            raise StalePartialError(f'source is larger than the expected {fill.size} bytes')
+        if fill.size and fill.bytes_written < fill.size:
+            raise IncompleteMediaError(f'source ended after {fill.bytes_written} of {fill.size} bytes')
+
+    def _can_resume(self, fill, failures, error):
+        """
+        الاستكمال ممكن بعد وصول بيانات فعلاً (فالفشل في البداية، مثل فيديو غير متاح، لا يُعاد)
+        وما دام هناك قراء ولم تتجاوز المحاولات الحد.
+        """
+        return (fill.resumable and fill.bytes_written > 0 and not fill.abandoned
+                and failures <= self.retries and not isinstance(error, StalePartialError))
+
+    def _schedule_resume(self, fill, failures, error):
+        """تسجيل محاولة الاستكمال -> المهلة قبلها بالثواني"""
+        print(f"Media cache fill interrupted after {fill.bytes_written} bytes, "
+              f"resuming ({failures}/{self.retries}): {error}")
+        with self._lock:
+            self.resumes += 1
+        return self.retry_delay * 2 ** (failures - 1)
+
+    def _commit_fill(self, key, fill, meta):
+        meta = dict(meta, size=fill.bytes_written, created_at=time.time())
+        meta_path = self._path(key, '.json')
+        with open(meta_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(fill.part_path, fill.data_path)
+        os.replace(meta_path + '.tmp', meta_path)
+        self._track(fill.data_path, fill.bytes_written)
+
+    def _fail_fill(self, key, fill, error):
+        if not fill.abandoned:
+            print(f"Media cache fill failed: {error}")
+        with fill.condition:
+            fill.error = error
+        keep = fill.resumable and fill.bytes_written > 0 and not isinstance(error, StalePartialError)
+        partial_path = self._path(key, '.partial')
+        if keep and self._move(fill.part_path, partial_path):
+            self._track(partial_path, fill.bytes_written)
+        else:
+            self._discard(fill.part_path)
+
+    def _end_fill(self, key, fill):
+        with self._lock:
+            self._fills.pop(key, None)
+        with fill.condition:
+            fill.done = True
+            fill.notify()
+        if fill.error is None or fill.resumable:
+            self._enforce_limit()
+
+    def _open_fill(self, fill):
+        """
+        فتح ملف عملية الملء للقراءة. المولد لا يفتحه إلا عند أول قراءة، وقد تكون عملية
+        ملء سريعة اكتملت وأعادت تسميته قبلها، فيُقرأ عندها من الملف المكتمل.
+        """
+        try:
+            return open(fill.part_path, 'rb')
+        except FileNotFoundError:
+            with fill.condition:
+                while not fill.done:
+                    fill.condition.wait(1.0)
+                if fill.error is not None:
+                    raise fill.error
+            return open(fill.data_path, 'rb')
+
+    def _tail(self, fill, start):
+        try:
+            # يبقى الملف المفتوح صالحاً للقراءة حتى بعد إعادة تسميته عند الاكتمال
+            with self._open_fill(fill) as f:
+                f.seek(start)
+                position = start
+                while True:
+                    with fill.condition:
+                        while fill.bytes_written <= position and not fill.done:
+                            fill.condition.wait(1.0)
+                        written, done, error = fill.bytes_written, fill.done, fill.error
+                    if error is not None:
+                        raise error
+                    if position < written:
+                        chunk = f.read(min(written - position, self.chunk_size))
+                        position += len(chunk)
+                        yield chunk
+                        continue
+                    if done:
+                        return
+        finally:
+            self._leave(fill)
+
+    async def _tail_async(self, fill, start):
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+
+        def listener():
+            loop.call_soon_threadsafe(wakeup.set)
+
+        with fill.condition:
+            fill.listeners.add(listener)
+        try:
+            with await self._run_reader(self._open_fill, fill) as f:
+                f.seek(start)
+                position = start
+                while True:
+                    wakeup.clear()
+                    with fill.condition:
+                        written, done, error = fill.bytes_written, fill.done, fill.error
+                    if error is not None:
+                        raise error
+                    if position < written:
+                        # القراءة في thread تعيد التحكم للحلقة بين الأجزاء حتى عند توفر البيانات
+                        chunk = await self._run_reader(f.read, min(written - position, self.chunk_size))
+                        position += len(chunk)
+                        yield chunk
+                        continue
+                    if done:
+                        return
+                    # الحالة قُرئت بعد clear() لذلك لا يضيع أي إشعار بينهما
+                    await wakeup.wait()
+        finally:
+            with fill.condition:
+                fill.listeners.discard(listener)
+            self._leave(fill)
+
+    def _leave(self, fill):
+        with fill.condition:
+            fill.readers -= 1
+            # القارئ الأخير قد يتوقف عند آخر بايت قبل انتهاء المنتج؛ عندها يُترك ليكتمل الملف
+            complete = fill.size and fill.bytes_written >= fill.size
+            abandon = fill.readers == 0 and not fill.done and not complete
+        if abandon:
+            fill.abandon()
+
+    def _read_file(self, path, start):
+        with open(path, 'rb') as f:
+            f.seek(start)
+            while True:
+                chunk = f.read(self.chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    async def _read_file_async(self, path, start):
+        with open(path, 'rb') as f:
+            f.seek(start)
+            while True:
+                chunk = await self._run_reader(f.read, self.chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    def _run_reader(self, func, *args):
+        return asyncio.get_running_loop().run_in_executor(self.read_executor, func, *args)
+
+    def _move(self, source, target):
+        try:
+            os.replace(source, target)
+        except OSError:
+            return False
+        return True
+
+    def _discard(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _enforce_limit(self):
+        """حذف الملفات الأقدم استخداماً (المكتملة والجزئية) حتى يعود الحجم الكلي تحت الحد"""
+        evicted = []
+        with self._index_lock:
+            while self._total > self.max_bytes and self._index:
+                path, size = self._index.popitem(last=False)
+                self._total -= size
+                evicted.append(path)
+        for path in evicted:
+            if path.endswith('.bin'):
+                self._discard(path[:-len('.bin')] + '.json')
+            self._discard(path)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'fills': self.fills,
+                    'attached': self.attached, 'filling': len(self._fills), 'resumes': self.resumes,
+                    'max_bytes': self.max_bytes}
+
+
+async def _iterate_async(source):
+    """التكرار غير المتزامن على منتج غير متزامن أو عادي (يُقرأ الأخير في thread)"""
+    if hasattr(source, '__aiter__'):
+        async for chunk in source:
+            yield chunk
+        return
+    iterator = iter(source)
+    try:
+        while True:
+            chunk = await asyncio.to_thread(next, iterator, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            close()
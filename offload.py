@@ -0,0 +1,161 @@
+"""
+تحويل التحميل إلى رابط الوسائط المباشر بدل تمرير البايتات عبر الخادم.
+
+- direct_source: هل يمكن للعميل جلب الصيغة بنفسه (صيغة واحدة عبر HTTP عادي، دون دمج أو
+  تحويل أو أجزاء HLS/DASH) وما رابطها ووقت انتهائه
+- url_expiry: وقت الانتهاء المضمن في الرابط (expire في روابط googlevideo، و Expires أو
+  X-Amz-Date + X-Amz-Expires في الروابط الموقعة لـ S3 و CloudFront)
+- sign_link / verify_link: توقيع HMAC لروابط التطبيق التي تعيد التوجيه إلى الرابط المباشر
+- RangeStream: بقية الصيغة من الرابط المباشر بدءاً من بايت معين (طلب Range)، لاستكمال
+  ملء الذاكرة المؤقتة بعد انقطاع المصدر
+"""
+
+import calendar
+import hashlib
+import hmac
+import re
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+from media_cache import IncompleteMediaError, StalePartialError
+
+DIRECT_PROTOCOLS = ('http', 'https')
+
+DirectUrl = namedtuple('DirectUrl', 'url expires_at ext filesize')
+
+
+def url_expiry(url):
+    """وقت انتهاء الرابط (ثوانٍ منذ 1970) إن كان مضمناً فيه، وإلا None"""
+    parts = urlsplit(url)
+    query = {key.lower(): values[0] for key, values in parse_qs(parts.query).items()}
+    try:
+        if 'expire' in query:
+            return float(query['expire'])
+        if 'expires' in query:
+            return float(query['expires'])
+        if 'x-amz-date' in query and 'x-amz-expires' in query:
+            signed_at = calendar.timegm(time.strptime(query['x-amz-date'], '%Y%m%dT%H%M%SZ'))
+            return signed_at + float(query['x-amz-expires'])
+    except ValueError:
+        return None
+    # بعض روابط googlevideo تضع المعاملات في المسار: /expire/<وقت>/
+    match = re.search(r'/expire/(\d+)', parts.path)
+    return float(match.group(1)) if match else None
+
+
+def direct_source(video_format, extracted_at=None, default_ttl=1800):
+    """
+    (DirectUrl، None) إن كان يمكن جلب الصيغة مباشرة، أو (None، السبب).
+    الروابط دون وقت انتهاء معروف تُعد صالحة default_ttl ثانية من وقت الاستخراج.
+    """
+    if not video_format:
+        return None, 'merge'
+    if video_format.get('protocol') not in DIRECT_PROTOCOLS or video_format.get('fragments'):
+        return None, 'protocol'
+    url = video_format.get('url')
+    if not url:
+        return None, 'protocol'
+    expires_at = url_expiry(url) or (extracted_at or time.time()) + default_ttl
+    size = video_format.get('filesize') or video_format.get('filesize_approx')
+    return DirectUrl(url, expires_at, video_format.get('ext'), int(size) if size else None), None
+
+
+def _signature(secret, *fields):
+    message = '\n'.join(str(field) for field in fields).encode('utf-8')
+    return hmac.new(secret.encode('utf-8'), message, hashlib.sha256).hexdigest()[:32]
+
+
+def sign_link(secret, url, format_id, expires):
+    return _signature(secret, url, format_id, int(expires))
+
+
+def verify_link(secret, url, format_id, expires, signature):
+    """التوقيع صحيح والرابط لم تنتهِ مدته"""
+    try:
+        expires = int(expires)
+    except (TypeError, ValueError):
+        return False
+    if expires < time.time():
+        return False
+    return hmac.compare_digest(sign_link(secret, url, format_id, expires), signature or '')
+
+
+class RangeStream:
+    """
+    بيانات الرابط المباشر بدءاً من البايت start. total هو الحجم الكلي المتوقع إن كان معروفاً:
+    إن أعلن الخادم حجماً مختلفاً فالبيانات الجزئية لا تطابق المصدر (StalePartialError)، وانتهاء
+    البيانات قبله يُعد انقطاعاً (IncompleteMediaError). limiter يُحرر مكانه عند الانتهاء.
+    """
+
+    def __init__(self, url, start, total=None, limiter=None, chunk_size=64 * 1024, timeout=30):
+        self.url = url
+        self.start = start
+        self.total = total
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.cancelled = False
+        self._limiter = limiter
+        self._response = None
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        try:
+            if self.total and self.start >= self.total:
+                # البيانات المحفوظة مكتملة ولم يبقَ ما يُطلب
+                return
+            response = self._response = requests.get(self.url, headers={'Range': f'bytes={self.start}-'},
+                                                     stream=True, timeout=self.timeout)
+            if self.cancelled:
+                raise IncompleteMediaError('range request cancelled')
+            skip = self._check_response(response)
+            position = self.start
+            for chunk in response.iter_content(self.chunk_size):
+                if skip:
+                    # الخادم تجاهل Range: تُتخطى البايتات الموجودة لدينا مسبقاً
+                    if len(chunk) <= skip:
+                        skip -= len(chunk)
+                        continue
+                    chunk, skip = chunk[skip:], 0
+                position += len(chunk)
+                yield chunk
+            if self.cancelled:
+                raise IncompleteMediaError('range request cancelled')
+            if self.total and position < self.total:
+                raise IncompleteMediaError(f'source ended after {position} of {self.total} bytes')
+        finally:
+            self.close()
+
+    def _check_response(self, response):
+        """التحقق من أن الاستجابة تكمل البيانات الموجودة -> عدد البايتات التي يجب تخطيها"""
+        if response.status_code == 416:
+            raise StalePartialError('partial data is larger than the source')
+        response.raise_for_status()
+        if response.status_code == 206:
+            match = re.match(r'bytes (\d+)-\d+/(\d+|\*)', response.headers.get('Content-Range', ''))
+            if not match or int(match.group(1)) != self.start:
+                raise StalePartialError('unexpected Content-Range')
+            size, skip = match.group(2), 0
+        else:
+            size, skip = response.headers.get('Content-Length', '*'), self.start
+        if size.isdigit():
+            if self.total and int(size) != self.total:
+                raise StalePartialError(f'source size changed ({size} != {self.total})')
+            self.total = int(size)
+        return skip
+
+    def cancel(self):
+        self.cancelled = True
+        self.close()
+
+    def close(self):
+        with self._lock:
+            response, self._response = self._response, None
+            limiter, self._limiter = self._limiter, None
+        if response is not None:
+            response.close()
+        if limiter is not None:
+            limiter.release()
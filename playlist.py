@@ -0,0 +1,154 @@
+"""
+أدوات قوائم التشغيل.
+
+- entry_url: رابط الفيديو لعنصر من مخرجات --flat-playlist
+- expand_entries: جلب المعلومات الكاملة لعناصر القائمة بالتوازي وإرجاع كل نتيجة فور جاهزيتها
+- PlaylistIndex: فهرس قائمة تشغيل يُبنى تدريجياً صفحة بعد صفحة
+"""
+
+import threading
+from concurrent.futures import FIRST_COMPLETED, wait
+
+
+def entry_url(entry):
+    """رابط الفيديو من عنصر قائمة تشغيل مسطحة (قد يحتوي url على المعرف فقط)"""
+    url = entry.get('webpage_url') or entry.get('url') or ''
+    if url and '://' not in url and entry.get('ie_key', 'Youtube') == 'Youtube':
+        return f'https://www.youtube.com/watch?v={url}'
+    return url
+
+
+def expand_entries(entries, resolve, executor, concurrency):
+    """
+    تنفيذ resolve(url) لكل عنصر على executor مع عدد محدود من المهام الجارية لهذا الطلب.
+
+    مولد يعيد (index, entry, result, error) بترتيب الاكتمال، ففشل عنصر لا يوقف البقية.
+    إغلاق المولد (مثلاً عند انقطاع العميل) يلغي العناصر التي لم تبدأ بعد.
+    """
+    remaining = iter(enumerate(entries))
+    pending = {}
+
+    def submit_next():
+        for index, entry in remaining:
+            pending[executor.submit(resolve, entry_url(entry))] = (index, entry)
+            return
+
+    for _ in range(max(1, concurrency)):
+        submit_next()
+    try:
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, entry = pending.pop(future)
+                submit_next()
+                try:
+                    yield index, entry, future.result(), None
+                except Exception as e:
+                    yield index, entry, None, e
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+class PlaylistIndex:
+    """
+    العناصر المعروفة من قائمة تشغيل بالترتيب.
+
+    fetch_range(start, end) تعيد العناصر من start إلى end (ترقيم يبدأ من 1 كما في
+    --playlist-items، و end=None حتى نهاية القائمة). يُفتح تعداد واحد من أول عنصر غير معروف
+    ويُحفظ مولده الحي، فتُكمل كل صفحة جديدة القراءة منه حيث توقفت السابقة بدل فتح تعداد جديد
+    يعيد جلب الصفحات السابقة من المصدر. يُغلق المولد عند اكتمال التعداد أو close().
+
+    القراءة من المولد تجري خارج lock: صفحات العناصر المعروفة لا تنتظر الشبكة، وطلب واحد
+    فقط يقرأ من المولد في كل مرة بينما ينتظره من يحتاج عناصر لم تصل بعد.
+    """
+
+    def __init__(self, fetch_range):
+        self.fetch_range = fetch_range
+        self.entries = []
+        self.complete = False
+        self.lock = threading.Lock()
+        self._changed = threading.Condition(self.lock)
+        self._source = None
+        self._fetching = False
+        self._closed = False
+
+    def page(self, offset, limit):
+        """
+        إرجاع (العناصر، هل توجد عناصر بعدها). يُقرأ عنصر واحد بعد النطاق، فقائمة عدد عناصرها end
+        بالضبط لا تُعلن صفحة تالية فارغة.
+        """
+        end = offset + limit
+        with self.lock:
+            # من يحتاج عناصر لم تصل ينتظر القارئ الجاري، فلا يُجلب نفس النطاق مرتين
+            while self._fetching and not self._known(end):
+                self._changed.wait()
+            if self._known(end):
+                return self._slice(offset, end)
+            self._fetching = True
+            source, self._source = self._source, None
+        try:
+            if source is None:
+                source = self.fetch_range(len(self.entries) + 1, None)
+            complete = self._read(source, end + 1)
+        except BaseException:
+            # مولد رفع استثناء انتهى؛ الصفحة التالية تفتح تعداداً جديداً من أول عنصر غير معروف
+            with self.lock:
+                self._fetching = False
+                self._changed.notify_all()
+            raise
+        with self.lock:
+            self._fetching = False
+            self.complete = self.complete or complete
+            if not (complete or self._closed):
+                source, self._source = None, source
+            self._changed.notify_all()
+            result = self._slice(offset, end)
+        if source is not None:
+            _close(source)
+        return result
+
+    def _known(self, end):
+        return self.complete or len(self.entries) > end
+
+    def _slice(self, offset, end):
+        return self.entries[offset:end], len(self.entries) > end
+
+    def _read(self, source, end):
+        """قراءة العناصر حتى end -> هل انتهت القائمة"""
+        while len(self.entries) < end:
+            entry = next(source, None)
+            if entry is None:
+                return True
+            with self.lock:
+                self.entries.append(entry)
+        return False
+
+    def close(self):
+        """إغلاق التعداد الحي (عند حذف الفهرس من الذاكرة)؛ إن كان طلب يقرأ منه يُغلق عند انتهائه"""
+        with self.lock:
+            self._closed = True
+            source, self._source = self._source, None
+        if source is not None:
+            _close(source)
+
+    @property
+    def title(self):
+        for entry in self.entries[:1]:
+            return entry.get('playlist_title') or entry.get('playlist')
+        return None
+
+    @property
+    def total(self):
+        """العدد الكلي إن عُرف (من yt-dlp أو بعد اكتمال التعداد)"""
+        if self.complete:
+            return len(self.entries)
+        for entry in self.entries[:1]:
+            return entry.get('playlist_count')
+        return None
+
+
+def _close(source):
+    close = getattr(source, 'close', None)
+    if close is not None:
+        close()
@@ -0,0 +1,355 @@
+"""
+إدارة العمليات الفرعية لبث الوسائط.
+
+- ProcessLimiter: حد عام لعدد عمليات الوسائط المتزامنة مع طابور انتظار محدود بأولويات
+- ManagedProcess: عملية تُقرأ مخرجاتها كأجزاء، ويُفرَّغ stderr في الخلفية،
+  وتُقتل ويُجمع رمز خروجها (reap) عند الإغلاق أو الإلغاء
+- AsyncManagedProcess: نفس السلوك على حلقة asyncio (وضع ASGI) بأنابيب غير حاجبة
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+
+from extractor import ExtractionError, get_startupinfo
+from metrics import REGISTRY
+
+PROCESS_SPAWN_SECONDS = REGISTRY.histogram(
+    'ytdl_process_spawn_seconds', 'Time to start a child process', ['program'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1))
+CHILD_PROCESSES = REGISTRY.gauge('ytdl_child_processes', 'Running managed child processes', ['program'])
+
+
+def program_name(args):
+    """اسم البرنامج من أمر العملية (تسمية المقاييس)"""
+    program = args[0] if isinstance(args, (list, tuple)) else str(args).split(' ', 1)[0]
+    return os.path.basename(str(program))
+
+
+class AdmissionError(Exception):
+    """لا يوجد مكان لعملية جديدة والطابور ممتلئ أو انتهت مهلة الانتظار"""
+
+    def __init__(self, retry_after):
+        super().__init__('عدد التحميلات الجارية وصل إلى الحد الأقصى')
+        self.retry_after = retry_after
+
+
+class ProcessCancelledError(ExtractionError):
+    """أُوقفت العملية قبل انتهائها (مثلاً بعد انقطاع جميع العملاء)"""
+
+
+# أولويات الطابور: الأصغر يحصل على المكان الشاغر أولاً
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+
+class ProcessLimiter:
+    """
+    حد أقصى لعدد العمليات المتزامنة مع طابور انتظار محدود الحجم والمدة.
+
+    المنتظرون يحصلون على الأماكن الشاغرة حسب الأولوية ثم حسب ترتيب الوصول. acquire تنتظر
+    في thread، و acquire_async على حلقة asyncio دون حجز thread، وكلاهما في نفس الطابور.
+    """
+
+    def __init__(self, max_processes=8, max_waiting=16, wait_timeout=10.0):
+        self.max_processes = max_processes
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.active = 0
+        self.rejected = 0
+        self._waiters = []
+        # تذاكر منتظري acquire_async -> (الحلقة، future يكتمل عند منح المكان)
+        self._async_waiters = {}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    def acquire(self, priority=PRIORITY_NORMAL):
+        with self._condition:
+            if self.active < self.max_processes and not self._waiters:
+                self.active += 1
+                return
+            if len(self._waiters) >= self.max_waiting:
+                self.rejected += 1
+                raise AdmissionError(self.retry_after())
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(self._waiters, ticket)
+            granted = False
+            try:
+                deadline = time.monotonic() + self.wait_timeout
+                while self.active >= self.max_processes or self._waiters[0] != ticket:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        raise AdmissionError(self.retry_after())
+                    self._condition.wait(remaining)
+                heapq.heappop(self._waiters)
+                self.active += 1
+                granted = True
+            finally:
+                if not granted:
+                    self._waiters.remove(ticket)
+                    heapq.heapify(self._waiters)
+                # تغيّر رأس الطابور: المنتظر التالي قد يستطيع الحصول على مكان
+                self._wake()
+
+    async def acquire_async(self, priority=PRIORITY_NORMAL):
+        """مثل acquire لكن الانتظار في الطابور future على الحلقة، فلا يحجز thread من الـ executor"""
+        loop = asyncio.get_running_loop()
+        with self._condition:
+            if self.active < self.max_processes and not self._waiters:
+                self.active += 1
+                return
+            if len(self._waiters) >= self.max_waiting:
+                self.rejected += 1
+                raise AdmissionError(self.retry_after())
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(self._waiters, ticket)
+            future = loop.create_future()
+            self._async_waiters[ticket] = (loop, future)
+        try:
+            await asyncio.wait_for(future, self.wait_timeout)
+        except BaseException as e:
+            timed_out = isinstance(e, asyncio.TimeoutError)
+            with self._condition:
+                # إن مُنح المكان قبل الإلغاء مباشرة فـ _grant يحرره لأن الـ future أُلغي
+                if self._async_waiters.pop(ticket, None) is not None:
+                    self._waiters.remove(ticket)
+                    heapq.heapify(self._waiters)
+                    self._wake()
+                if timed_out:
+                    self.rejected += 1
+            if future.done() and not future.cancelled():
+                # المكان مُنح لكن الانتظار أُلغي قبل استلامه
+                self.release()
+            if timed_out:
+                raise AdmissionError(self.retry_after()) from None
+            raise
+
+    def _wake(self):
+        """منح الأماكن الشاغرة لمنتظري acquire_async في رأس الطابور وإيقاظ البقية؛ مع الإمساك بـ _condition"""
+        while self._waiters and self.active < self.max_processes and self._waiters[0] in self._async_waiters:
+            ticket = heapq.heappop(self._waiters)
+            loop, future = self._async_waiters.pop(ticket)
+            self.active += 1
+            try:
+                loop.call_soon_threadsafe(self._grant, future)
+            except RuntimeError:
+                # الحلقة أُغلقت ولن يستلم أحد المكان
+                self.active -= 1
+        self._condition.notify_all()
+
+    def _grant(self, future):
+        if future.cancelled():
+            self.release()
+        else:
+            future.set_result(None)
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._wake()
+
+    def retry_after(self):
+        """عدد الثواني المقترح قبل إعادة المحاولة"""
+        return max(1, int(self.wait_timeout))
+
+    def stats(self):
+        with self._condition:
+            return {'active': self.active, 'waiting': self.waiting, 'rejected': self.rejected,
+                    'max_processes': self.max_processes, 'max_waiting': self.max_waiting}
+
+
+class ManagedProcess:
+    """
+    عملية فرعية تُقرأ مخرجاتها عبر التكرار.
+
+    spawn() تنشئ العملية (subprocess.Popen مع stdout و stderr كأنابيب). عند انتهاء
+    المخرجات يُنتظر خروج العملية ويُرفع ExtractionError برسالة stderr إن فشلت.
+    cancel() يمكن استدعاؤها من أي thread لقتل العملية فوراً، والإغلاق يضمن دائماً
+    قتل العملية وجمع رمز خروجها وتحرير مكانها في limiter.
+    """
+
+    def __init__(self, spawn, limiter=None, chunk_size=64 * 1024, stderr_limit=64 * 1024):
+        self._limiter = limiter
+        self.chunk_size = chunk_size
+        self.stderr_limit = stderr_limit
+        self.cancelled = False
+        self._closed = False
+        self._lock = threading.Lock()
+        self._stderr = bytearray()
+        started = time.perf_counter()
+        try:
+            self.process = spawn()
+        except BaseException:
+            self._release()
+            raise
+        self.program = program_name(self.process.args)
+        PROCESS_SPAWN_SECONDS.labels(self.program).observe(time.perf_counter() - started)
+        CHILD_PROCESSES.labels(self.program).inc()
+        # تفريغ stderr باستمرار حتى لا تتوقف العملية عند امتلاء الأنبوب
+        self._stderr_thread = threading.Thread(target=self._drain_stderr, daemon=True)
+        self._stderr_thread.start()
+
+    def _drain_stderr(self):
+        for line in iter(self.process.stderr.readline, b''):
+            self._stderr.extend(line)
+            if len(self._stderr) > self.stderr_limit:
+                del self._stderr[:len(self._stderr) - self.stderr_limit]
+
+    def stderr_text(self):
+        return self._stderr.decode('utf-8', errors='replace')
+
+    def __iter__(self):
+        try:
+            while True:
+                chunk = self.process.stdout.read1(self.chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+            self.process.wait()
+            self._stderr_thread.join(timeout=5)
+            if self.cancelled:
+                raise ProcessCancelledError('تم إيقاف العملية')
+            if self.process.returncode != 0:
+                raise ExtractionError('yt-dlp failed', self.stderr_text())
+        finally:
+            self.close()
+
+    def cancel(self):
+        self.cancelled = True
+        self._kill()
+
+    def _kill(self):
+        if self.process.poll() is None:
+            try:
+                self.process.kill()
+            except OSError:
+                pass
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._kill()
+        self.process.wait()
+        CHILD_PROCESSES.labels(self.program).dec()
+        self._stderr_thread.join(timeout=1)
+        for pipe in (self.process.stdout, self.process.stderr):
+            try:
+                pipe.close()
+            except (OSError, ValueError):
+                pass
+        self._release()
+
+    def _release(self):
+        if self._limiter is not None:
+            self._limiter.release()
+            self._limiter = None
+
+
+class AsyncManagedProcess:
+    """
+    نسخة asyncio من ManagedProcess لوضع ASGI.
+
+    تُنشأ العملية عبر asyncio.create_subprocess_exec عند بدء التكرار (async for)،
+    فتُقرأ مخرجاتها دون حجز thread لكل تحميل. cancel() آمنة للاستدعاء من أي thread.
+    """
+
+    def __init__(self, command, limiter=None, chunk_size=64 * 1024, stderr_limit=64 * 1024):
+        self.command = command
+        self._limiter = limiter
+        self.chunk_size = chunk_size
+        self.stderr_limit = stderr_limit
+        self.cancelled = False
+        self.process = None
+        self._closed = False
+        self._loop = None
+        self._stderr = bytearray()
+        self._stderr_task = None
+
+    async def _start(self):
+        self._loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            self.process = await asyncio.create_subprocess_exec(
+                *self.command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                limit=self.chunk_size, startupinfo=get_startupinfo())
+        except BaseException:
+            self._release()
+            raise
+        self.program = program_name(self.command)
+        PROCESS_SPAWN_SECONDS.labels(self.program).observe(time.perf_counter() - started)
+        CHILD_PROCESSES.labels(self.program).inc()
+        self._stderr_task = asyncio.ensure_future(self._drain_stderr())
+        if self.cancelled:
+            self._kill()
+
+    async def _drain_stderr(self):
+        while True:
+            line = await self.process.stderr.readline()
+            if not line:
+                return
+            self._stderr.extend(line)
+            if len(self._stderr) > self.stderr_limit:
+                del self._stderr[:len(self._stderr) - self.stderr_limit]
+
+    def stderr_text(self):
+        return self._stderr.decode('utf-8', errors='replace')
+
+    async def __aiter__(self):
+        await self._start()
+        try:
+            while True:
+                chunk = await self.process.stdout.read(self.chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+            await self.process.wait()
+            await asyncio.wait_for(self._stderr_task, 5)
+            if self.cancelled:
+                raise ProcessCancelledError('تم إيقاف العملية')
+            if self.process.returncode != 0:
+                raise ExtractionError('yt-dlp failed', self.stderr_text())
+        finally:
+            await self.close()
+
+    def cancel(self):
+        self.cancelled = True
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._kill)
+
+    def _kill(self):
+        if self.process is not None and self.process.returncode is None:
+            try:
+                self.process.kill()
+            except ProcessLookupError:
+                pass
+
+    async def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self.process is not None:
+            self._kill()
+            await self.process.wait()
+            CHILD_PROCESSES.labels(self.program).dec()
+            if self._stderr_task is not None:
+                try:
+                    await asyncio.wait_for(self._stderr_task, 1)
+                except (asyncio.TimeoutError, OSError):
+                    self._stderr_task.cancel()
+        self._release()
+
+    def _release(self):
+        if self._limiter is not None:
+            self._limiter.release()
+            self._limiter = None
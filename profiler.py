@@ -0,0 +1,89 @@
+"""
+محلل أداء بأخذ العينات للعملية الجارية.
+
+يأخذ كل interval ثانية لقطة لمكدسات جميع الـ threads (sys._current_frames) دون تعديل
+الشيفرة المُحلَّلة، ويجمعها بصيغة المكدسات المطوية (folded stacks) التي تقرؤها أدوات
+flamegraph.pl و speedscope و inferno: سطر لكل مكدس "إطار;إطار;... عدد".
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# دوال الانتظار في المكتبة القياسية
+WAIT_FRAMES = {
+    ('threading.py', 'wait'),
+    ('queue.py', 'get'),
+    ('selectors.py', 'select'),
+    ('socket.py', 'accept'),
+}
+
+# حلقات تنتظر عملاً جديداً: thread ينتظر فيها مباشرة خامل (أما انتظار عملية yt-dlp
+# أو نتيجة استخراج داخل طلب فهو من زمن الطلب ويبقى في التحليل)
+IDLE_LOOPS = {
+    ('thread.py', '_worker'),
+    ('socketserver.py', 'serve_forever'),
+    ('serving.py', 'serve_forever'),
+    ('base_events.py', '_run_once'),
+    ('capabilities.py', '_run'),
+}
+
+_lock = threading.Lock()
+
+
+class ProfilerBusyError(Exception):
+    """يوجد تحليل أداء جارٍ بالفعل"""
+
+
+def frame_label(frame):
+    code = frame.f_code
+    module = frame.f_globals.get('__name__') or os.path.basename(code.co_filename)
+    return f'{module}:{code.co_name}'
+
+
+def fold_stack(frame):
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+def _frame_key(frame):
+    return os.path.basename(frame.f_code.co_filename), frame.f_code.co_name
+
+
+def is_idle(frame):
+    while frame is not None and _frame_key(frame) in WAIT_FRAMES:
+        frame = frame.f_back
+    return frame is not None and _frame_key(frame) in IDLE_LOOPS
+
+
+def sample(seconds, interval=0.005, include_idle=False):
+    """
+    أخذ عينات لمدة seconds ثانية وإرجاع (Counter للمكدسات المطوية، عدد اللقطات).
+    تحليل واحد فقط في كل وقت (ProfilerBusyError).
+    """
+    if not _lock.acquire(blocking=False):
+        raise ProfilerBusyError('profiler already running')
+    try:
+        own_id = threading.get_ident()
+        stacks = Counter()
+        snapshots = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or (not include_idle and is_idle(frame)):
+                    continue
+                stacks[fold_stack(frame)] += 1
+            snapshots += 1
+            time.sleep(interval)
+        return stacks, snapshots
+    finally:
+        _lock.release()
+
+
+def render_folded(stacks):
+    return ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
@@ -0,0 +1,305 @@
+"""
+تتبع تقدم التحميلات وبث التحديثات للمشتركين (Server-Sent Events).
+"""
+
+import asyncio
+import json
+import threading
+import time
+
+
+class ProgressHub:
+    """
+    مخزن حالات التقدم مع إشعار المنتظرين عند كل تحديث.
+
+    لكل عمل (تحميل أو دفعة) رقم إصدار يزداد مع كل تحديث، فيعرف كل مشترك
+    ما تغير منذ آخر مرة أرسل فيها دون الحاجة إلى طابور لكل مشترك.
+
+    الأعمال المنتهية تُحذف من الذاكرة بعد finished_ttl ثانية (تبقى حالتها الدائمة في
+    مخزن الأعمال إن وُجد).
+    """
+
+    PRUNE_EVERY = 256
+
+    def __init__(self, finished_ttl=None):
+        self.finished_ttl = finished_ttl
+        self._jobs = {}
+        self._versions = {}
+        self._owners = {}
+        self._finished_at = {}
+        self._version = 0
+        self._condition = threading.Condition()
+        self._listeners = set()
+
+    def update(self, job_id, state, client_id=None):
+        with self._condition:
+            self._version += 1
+            self._jobs[job_id] = state
+            self._versions[job_id] = self._version
+            if client_id:
+                self._owners[job_id] = client_id
+            if state.get('status') in FINISHED_STATES:
+                self._finished_at[job_id] = time.monotonic()
+            else:
+                self._finished_at.pop(job_id, None)
+            if self.finished_ttl is not None and self._version % self.PRUNE_EVERY == 0:
+                self._prune()
+            self._condition.notify_all()
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener()
+
+    def subscribe(self, listener):
+        """تسجيل دالة تُستدعى بعد كل تحديث (لإيقاظ المشتركين على حلقة asyncio)"""
+        with self._condition:
+            self._listeners.add(listener)
+
+    def unsubscribe(self, listener):
+        with self._condition:
+            self._listeners.discard(listener)
+
+    def assign(self, job_id, client_id):
+        """ربط عمل بعميل حتى يظهر في بث جميع أعمال هذا العميل"""
+        if client_id:
+            with self._condition:
+                self._owners[job_id] = client_id
+
+    def _prune(self):
+        cutoff = time.monotonic() - self.finished_ttl
+        for job_id in [job_id for job_id, at in self._finished_at.items() if at < cutoff]:
+            for table in (self._jobs, self._versions, self._owners, self._finished_at):
+                table.pop(job_id, None)
+
+    def owner(self, job_id):
+        with self._condition:
+            return self._owners.get(job_id)
+
+    def get(self, job_id, default=None):
+        with self._condition:
+            return self._jobs.get(job_id, default)
+
+    def jobs_for(self, client_id):
+        with self._condition:
+            return [job_id for job_id, owner in self._owners.items() if owner == client_id]
+
+    def changes(self, job_ids, seen, timeout):
+        """
+        انتظار تحديثات على الأعمال المحددة (أو أعمال عميل عبر callable) حتى timeout ثانية.
+
+        seen قاموس {job_id: آخر إصدار أُرسل}، ويعاد قاموس بالحالات الجديدة فقط.
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                ids = job_ids() if callable(job_ids) else job_ids
+                changed = {job_id: self._jobs[job_id] for job_id in ids
+                           if job_id in self._jobs and self._versions[job_id] > seen.get(job_id, 0)}
+                if changed:
+                    for job_id in changed:
+                        seen[job_id] = self._versions[job_id]
+                    return changed
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return {}
+                self._condition.wait(remaining)
+
+
+FINISHED_STATES = ('completed', 'error', 'cancelled')
+
+
+def sse_stream(hub, job_ids, min_interval=0.5, heartbeat=15.0, close_when_finished=True, pending_timeout=None):
+    """
+    مولد أحداث SSE لتقدم مجموعة أعمال.
+
+    يرسل أحدث حالة فقط لكل عمل بمعدل لا يتجاوز تحديثاً كل min_interval ثانية، حتى لا
+    تغرق التحميلات السريعة المتصفح بالأحداث، ويرسل تعليقاً دورياً لإبقاء الاتصال حياً.
+
+    pending_timeout: مدة انتظار أول تحديث (العميل قد يفتح البث قبل بدء العمل)؛ إن لم يصل
+    يُنهى البث بحدث end حتى لا يبقى معرّف غير معروف محجوزاً للأبد.
+    """
+    seen = {}
+    last_emit = 0.0
+    deadline = None if pending_timeout is None else time.monotonic() + pending_timeout
+    yield 'retry: 3000\n\n'
+    while True:
+        # تحديد المعدل: التحديثات التي تصل خلال هذه الفترة تُدمج في الحدث التالي
+        wait = last_emit + min_interval - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+
+        timeout = heartbeat
+        if deadline is not None and not seen:
+            timeout = min(heartbeat, max(deadline - time.monotonic(), 0))
+        changed = hub.changes(job_ids, seen, timeout)
+        if not changed:
+            if _pending_expired(seen, deadline):
+                yield END_EVENT
+                return
+            yield ': keepalive\n\n'
+            continue
+
+        last_emit = time.monotonic()
+        events, finished = _format_events(hub, job_ids, changed, close_when_finished)
+        yield events
+        if finished:
+            return
+
+
+async def sse_stream_async(hub, job_ids, min_interval=0.5, heartbeat=15.0, close_when_finished=True,
+                           pending_timeout=None):
+    """نسخة غير متزامنة من sse_stream لا تحجز thread لكل مشترك (وضع ASGI)"""
+    loop = asyncio.get_running_loop()
+    wakeup = asyncio.Event()
+
+    def listener():
+        loop.call_soon_threadsafe(wakeup.set)
+
+    hub.subscribe(listener)
+    try:
+        seen = {}
+        last_emit = 0.0
+        deadline = None if pending_timeout is None else time.monotonic() + pending_timeout
+        yield 'retry: 3000\n\n'
+        while True:
+            wait = last_emit + min_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+            wakeup.clear()
+            changed = hub.changes(job_ids, seen, 0)
+            if not changed:
+                if _pending_expired(seen, deadline):
+                    yield END_EVENT
+                    return
+                timeout = heartbeat
+                if deadline is not None and not seen:
+                    timeout = min(heartbeat, max(deadline - time.monotonic(), 0))
+                try:
+                    await asyncio.wait_for(wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    if not _pending_expired(seen, deadline):
+                        yield ': keepalive\n\n'
+                continue
+
+            last_emit = time.monotonic()
+            events, finished = _format_events(hub, job_ids, changed, close_when_finished)
+            yield events
+            if finished:
+                return
+    finally:
+        hub.unsubscribe(listener)
+
+
+END_EVENT = 'event: end\ndata: {}\n\n'
+
+
+def _pending_expired(seen, deadline):
+    return deadline is not None and not seen and time.monotonic() >= deadline
+
+
+def _progress_event(job_id, state):
+    payload = dict(state, id=job_id)
+    return f'event: progress\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n'
+
+
+def _format_events(hub, job_ids, changed, close_when_finished):
+    """نص أحداث SSE للحالات المتغيرة، وهل انتهت جميع الأعمال المتابعة"""
+    events = ''.join(_progress_event(job_id, state) for job_id, state in changed.items())
+
+    if close_when_finished and not callable(job_ids):
+        states = [hub.get(job_id) for job_id in job_ids]
+        if all(state and state.get('status') in FINISHED_STATES for state in states):
+            return events + END_EVENT, True
+    return events, False
+
+
+def final_events(job_id, state):
+    """أحداث SSE لعمل منتهٍ لم يعد في الذاكرة: حالته المحفوظة ثم end، دون بث ينتظر تحديثات لن تصل"""
+    return _progress_event(job_id, state) + END_EVENT
+
+
+def format_bytes(size):
+    """تنسيق حجم بالبايت إلى نص مقروء"""
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(size) < 1024 or unit == 'GB':
+            return f'{size:.1f} {unit}' if unit != 'B' else f'{int(size)} B'
+        size /= 1024
+
+
+class TransferMeter:
+    """
+    قياس نقل البيانات: البايتات المرسلة، السرعة اللحظية والمنعّمة، والوقت المتبقي.
+
+    add() تُستدعى لكل جزء مرسل وتكلفتها زيادة عداد ومقارنة وقت فقط؛ الحسابات
+    واستدعاء on_update تحدث مرة كل interval ثانية مهما كان حجم الأجزاء.
+    """
+
+    def __init__(self, expected_bytes=None, interval=0.5, smoothing=0.3, on_update=None):
+        self.expected_bytes = expected_bytes or None
+        self.interval = interval
+        self.smoothing = smoothing
+        self.on_update = on_update
+        self.bytes_sent = 0
+        self.rate = 0.0
+        self.smoothed_rate = None
+        self.started_at = time.monotonic()
+        self._last_time = self.started_at
+        self._last_bytes = 0
+        self._next_update = self.started_at + interval
+
+    def add(self, count):
+        self.bytes_sent += count
+        now = time.monotonic()
+        if now >= self._next_update:
+            self._next_update = now + self.interval
+            self._sample(now)
+            if self.on_update:
+                self.on_update(self)
+
+    def _sample(self, now):
+        elapsed = now - self._last_time
+        if elapsed <= 0:
+            return
+        self.rate = (self.bytes_sent - self._last_bytes) / elapsed
+        if self.smoothed_rate is None:
+            self.smoothed_rate = self.rate
+        else:
+            self.smoothed_rate = self.smoothing * self.rate + (1 - self.smoothing) * self.smoothed_rate
+        self._last_time = now
+        self._last_bytes = self.bytes_sent
+
+    @property
+    def percent(self):
+        """النسبة المئوية (لا تتجاوز 99 قبل الاكتمال لأن الحجم المتوقع قد يكون تقريبياً)"""
+        if not self.expected_bytes:
+            return None
+        return min(99, int(self.bytes_sent * 100 / self.expected_bytes))
+
+    @property
+    def eta(self):
+        if not self.expected_bytes or not self.smoothed_rate:
+            return None
+        return max(0.0, (self.expected_bytes - self.bytes_sent) / self.smoothed_rate)
+
+    def snapshot(self):
+        eta = self.eta
+        return {
+            'bytes_sent': self.bytes_sent,
+            'expected_bytes': self.expected_bytes,
+            'rate': round(self.rate),
+            'smoothed_rate': round(self.smoothed_rate or 0),
+            'eta': round(eta, 1) if eta is not None else None,
+            'elapsed': round(time.monotonic() - self.started_at, 1),
+        }
+
+    def describe(self):
+        """وصف مقروء للتقدم الحالي"""
+        text = f'تم تحميل {format_bytes(self.bytes_sent)}'
+        if self.expected_bytes:
+            text += f' من {format_bytes(self.expected_bytes)}'
+        if self.smoothed_rate:
+            text += f' بسرعة {format_bytes(self.smoothed_rate)}/ث'
+        eta = self.eta
+        if eta is not None:
+            text += f' - متبقٍ {int(eta // 60)}:{int(eta % 60):02d}'
+        return text
@@ -0,0 +1,92 @@
+"""
+البحث في يوتيوب مع ذاكرة مؤقتة لنتائج كل استعلام.
+
+- تُجلب نتائج الاستعلام في thread خلفي وتُضاف فور استخراج كل عنصر، فيقرأ الطلب
+  (وأي طلبات متزامنة لنفس الاستعلام) النتائج أثناء وصولها من بحث واحد
+- يُحفظ أكبر عدد نتائج جُلب لكل استعلام، فيُخدم الطلب الأصغر من أول النتائج المحفوظة
+"""
+
+import threading
+
+from cache import TTLCache
+
+
+def normalize_query(query):
+    """مفتاح الاستعلام: حالة الأحرف والمسافات الزائدة لا تغير نتائج البحث"""
+    return ' '.join(query.casefold().split())
+
+
+class SearchResults:
+    """نتائج استعلام واحد بالترتيب، تُملأ تدريجياً"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.entries = []
+        self.complete = False
+        self.error = None
+        self.condition = threading.Condition()
+
+    def covers(self, limit):
+        if self.error is not None:
+            return False
+        # بحث مكتمل بنتائج أقل مما طُلب يعني أن الاستعلام لا يملك نتائج أكثر
+        return self.limit >= limit or (self.complete and len(self.entries) < self.limit)
+
+    def iter(self, limit):
+        """أول limit نتيجة، كل نتيجة فور وصولها"""
+        index = 0
+        while index < limit:
+            with self.condition:
+                while index >= len(self.entries) and not self.complete:
+                    self.condition.wait()
+                if index >= len(self.entries):
+                    if self.error is not None:
+                        raise self.error
+                    return
+                entry = self.entries[index]
+            index += 1
+            yield entry
+
+
+class SearchCache:
+    """
+    ذاكرة مؤقتة (LRU مع TTL) لنتائج البحث حسب الاستعلام.
+
+    search(query, limit) تعيد مولداً لنتائج البحث بالترتيب. البحث يكمل في الخلفية حتى
+    لو انقطع العميل الذي بدأه، فتُحفظ نتائجه لمن يطلب نفس الاستعلام بعده.
+    """
+
+    def __init__(self, search, maxsize=256, ttl=600):
+        self.search = search
+        self.results = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.lock = threading.Lock()
+
+    def lookup(self, query, limit):
+        """إرجاع (النتائج، هل كانت محفوظة أو جارية مسبقاً)"""
+        key = normalize_query(query)
+        with self.lock:
+            results = self.results.get(key)
+            if results is not None and results.covers(limit):
+                return results, True
+            results = SearchResults(limit)
+            self.results.set(key, results)
+        thread = threading.Thread(target=self._fill, args=(query, results), daemon=True)
+        thread.start()
+        return results, False
+
+    def _fill(self, query, results):
+        try:
+            for entry in self.search(query, results.limit):
+                with results.condition:
+                    results.entries.append(entry)
+                    results.condition.notify_all()
+        except Exception as e:
+            # البحث الفاشل يبقى في الذاكرة كإخفاق ويُعاد عند الطلب التالي (covers)
+            results.error = e
+        finally:
+            with results.condition:
+                results.complete = True
+                results.condition.notify_all()
+
+    def stats(self):
+        return self.results.stats()
@@ -0,0 +1,400 @@
+"""
+مشاركة حالات التقدم وحالات الدفعات وإشارات الإلغاء بين عمال gunicorn والخوادم.
+
+- MemoryBackend: عامل واحد؛ كل شيء في ذاكرة العملية (السلوك الافتراضي)
+- NetworkBackend: يرسل تحديثات العامل إلى StateServer عبر TCP (سطر JSON لكل رسالة)،
+  ويستقبل تحديثات بقية العمال على اتصال اشتراك ويطبقها على ProgressHub المحلي، فيعمل
+  /progress و /events من أي عامل. الإرسال من thread خلفي يدمج التحديثات المتتالية لكل
+  عمل، فلا ينتظر البث رد الخادم
+- StateServer: الخادم المشترك (python state_backend.py --port 7070)، يحفظ آخر حالة لكل
+  عمل وآخر سجل لكل دفعة ويعيد بث التحديثات والإلغاءات إلى جميع المشتركين
+"""
+
+import hmac
+import json
+import queue
+import socket
+import socketserver
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+FINISHED_STATES = ('completed', 'error', 'cancelled')
+
+
+class BackendError(Exception):
+    """تعذر الاتصال بخادم الحالة أو رفض الطلب"""
+
+
+class MemoryBackend:
+    """الحالة داخل العملية فقط: ProgressHub المحلي هو المصدر الوحيد"""
+
+    shared = False
+
+    def __init__(self):
+        self._on_cancel = None
+
+    def start(self, hub, on_cancel=None):
+        self._on_cancel = on_cancel
+
+    def publish(self, job_id, state, client_id=None):
+        pass
+
+    def put_record(self, kind, key, value):
+        pass
+
+    def get(self, job_id):
+        return None
+
+    def get_record(self, kind, key):
+        return None
+
+    def cancel(self, job_id):
+        if self._on_cancel:
+            self._on_cancel(job_id)
+
+    def ping(self):
+        return {'ok': True, 'backend': 'memory'}
+
+
+def _send(sock, message):
+    sock.sendall(json.dumps(message, ensure_ascii=False).encode('utf-8') + b'\n')
+
+
+def _exchange(sock, rfile, message):
+    _send(sock, message)
+    line = rfile.readline()
+    if not line:
+        raise BackendError('connection closed')
+    reply = json.loads(line)
+    if 'error' in reply:
+        raise BackendError(reply['error'])
+    return reply.get('result')
+
+
+class NetworkBackend:
+    """عميل StateServer (انظر وصف الوحدة)"""
+
+    shared = True
+
+    def __init__(self, host, port, token='', timeout=5.0, reconnect_delay=1.0):
+        self.address = (host, port)
+        self.token = token
+        self.timeout = timeout
+        self.reconnect_delay = reconnect_delay
+        # معرف هذا العامل: تحديثاته تعود إليه في الاشتراك ولا تُطبق مرتين
+        self.origin = uuid.uuid4().hex
+        self.connected = False
+        self.dropped = 0
+        self._hub = None
+        self._on_cancel = None
+        self._connection = None
+        self._request_lock = threading.Lock()
+        self._pending = threading.Condition()
+        self._pending_progress = {}
+        self._pending_records = {}
+        self._stop = threading.Event()
+
+    def start(self, hub, on_cancel=None):
+        self._hub = hub
+        self._on_cancel = on_cancel
+        threading.Thread(target=self._subscribe_loop, name='state-subscriber', daemon=True).start()
+        threading.Thread(target=self._publish_loop, name='state-publisher', daemon=True).start()
+
+    def close(self):
+        self._stop.set()
+        with self._pending:
+            self._pending.notify_all()
+
+    def _connect(self):
+        sock = socket.create_connection(self.address, timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        rfile = sock.makefile('rb')
+        try:
+            if self.token:
+                _exchange(sock, rfile, {'op': 'auth', 'token': self.token})
+        except BaseException:
+            sock.close()
+            raise
+        return sock, rfile
+
+    def _request(self, op, **fields):
+        """طلب واحد على الاتصال المشترك (مع إعادة الاتصال مرة عند انقطاعه)"""
+        with self._request_lock:
+            for attempt in range(2):
+                try:
+                    if self._connection is None:
+                        self._connection = self._connect()
+                    return _exchange(*self._connection, dict(fields, op=op))
+                except (OSError, ValueError) as e:
+                    if self._connection is not None:
+                        self._connection[0].close()
+                        self._connection = None
+                    if attempt:
+                        raise BackendError(str(e)) from e
+
+    # --- الإرسال المؤجل ---
+
+    def publish(self, job_id, state, client_id=None):
+        with self._pending:
+            self._pending_progress[job_id] = (state, client_id)
+            self._pending.notify()
+
+    def put_record(self, kind, key, value):
+        with self._pending:
+            self._pending_records[(kind, key)] = value
+            self._pending.notify()
+
+    def _publish_loop(self):
+        while not self._stop.is_set():
+            with self._pending:
+                while not self._pending_progress and not self._pending_records and not self._stop.is_set():
+                    self._pending.wait()
+                progress, self._pending_progress = self._pending_progress, {}
+                records, self._pending_records = self._pending_records, {}
+            if not progress and not records:
+                continue
+            try:
+                self._request('publish', origin=self.origin,
+                              progress=[[job_id, state, client_id] for job_id, (state, client_id) in progress.items()],
+                              records=[[kind, key, value] for (kind, key), value in records.items()])
+            except BackendError as e:
+                # التقدم قابل للفقد: التحديث التالي يحمل الحالة الكاملة
+                self.dropped += len(progress) + len(records)
+                print(f"State backend publish error: {e}")
+                self._stop.wait(self.reconnect_delay)
+
+    # --- الاشتراك ---
+
+    def _subscribe_loop(self):
+        while not self._stop.is_set():
+            try:
+                sock, rfile = self._connect()
+            except (OSError, BackendError) as e:
+                print(f"State backend connect error: {e}")
+                self._stop.wait(self.reconnect_delay)
+                continue
+            try:
+                _exchange(sock, rfile, {'op': 'subscribe'})
+                sock.settimeout(None)
+                self.connected = True
+                for line in rfile:
+                    self._dispatch(json.loads(line))
+            except (OSError, ValueError, BackendError) as e:
+                print(f"State backend subscription error: {e}")
+            finally:
+                self.connected = False
+                sock.close()
+            self._stop.wait(self.reconnect_delay)
+
+    def _dispatch(self, event):
+        if event['type'] == 'progress':
+            if event.get('origin') != self.origin:
+                self._hub.update(event['key'], event['state'], event.get('client_id'))
+        elif event['type'] == 'cancel':
+            if self._on_cancel:
+                try:
+                    self._on_cancel(event['key'])
+                except Exception as e:
+                    print(f"State backend cancel error: {e}")
+
+    # --- القراءة ---
+
+    def get(self, job_id):
+        try:
+            return self._request('get', key=job_id)
+        except BackendError as e:
+            print(f"State backend error: {e}")
+            return None
+
+    def get_record(self, kind, key):
+        try:
+            return self._request('record', kind=kind, key=key)
+        except BackendError as e:
+            print(f"State backend error: {e}")
+            return None
+
+    def cancel(self, job_id):
+        """بث إشارة إلغاء إلى جميع العمال (بما فيها هذا العامل عبر الاشتراك)"""
+        self._request('cancel', key=job_id, origin=self.origin)
+
+    def ping(self):
+        try:
+            self._request('ping')
+        except BackendError as e:
+            return {'ok': False, 'backend': 'network', 'error': str(e)}
+        return {'ok': True, 'backend': 'network', 'subscribed': self.connected, 'dropped': self.dropped}
+
+
+def create_backend(url, token=''):
+    """memory، أو tcp://host:port لخادم حالة مشترك"""
+    if not url or url == 'memory':
+        return MemoryBackend()
+    parts = urlsplit(url)
+    if parts.scheme != 'tcp' or not parts.hostname or not parts.port:
+        raise ValueError(f'unsupported state backend: {url}')
+    return NetworkBackend(parts.hostname, parts.port, token=token)
+
+
+class StateServer:
+    """
+    خادم الحالة المشترك. الحالات المنتهية والسجلات التي لم تُحدَّث منذ ttl ثانية تُحذف.
+    """
+
+    PRUNE_EVERY = 1024
+    SUBSCRIBER_QUEUE_SIZE = 4096
+    SEND_TIMEOUT = 30
+
+    def __init__(self, host='127.0.0.1', port=7070, token='', ttl=3600):
+        self.token = token
+        self.ttl = ttl
+        self._states = {}
+        self._records = {}
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._operations = 0
+        state = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                state._handle_connection(self)
+
+        self._server = socketserver.ThreadingTCPServer((host, port), Handler, bind_and_activate=False)
+        self._server.daemon_threads = True
+        self._server.allow_reuse_address = True
+        self._server.server_bind()
+        self._server.server_activate()
+        self.address = self._server.server_address
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='state-server', daemon=True).start()
+        return self
+
+    def shutdown(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handle_connection(self, handler):
+        authenticated = not self.token
+        for line in handler.rfile:
+            try:
+                message = json.loads(line)
+                op = message.get('op')
+                if op == 'auth':
+                    authenticated = hmac.compare_digest(str(message.get('token', '')), self.token)
+                    reply = {'result': 'ok'} if authenticated else {'error': 'invalid token'}
+                elif not authenticated:
+                    reply = {'error': 'authentication required'}
+                elif op == 'subscribe':
+                    _send(handler.connection, {'result': 'ok'})
+                    self._serve_subscriber(handler)
+                    return
+                else:
+                    reply = {'result': self._execute(op, message)}
+            except (ValueError, KeyError, TypeError) as e:
+                reply = {'error': f'bad request: {e}'}
+            try:
+                _send(handler.connection, reply)
+            except OSError:
+                return
+
+    def _serve_subscriber(self, handler):
+        """
+        إرسال الأحداث إلى مشترك من طابوره. البث لا يكتب في الاتصال مباشرة، فلا يبطئ مشترك
+        بطيء بقية العمال؛ المشترك الذي يمتلئ طابوره يُفصل ويعيد الاتصال.
+        """
+        subscriber = queue.Queue(maxsize=self.SUBSCRIBER_QUEUE_SIZE)
+        handler.connection.settimeout(self.SEND_TIMEOUT)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        try:
+            while True:
+                payload = subscriber.get()
+                if payload is None:
+                    return
+                handler.connection.sendall(payload)
+        except OSError:
+            pass
+        finally:
+            with self._lock:
+                self._subscribers.discard(subscriber)
+
+    def _broadcast(self, events):
+        payload = b''.join(json.dumps(event, ensure_ascii=False).encode('utf-8') + b'\n' for event in events)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(payload)
+            except queue.Full:
+                with self._lock:
+                    self._subscribers.discard(subscriber)
+                # إفراغ مكان لإشارة الإنهاء حتى يغلق thread المشترك الاتصال
+                try:
+                    subscriber.get_nowait()
+                except queue.Empty:
+                    pass
+                subscriber.put_nowait(None)
+
+    def _execute(self, op, message):
+        now = time.monotonic()
+        if op == 'publish':
+            events = []
+            with self._lock:
+                for job_id, state, client_id in message.get('progress', []):
+                    previous = self._states.get(job_id)
+                    client_id = client_id or (previous and previous[1])
+                    self._states[job_id] = (state, client_id, now)
+                    events.append({'type': 'progress', 'key': job_id, 'state': state, 'client_id': client_id,
+                                   'origin': message.get('origin')})
+                for kind, key, value in message.get('records', []):
+                    self._records[(kind, key)] = (value, now)
+                self._operations += 1
+                if self._operations % self.PRUNE_EVERY == 0:
+                    self._prune(now)
+            if events:
+                self._broadcast(events)
+            return len(events)
+        if op == 'get':
+            with self._lock:
+                entry = self._states.get(message['key'])
+            return entry[0] if entry else None
+        if op == 'record':
+            with self._lock:
+                entry = self._records.get((message['kind'], message['key']))
+            return entry[0] if entry else None
+        if op == 'cancel':
+            self._broadcast([{'type': 'cancel', 'key': message['key'], 'origin': message.get('origin')}])
+            return 'ok'
+        if op == 'ping':
+            with self._lock:
+                return {'jobs': len(self._states), 'records': len(self._records),
+                        'subscribers': len(self._subscribers)}
+        raise ValueError(f'unknown op {op}')
+
+    def _prune(self, now):
+        cutoff = now - self.ttl
+        for job_id in [job_id for job_id, (state, _, at) in self._states.items()
+                       if at < cutoff and state.get('status') in FINISHED_STATES]:
+            del self._states[job_id]
+        for key in [key for key, (_, at) in self._records.items() if at < cutoff]:
+            del self._records[key]
+
+
+if __name__ == '__main__':
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser(description='خادم الحالة المشترك بين عمال التطبيق')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7070)
+    parser.add_argument('--ttl', type=float, default=3600, help='ثوانٍ قبل حذف الحالات المنتهية')
+    args = parser.parse_args()
+    server = StateServer(args.host, args.port, token=os.environ.get('STATE_BACKEND_TOKEN', ''), ttl=args.ttl)
+    print(f'State server listening on {server.address[0]}:{server.address[1]}')
+    server.serve_forever()
@@ -0,0 +1,247 @@
+"""
+تخزين دائم لحالات الأعمال وتاريخ التحميلات في SQLite (وضع WAL).
+
+- الكتابة لا تحدث في مسار الطلب: record_job و add_history تضيفان إلى ذاكرة معلقة
+  (آخر حالة فقط لكل عمل) ويكتبها thread خلفي دفعة واحدة كل flush_interval ثانية
+- القراءة من اتصال لكل thread؛ وضع WAL يسمح بالقراءة أثناء الكتابة وبمشاركة الملف
+  بين عدة عمليات (عمال gunicorn)
+- الضغط الدوري يحذف ما تجاوز مدة الاحتفاظ ويعيد المساحة إلى نظام الملفات
+"""
+
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    client_id TEXT,
+    status TEXT NOT NULL,
+    progress REAL,
+    message TEXT,
+    state TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_updated_at ON jobs (updated_at);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, updated_at);
+CREATE INDEX IF NOT EXISTS jobs_client_id ON jobs (client_id, updated_at);
+
+CREATE TABLE IF NOT EXISTS history (
+    id TEXT PRIMARY KEY,
+    video_id TEXT,
+    title TEXT,
+    url TEXT,
+    quality TEXT,
+    download_path TEXT,
+    size INTEGER,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS history_created_at ON history (created_at);
+CREATE INDEX IF NOT EXISTS history_video_id ON history (video_id, created_at);
+'''
+
+UPSERT_JOB = '''
+INSERT INTO jobs (id, client_id, status, progress, message, state, updated_at)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (id) DO UPDATE SET
+    client_id = COALESCE(excluded.client_id, jobs.client_id),
+    status = excluded.status,
+    progress = excluded.progress,
+    message = excluded.message,
+    state = excluded.state,
+    updated_at = excluded.updated_at
+'''
+
+INSERT_HISTORY = '''
+INSERT OR REPLACE INTO history (id, video_id, title, url, quality, download_path, size, created_at)
+VALUES (:id, :video_id, :title, :url, :quality, :download_path, :size, :created_at)
+'''
+
+
+class JobStore:
+    def __init__(self, path, flush_interval=1.0, job_retention=7 * 86400, history_retention=90 * 86400,
+                 compact_interval=3600):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.job_retention = job_retention
+        self.history_retention = history_retention
+        self.compact_interval = compact_interval
+        self.flushes = 0
+        self.rows_written = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._pending_jobs = {}
+        self._pending_history = []
+        self._stop = threading.Event()
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        connection = self._connection()
+        if connection.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            # ملف أنشئ دون auto_vacuum (ضبطه لا يسري على ملف موجود إلا بعد VACUUM)
+            connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            connection.execute('VACUUM')
+        connection.executescript(SCHEMA)
+        self._next_compact = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name='job-store', daemon=True)
+        self._thread.start()
+        # كتابة ما تبقى معلقاً عند إيقاف الخادم
+        atexit.register(self.close)
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.row_factory = sqlite3.Row
+            # يجب ضبط auto_vacuum قبل أي كتابة في ملف جديد (بما فيها تفعيل WAL) حتى يعمل
+            # incremental_vacuum عند الضغط
+            connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('PRAGMA synchronous = NORMAL')
+            self._local.connection = connection
+        return connection
+
+    # --- الكتابة المؤجلة ---
+
+    def record_job(self, job_id, state, client_id=None):
+        """تسجيل آخر حالة لعمل (التحديثات المتتالية قبل الكتابة تُدمج في صف واحد)"""
+        with self._lock:
+            self._pending_jobs[job_id] = (state, client_id, time.time())
+
+    def add_history(self, item):
+        with self._lock:
+            self._pending_history.append(item)
+
+    def flush(self):
+        """كتابة كل ما هو معلق في معاملة واحدة"""
+        with self._lock:
+            jobs, self._pending_jobs = self._pending_jobs, {}
+            history, self._pending_history = self._pending_history, []
+        job_rows = [self._job_row(job_id, *pending) for job_id, pending in jobs.items()]
+        if not job_rows and not history:
+            return
+        with self._write_lock:
+            connection = self._connection()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                connection.executemany(UPSERT_JOB, job_rows)
+                connection.executemany(INSERT_HISTORY, [self._history_row(item) for item in history])
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+        self.flushes += 1
+        self.rows_written += len(job_rows) + len(history)
+
+    @staticmethod
+    def _job_row(job_id, state, client_id, updated_at):
+        return (job_id, client_id, state.get('status') or 'unknown', state.get('progress'), state.get('message'),
+                json.dumps(state, ensure_ascii=False), updated_at)
+
+    @staticmethod
+    def _history_row(item):
+        return {key: item.get(key) for key in
+                ('id', 'video_id', 'title', 'url', 'quality', 'download_path', 'size', 'created_at')}
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+                if time.monotonic() >= self._next_compact:
+                    self._next_compact = time.monotonic() + self.compact_interval
+                    self.compact()
+            except sqlite3.Error as e:
+                print(f"Job store error: {e}")
+
+    def close(self):
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self.flush()
+
+    # --- القراءة ---
+
+    def get_job(self, job_id):
+        """آخر حالة معروفة للعمل (المعلقة أولاً ثم المكتوبة)، أو None"""
+        with self._lock:
+            pending = self._pending_jobs.get(job_id)
+            if pending is not None:
+                return pending[0]
+        row = self._connection().execute('SELECT state FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return json.loads(row['state']) if row else None
+
+    def query_jobs(self, client_id=None, status=None, limit=20, offset=0):
+        """أعمال عميل (الأحدث أولاً) مع إمكانية التصفية بالحالة -> (العناصر، العدد الكلي)"""
+        self.flush()
+        where, params = _where([('client_id = ?', client_id), ('status = ?', status)])
+        return self._page('jobs', where, params, 'updated_at', limit, offset, _job_from_row)
+
+    def query_history(self, video_id=None, search=None, since=None, until=None, limit=20, offset=0):
+        """تاريخ التحميلات (الأحدث أولاً) مع التصفية -> (العناصر، العدد الكلي)"""
+        self.flush()
+        where, params = _where([
+            ('video_id = ?', video_id),
+            ("title LIKE ? ESCAPE '\\'", f"%{_escape_like(search)}%" if search else None),
+            ('created_at >= ?', since),
+            ('created_at < ?', until),
+        ])
+        return self._page('history', where, params, 'created_at', limit, offset, _history_from_row)
+
+    def _page(self, table, where, params, order_by, limit, offset, convert):
+        connection = self._connection()
+        total = connection.execute(f'SELECT COUNT(*) FROM {table}{where}', params).fetchone()[0]
+        rows = connection.execute(f'SELECT * FROM {table}{where} ORDER BY {order_by} DESC LIMIT ? OFFSET ?',
+                                  [*params, limit, offset]).fetchall()
+        return [convert(row) for row in rows], total
+
+    def clear_history(self):
+        with self._lock:
+            self._pending_history = []
+        with self._write_lock:
+            self._connection().execute('DELETE FROM history')
+
+    # --- الضغط ---
+
+    def compact(self):
+        """حذف الأعمال والتاريخ الأقدم من مدة الاحتفاظ وإعادة المساحة -> عدد الصفوف المحذوفة"""
+        now = time.time()
+        with self._write_lock:
+            connection = self._connection()
+            deleted = connection.execute('DELETE FROM jobs WHERE updated_at < ?',
+                                         (now - self.job_retention,)).rowcount
+            deleted += connection.execute('DELETE FROM history WHERE created_at < ?',
+                                          (now - self.history_retention,)).rowcount
+            if deleted:
+                # incremental_vacuum يحرر صفحة واحدة في كل خطوة، و execute تنفذ خطوة واحدة فقط
+                # لأنه لا يعيد أعمدة؛ executescript تنفذه حتى النهاية
+                connection.executescript('PRAGMA incremental_vacuum;')
+            connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        return deleted
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending_jobs) + len(self._pending_history)
+        return {'pending': pending, 'flushes': self.flushes, 'rows_written': self.rows_written}
+
+
+def _where(conditions):
+    clauses = [(clause, value) for clause, value in conditions if value is not None]
+    if not clauses:
+        return '', []
+    return ' WHERE ' + ' AND '.join(clause for clause, _ in clauses), [value for _, value in clauses]
+
+
+def _escape_like(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _job_from_row(row):
+    return dict(json.loads(row['state']), id=row['id'])
+
+
+def _history_from_row(row):
+    return dict(row, timestamp=datetime.fromtimestamp(row['created_at']).isoformat())
@@ -0,0 +1,72 @@
+"""
+أدوات الترجمات.
+
+- list_subtitles: قائمة الترجمات المتاحة من معلومات الفيديو (اليدوية أولاً ثم التلقائية)
+- choose_subtitle_format: اختيار صيغة ملف الترجمة من الصيغ المتاحة للغة
+- read_subtitle_folder: منتج للذاكرة المؤقتة يقرأ ملف الترجمة الذي كتبه yt-dlp ثم يحذف مجلده
+"""
+
+import os
+import shutil
+
+from extractor import ExtractionError
+
+# الصيغ المفضلة عند عدم طلب صيغة متاحة
+PREFERRED_FORMATS = ('srt', 'vtt')
+
+MIMETYPES = {'srt': 'application/x-subrip', 'vtt': 'text/vtt'}
+
+
+def subtitle_tracks(video_data, lang_code):
+    """صيغ ترجمة اللغة المتاحة (اليدوية إن وجدت، وإلا التلقائية)"""
+    for section in ('subtitles', 'automatic_captions'):
+        tracks = (video_data.get(section) or {}).get(lang_code)
+        if tracks:
+            return tracks
+    return []
+
+
+def list_subtitles(video_data):
+    """الترجمات اليدوية أولاً ثم التلقائية (نفس ترتيب --list-subs)"""
+    subtitles = []
+    seen_codes = set()
+    for section in ('subtitles', 'automatic_captions'):
+        for lang_code, tracks in (video_data.get(section) or {}).items():
+            if lang_code in seen_codes or not tracks:
+                continue
+            seen_codes.add(lang_code)
+            subtitles.append({
+                'code': lang_code,
+                'name': next((t.get('name') for t in tracks if t.get('name')), lang_code),
+                'automatic': section == 'automatic_captions',
+                'formats': [t.get('ext') for t in tracks if t.get('ext')],
+                'available': True
+            })
+    return subtitles
+
+
+def choose_subtitle_format(tracks, requested=None):
+    """الصيغة المطلوبة إن كانت متاحة، وإلا أول صيغة مفضلة متاحة، وإلا أول صيغة"""
+    formats = [t.get('ext') for t in tracks if t.get('ext')]
+    for ext in (requested, *PREFERRED_FORMATS):
+        if ext and ext in formats:
+            return ext
+    return formats[0] if formats else None
+
+
+def read_subtitle_folder(folder, chunk_size=64 * 1024):
+    """
+    مولد لمحتوى ملف الترجمة الوحيد في مجلد تحميل مؤقت، يحذف المجلد عند الانتهاء.
+    """
+    try:
+        names = [name for name in os.listdir(folder) if not name.endswith('.part')]
+        if not names:
+            raise ExtractionError('yt-dlp failed', 'No subtitle file was written')
+        with open(os.path.join(folder, names[0]), 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
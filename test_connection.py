@@ -8,33 +8,54 @@ import sys
 import json
 import requests
 
+from capabilities import check_folder, check_ffmpeg, check_version
+
+# نفس الحد الافتراضي الذي يستخدمه التطبيق للجاهزية
+MIN_FREE_DISK_BYTES = 1024 ** 3
+
 def test_yt_dlp():
     """فحص وجود yt-dlp"""
-    try:
-        result = subprocess.run(['yt-dlp', '--version'], capture_output=True, text=True, check=True)
-        print(f"✅ yt-dlp مثبت بنجاح - الإصدار: {result.stdout.strip()}")
+    result = check_version(['yt-dlp', '--version'])
+    if result['ok']:
+        print(f"✅ yt-dlp مثبت بنجاح - الإصدار: {result['version']}")
         return True
-    except FileNotFoundError:
+    if result['error'] == 'not installed':
         print("❌ yt-dlp غير مثبت")
         print("💡 قم بتثبيته باستخدام: pip install yt-dlp")
-        return False
-    except subprocess.CalledProcessError as e:
-        print(f"❌ خطأ في yt-dlp: {e}")
-        return False
+    else:
+        print(f"❌ خطأ في yt-dlp: {result['error']}")
+    return False
 
 def test_ffmpeg():
-    """فحص وجود ffmpeg"""
-    try:
-        result = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True, check=True)
-        print("✅ ffmpeg متوفر - يمكن تحويل الصوت والفيديو")
-        return True
-    except FileNotFoundError:
-        print("⚠️ ffmpeg غير مثبت - بعض الميزات قد لا تعمل")
-        print("💡 قم بتثبيته من: https://ffmpeg.org/download.html")
+    """فحص وجود ffmpeg و ffprobe والمرمزات المطلوبة"""
+    result = check_ffmpeg()
+    if not result['ok']:
+        if result['error'] == 'not installed':
+            print("⚠️ ffmpeg غير مثبت - بعض الميزات قد لا تعمل")
+            print("💡 قم بتثبيته من: https://ffmpeg.org/download.html")
+        else:
+            print("⚠️ ffmpeg لا يعمل بشكل صحيح")
         return False
-    except subprocess.CalledProcessError:
-        print("⚠️ ffmpeg لا يعمل بشكل صحيح")
+    print("✅ ffmpeg متوفر - يمكن تحويل الصوت والفيديو")
+    if not result['ffprobe']:
+        print("⚠️ ffprobe غير مثبت")
+    missing = [name for name, available in result['encoders'].items() if not available]
+    if missing:
+        print(f"⚠️ مرمزات غير متاحة في ffmpeg: {', '.join(missing)} - بعض صيغ التحويل لن تعمل")
+    return True
+
+def test_downloads_folder():
+    """فحص قابلية الكتابة في مجلد التحميلات والمساحة الحرة"""
+    result = check_folder('downloads', MIN_FREE_DISK_BYTES)
+    if not result['writable']:
+        print("❌ لا يمكن الكتابة في مجلد التحميلات")
         return False
+    free_gb = (result['free_bytes'] or 0) / 1024 ** 3
+    if not result['ok']:
+        print(f"⚠️ المساحة الحرة قليلة: {free_gb:.1f} GB")
+        return False
+    print(f"✅ مجلد التحميلات قابل للكتابة - المساحة الحرة: {free_gb:.1f} GB")
+    return True
 
 def test_youtube_access():
     """فحص الوصول إلى يوتيوب"""
@@ -121,6 +142,11 @@ def main():
     ffmpeg_ok = test_ffmpeg()
     tests.append(ffmpeg_ok)
     print()
+
+    # فحص مجلد التحميلات
+    print("💾 فحص مجلد التحميلات...")
+    tests.append(test_downloads_folder())
+    print()
     
     # فحص الوصول إلى يوتيوب
     if yt_dlp_ok and internet_ok:
@@ -0,0 +1,23 @@
+"""
+إعداد مشترك للاختبارات: وحدات المشروع من الجذر، وبيانات القياس الوهمية (fake_media
+و yt_dlp الوهمية من benchmarks/stub) حتى تعمل الاختبارات دون اتصال بالإنترنت.
+"""
+
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault('FAKE_YTDLP_LATENCY', '0')
+sys.path[:0] = [os.path.join(ROOT, 'benchmarks', 'stub'), os.path.join(ROOT, 'benchmarks'), ROOT]
+
+
+def wait_until(condition, timeout=5.0, interval=0.01):
+    """انتظار تحقق شرط من thread آخر، وإرجاع آخر قيمة له"""
+    deadline = time.monotonic() + timeout
+    while True:
+        result = condition()
+        if result or time.monotonic() >= deadline:
+            return result
+        time.sleep(interval)
@@ -0,0 +1,176 @@
+"""اختبارات محرك التحميل المتعدد: إعادة المحاولة والتأخير المتزايد والإلغاء"""
+
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import batch as batch_module
+from batch import BatchEngine
+from conftest import wait_until
+from extractor import DownloadCancelledError, ExtractionError
+
+
+@pytest.fixture
+def backoffs(monkeypatch):
+    """تسجيل مدد الانتظار بين المحاولات بدل انتظارها فعلاً"""
+    waits = []
+
+    class RecordingEvent(threading.Event):
+        def wait(self, timeout=None):
+            if self.is_set():
+                return True
+            waits.append(timeout)
+            return False
+
+    class RecordingBatch(batch_module.Batch):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.cancel_event = RecordingEvent()
+
+    monkeypatch.setattr(batch_module, 'Batch', RecordingBatch)
+    return waits
+
+
+def finish(batch):
+    assert batch.done.wait(5)
+    return batch.to_dict()
+
+
+def test_items_complete_and_report_progress():
+    updates, done = [], []
+
+    def download(item, format_spec, on_progress, cancel_event):
+        on_progress(50, 100)
+        on_progress(100, 100)
+        return f'/downloads/{item.index}.{format_spec}'
+
+    engine = BatchEngine(download, max_workers=2, on_update=lambda b: updates.append(b.status),
+                         on_item_done=lambda b, item: done.append(item.index), update_interval=0)
+    result = finish(engine.submit(['a', 'b', 'c'], format_spec='mp4', concurrency=2))
+
+    assert result['status'] == 'completed'
+    assert result['progress'] == 100
+    assert result['counts'] == {'completed': 3}
+    assert [item['filepath'] for item in result['items']] == ['/downloads/0.mp4', '/downloads/1.mp4', '/downloads/2.mp4']
+    assert sorted(done) == [0, 1, 2]
+    assert updates[-1] == 'completed'
+
+
+def test_item_done_hook_failure_keeps_item_completed():
+    attempts = []
+
+    def download(item, format_spec, on_progress, cancel_event):
+        attempts.append(item.url)
+        return '/downloads/ok'
+
+    def record(batch, item):
+        raise OSError('database is locked')
+
+    engine = BatchEngine(download, max_retries=2, on_item_done=record)
+    result = finish(engine.submit(['a']))
+
+    # العنصر حُمّل مرة واحدة ولا يُعاد تحميله بسبب فشل تسجيله
+    assert attempts == ['a']
+    assert result['status'] == 'completed'
+    assert result['items'][0]['status'] == 'completed'
+    assert result['items'][0]['error'] is None
+
+
+def test_failed_item_is_retried_with_growing_backoff(backoffs):
+    attempts = []
+
+    def download(item, format_spec, on_progress, cancel_event):
+        attempts.append(item.url)
+        if len(attempts) < 3:
+            raise ExtractionError('yt-dlp failed', 'HTTP Error 503')
+        return '/downloads/ok'
+
+    engine = BatchEngine(download, max_retries=2, retry_backoff=1.5)
+    result = finish(engine.submit(['a']))
+
+    assert result['status'] == 'completed'
+    assert result['items'][0]['attempts'] == 3
+    assert result['items'][0]['error'] is None
+    assert backoffs == [1.5, 3.0]
+
+
+def test_item_fails_after_max_retries(backoffs):
+    def download(item, format_spec, on_progress, cancel_event):
+        if item.url == 'bad':
+            raise ExtractionError('yt-dlp failed', 'ERROR: Private video')
+        return '/downloads/ok'
+
+    engine = BatchEngine(download, max_retries=1, retry_backoff=2)
+    result = finish(engine.submit(['bad', 'good'], concurrency=1))
+
+    bad, good = result['items']
+    assert bad['status'] == 'error'
+    assert bad['attempts'] == 2
+    assert bad['error'] == 'ERROR: Private video'
+    assert good['status'] == 'completed'
+    assert result['status'] == 'completed'
+    assert backoffs == [2]
+
+    result = finish(engine.submit(['bad']))
+    assert result['status'] == 'error'
+
+
+def test_cancel_stops_running_and_queued_items():
+    started = threading.Event()
+
+    def download(item, format_spec, on_progress, cancel_event):
+        started.set()
+        if cancel_event.wait(5):
+            raise DownloadCancelledError('تم إلغاء التحميل')
+        return '/downloads/ok'
+
+    engine = BatchEngine(download, max_workers=1, batch_concurrency=1)
+    batch = engine.submit(['a', 'b', 'c'])
+    assert started.wait(5)
+    assert batch.status == 'downloading'
+
+    assert engine.cancel(batch.id) is batch
+    result = finish(batch)
+
+    assert result['status'] == 'cancelled'
+    assert result['counts'] == {'cancelled': 3}
+    assert [item['attempts'] for item in result['items']] == [1, 0, 0]
+    assert engine.cancel('missing') is None
+
+
+def test_cancel_interrupts_retry_backoff():
+    failed = threading.Event()
+
+    def download(item, format_spec, on_progress, cancel_event):
+        failed.set()
+        raise ExtractionError('yt-dlp failed', 'HTTP Error 503')
+
+    engine = BatchEngine(download, max_retries=5, retry_backoff=60)
+    batch = engine.submit(['a'])
+    assert failed.wait(5)
+    assert wait_until(lambda: batch.items[0].status == 'retrying')
+
+    engine.cancel(batch.id)
+    result = finish(batch)
+    assert result['status'] == 'cancelled'
+    assert result['items'][0]['attempts'] == 1
+
+
+def test_finished_batches_are_pruned_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(batch_module, 'time', SimpleNamespace(monotonic=lambda: now[0]))
+    engine = BatchEngine(lambda *args: '/downloads/ok', finished_ttl=60)
+
+    old = engine.submit(['a'])
+    finish(old)
+    now[0] += 30
+    recent = engine.submit(['b'])
+    assert engine.get(old.id) is old
+
+    finish(recent)
+    now[0] += 45
+    engine.submit(['c'])
+    # الدفعة الأولى انتهت قبل أكثر من 60 ثانية، والثانية لم تتجاوزها بعد
+    assert engine.get(old.id) is None
+    assert engine.get(recent.id) is recent
@@ -0,0 +1,89 @@
+"""اختبارات محرك الاستخراج داخل العملية مع yt_dlp الوهمية (benchmarks/stub)"""
+
+import pytest
+
+import fake_media
+from extractor import ExtractionError, InProcessEngine, normalize_video_id
+
+PLAYLIST_URL = 'https://www.youtube.com/playlist?list=PLbenchmark'
+
+
+@pytest.fixture
+def engine():
+    engine = InProcessEngine(pool_size=2)
+    yield engine
+    engine.close()
+
+
+@pytest.fixture
+def pulled(engine, monkeypatch):
+    """عناصر القائمة تُعاد كمولد يسجل ما سُحب منه، كما يفعل yt-dlp مع process=False"""
+    pulled = []
+    extract_info = engine._yt_dlp.YoutubeDL.extract_info
+
+    def lazy_extract_info(self, url, download=True, process=True):
+        info = extract_info(self, url, download=download, process=process)
+        if not process and info.get('_type') == 'playlist':
+            entries = list(info['entries'])
+
+            def generate():
+                for entry in entries:
+                    pulled.append(entry['id'])
+                    yield entry
+            info['entries'] = generate()
+        return info
+
+    monkeypatch.setattr(engine._yt_dlp.YoutubeDL, 'extract_info', lazy_extract_info)
+    return pulled
+
+
+def test_iter_flat_yields_each_entry_as_it_is_fetched(engine, pulled):
+    entries = engine.iter_flat(PLAYLIST_URL)
+
+    first = next(entries)
+    assert len(pulled) == 1
+    assert first['id'] == pulled[0]
+    entries.close()
+
+
+def test_iter_flat_range_matches_playlist_items(engine, pulled):
+    expected = [entry['id'] for entry in fake_media.flat_entries(PLAYLIST_URL, '3:5')]
+
+    assert [entry['id'] for entry in engine.iter_flat(PLAYLIST_URL, 3, 5)] == expected
+    # التعداد يتوقف عند نهاية النطاق
+    assert len(pulled) == 5
+    assert len(list(engine.iter_flat(PLAYLIST_URL, 48))) == fake_media.PLAYLIST_SIZE - 47
+
+
+def test_iter_flat_single_video_returns_full_info(engine):
+    [info] = engine.iter_flat('https://youtu.be/abcdefghijk')
+
+    assert info['id'] == 'abcdefghijk'
+    assert info['formats']
+
+
+def test_search_in_progress_does_not_hold_pooled_instance(engine, pulled):
+    results = engine.iter_search('lofi', 5)
+    first = next(results)
+
+    # نتائج البحث المعلقة لا تحجز نسخة من المجموعة، فيبقى الاستخراج متاحاً لبقية الطلبات
+    assert engine._pool.qsize() == engine.pool_size
+    assert engine.extract_info(first['url'])['id'] == first['id']
+    assert len([first, *results]) == 5
+    assert engine._pool.qsize() == engine.pool_size
+
+
+def test_extraction_errors_are_wrapped(engine):
+    url = 'https://www.youtube.com/watch?v=xprivate000'
+    with pytest.raises(ExtractionError) as error:
+        list(engine.iter_flat(url))
+    assert 'Private video' in error.value.stderr
+    with pytest.raises(ExtractionError) as error:
+        engine.extract_info(url)
+    assert 'Private video' in error.value.stderr
+
+
+def test_normalize_video_id():
+    assert normalize_video_id(' https://youtu.be/abcdefghijk ') == 'youtube:abcdefghijk'
+    assert normalize_video_id('https://www.youtube.com/shorts/abcdefghijk?feature=share') == 'youtube:abcdefghijk'
+    assert normalize_video_id('https://Example.com/v/1#t=5') == 'url:https://example.com/v/1'
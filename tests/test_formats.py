@@ -0,0 +1,109 @@
+"""اختبارات فهرس الصيغ واختيار الصيغة بتعبير الاختيار (FormatIndex.select)"""
+
+import pytest
+
+import fake_media
+from formats import SelectorError, build_format_index
+
+SIZE = fake_media.MEDIA_SIZE
+
+
+@pytest.fixture(scope='module')
+def index():
+    # صيغ فيديو وهمي بنفس بنية yt-dlp: مدمجة 18 و 22، فيديو فقط 134/136/137، صوت فقط 140/251
+    return build_format_index(fake_media.video_info('abcdefghijk'))
+
+
+def spec(index, selector):
+    selection = index.select(selector)
+    return selection and selection.format_spec
+
+
+def test_best_prefers_pair_merged_into_same_container(index):
+    selection = index.select('best')
+    # 137 هو الأعلى ارتفاعاً، و 140 (m4a) يُدمج في mp4 فيُفضل على 251 الأعلى جودة
+    assert selection.format_ids == ['137', '140']
+    assert selection.format_spec == '137+140'
+    assert selection.ext == 'mp4'
+    assert selection.size == int(SIZE * 1.6) + int(SIZE * 0.1)
+
+
+def test_kind_selectors(index):
+    assert spec(index, 'bestvideo') == '137'
+    assert spec(index, 'bestaudio') == '251'
+    assert spec(index, 'worstvideo') == '134'
+    assert spec(index, 'worstaudio') == '140'
+    # الأزواج تُرتب بجودة الفيديو ثم توافق الحاوية ثم جودة الصوت
+    assert spec(index, 'worst') == '134+251'
+    assert spec(index, 'worst[ext=mp4]') == '134+140'
+
+
+def test_filters(index):
+    # 22 المدمجة بمعدل بت أعلى من زوج 136+140 بنفس الارتفاع
+    assert spec(index, 'best[height<=720]') == '22'
+    assert spec(index, 'best[height<=720p]') == '22'
+    assert spec(index, 'bestaudio[acodec=aac]') == '140'
+    assert spec(index, 'bestaudio[acodec=mp4a.40.2]') == '140'
+    assert spec(index, 'bestvideo[vcodec=h264][height<1080]') == '136'
+    assert spec(index, 'bestaudio[ext!=webm]') == '140'
+    # 22 و أزواج 136 أكبر من الحد، و 18 أعلى معدل بت للفيديو من 134
+    assert spec(index, f'best[height<=720][filesize<{int(SIZE * 0.5)}]') == '18'
+
+
+def test_size_units(index):
+    assert index.select('bestvideo[size<1k]') is None
+    assert spec(index, f'bestvideo[filesize<={SIZE / 1024 ** 2:.1f}MiB]') == '136'
+
+
+def test_alternatives_fall_through_in_order(index):
+    assert spec(index, 'bestvideo[vcodec=vp9]/bestaudio[acodec=opus]') == '251'
+    assert spec(index, 'best[height>=1080] / best') == '137+140'
+    assert index.select('best[height>2160]/bestvideo[vcodec=av1]') is None
+
+
+@pytest.mark.parametrize('selector', ['bestest', 'best[foo=1]', 'best[height<=abc]', 'best[vcodec>h264]',
+                                      'best[filesize<10X]', 'best[height<=720', 'best/'])
+def test_invalid_selectors(index, selector):
+    with pytest.raises(SelectorError):
+        index.select(selector)
+
+
+def test_missing_fields_are_derived_or_never_match():
+    index = build_format_index({'duration': 100, 'formats': [
+        # الارتفاع من الوصف، والحجم من معدل البت والمدة
+        {'format_id': 'a', 'ext': 'mp4', 'vcodec': 'avc1', 'acodec': 'mp4a', 'format_note': '720p60', 'tbr': 800},
+        {'format_id': 'b', 'ext': 'mp4', 'vcodec': 'avc1', 'acodec': 'mp4a'},
+        {'format_id': 'sb0', 'ext': 'mhtml', 'vcodec': 'none', 'acodec': 'none'},
+    ]})
+
+    assert [fmt.format_id for fmt in index.formats] == ['a', 'b']
+    assert index.by_id['a'].height == 720
+    assert index.by_id['a'].size == 800 * 1000 / 8 * 100
+    assert spec(index, 'best[height=720]') == 'a'
+    # حقل غير معروف لا يطابق أي شرط
+    assert spec(index, 'worst[height<=720]') == 'a'
+    assert spec(index, 'worst') == 'b'
+
+
+def test_equal_quality_prefers_smaller_file():
+    index = build_format_index({'formats': [
+        {'format_id': 'large', 'ext': 'mp4', 'vcodec': 'avc1', 'acodec': 'mp4a', 'height': 720, 'tbr': 1000,
+         'filesize': 2000},
+        {'format_id': 'small', 'ext': 'mp4', 'vcodec': 'avc1', 'acodec': 'mp4a', 'height': 720, 'tbr': 1000,
+         'filesize': 1000},
+    ]})
+
+    assert spec(index, 'best') == 'small'
+    assert spec(index, 'worst') == 'small'
+
+
+def test_unmergeable_pair_uses_mkv():
+    index = build_format_index({'formats': [
+        {'format_id': 'v', 'ext': 'webm', 'vcodec': 'vp9', 'acodec': 'none', 'height': 1080},
+        {'format_id': 'a', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'abr': 128},
+    ]})
+
+    selection = index.select('best')
+    assert selection.format_spec == 'v+a'
+    assert selection.ext == 'mkv'
+    assert selection.size is None
@@ -0,0 +1,247 @@
+"""اختبارات ذاكرة الوسائط على القرص: الملء، والقراءة أثناء الملء، والإخلاء، والاستكمال"""
+
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+
+from conftest import wait_until
+from media_cache import IncompleteMediaError, MediaCache, media_key
+
+DATA = bytes(range(256)) * 40
+
+
+def chunks_of(data, size=1024):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class Source:
+    """
+    منتج يعيد البيانات بدءاً من offset. fail_after: عدد البايتات قبل انقطاع كل محاولة،
+    و gate حدث ينتظره قبل كل جزء، و hold_after عدد البايتات التي يتوقف بعدها حتى يُلغى.
+    """
+
+    def __init__(self, data=DATA, fail_after=None, gate=None, hold_after=None):
+        self.data = data
+        self.fail_after = fail_after
+        self.gate = gate
+        self.hold_after = hold_after
+        self.offsets = []
+        self.cancelled = False
+
+    def __call__(self, offset=0):
+        self.offsets.append(offset)
+        self._chunks = self._iterate(offset, self.fail_after.pop(0) if self.fail_after else None)
+        return self
+
+    def __iter__(self):
+        return self._chunks
+
+    def _iterate(self, offset, fail_after):
+        sent = 0
+        for chunk in chunks_of(self.data[offset:]):
+            if self.gate is not None:
+                self.gate.wait(5)
+            if self.hold_after is not None and sent >= self.hold_after:
+                wait_until(lambda: self.cancelled)
+            if self.cancelled:
+                return
+            if fail_after is not None and sent >= fail_after:
+                raise ConnectionError('connection reset by peer')
+            sent += len(chunk)
+            yield chunk
+
+    def cancel(self):
+        self.cancelled = True
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return MediaCache(str(tmp_path), chunk_size=1000, retry_delay=0)
+
+
+def read_all(stream):
+    return b''.join(stream)
+
+
+def test_fill_then_serve_from_disk(cache):
+    key = media_key('youtube:abc', '18')
+    source = Source()
+
+    stream, started = cache.open_stream(key, source, meta={'mimetype': 'video/mp4'})
+    assert started
+    assert read_all(stream) == DATA
+    assert wait_until(lambda: not cache.is_filling(key))
+
+    cached = cache.get(key)
+    assert cached.size == len(DATA)
+    assert cached.meta['mimetype'] == 'video/mp4'
+    with open(cached.path, 'rb') as f:
+        assert f.read() == DATA
+
+    stream, started = cache.open_stream(key, Source(), start=100)
+    assert not started
+    assert read_all(stream) == DATA[100:]
+    assert source.offsets == [0]
+    assert cache.stats()['fills'] == 1
+
+
+def test_concurrent_readers_attach_to_running_fill(cache):
+    key = media_key('youtube:abc', '22')
+    gate = threading.Event()
+    source = Source(gate=gate)
+
+    first, started = cache.open_stream(key, source)
+    second, attached_started = cache.open_stream(key, Source(), start=5000)
+    assert started and not attached_started
+    assert cache.stats()['attached'] == 1
+
+    results = {}
+    readers = [threading.Thread(target=lambda: results.__setitem__('first', read_all(first))),
+               threading.Thread(target=lambda: results.__setitem__('second', read_all(second)))]
+    for reader in readers:
+        reader.start()
+    gate.set()
+    for reader in readers:
+        reader.join(5)
+
+    assert results == {'first': DATA, 'second': DATA[5000:]}
+    assert source.offsets == [0]
+    assert cache.get(key).size == len(DATA)
+
+
+def test_last_reader_leaving_cancels_fill(cache):
+    key = media_key('youtube:abc', '137')
+    source = Source(hold_after=1024)
+
+    stream, _ = cache.open_stream(key, source)
+    next(stream)
+    stream.close()
+
+    assert wait_until(lambda: not cache.is_filling(key))
+    assert source.cancelled
+    # لا يُقدَّم ملف ناقص على أنه مكتمل
+    assert cache.get(key) is None
+    assert os.listdir(os.path.dirname(cache._path(key, '.part'))) == []
+
+
+def test_oldest_entries_are_evicted_over_limit(tmp_path):
+    cache = MediaCache(str(tmp_path), max_bytes=len(DATA) * 2)
+    keys = [media_key(f'youtube:{name}', '18') for name in 'abc']
+
+    for key in keys[:2]:
+        read_all(cache.open_stream(key, Source())[0])
+        assert wait_until(lambda: not cache.is_filling(key))
+    # الأول استُخدم مؤخراً، فالثاني هو الأقدم استخداماً
+    assert cache.get(keys[0]) is not None
+
+    read_all(cache.open_stream(keys[2], Source())[0])
+    # الإخلاء يجري بعد انتهاء عملية الملء، و get تحدّث ترتيب الاستخدام فلا تُستدعى قبله
+    assert wait_until(lambda: not os.path.exists(cache._path(keys[1], '.bin')))
+
+    assert not os.path.exists(cache._path(keys[1], '.json'))
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[2]) is not None
+
+
+def test_usage_order_survives_restart(tmp_path):
+    cache = MediaCache(str(tmp_path), max_bytes=len(DATA) * 2)
+    keys = [media_key(f'youtube:{name}', '18') for name in 'abc']
+    for key in keys[:2]:
+        read_all(cache.open_stream(key, Source())[0])
+        assert wait_until(lambda: not cache.is_filling(key))
+    # الفهرس يُبنى من أوقات التعديل عند البدء
+    now = time.time()
+    os.utime(cache._path(keys[0], '.bin'), (now, now))
+    os.utime(cache._path(keys[1], '.bin'), (now - 60, now - 60))
+
+    cache = MediaCache(str(tmp_path), max_bytes=len(DATA) * 2)
+    read_all(cache.open_stream(keys[2], Source())[0])
+    assert wait_until(lambda: not os.path.exists(cache._path(keys[1], '.bin')))
+    assert cache.get(keys[0]) is not None
+
+
+def test_interrupted_source_is_resumed_within_fill(cache):
+    key = media_key('youtube:abc', '140')
+    source = Source(fail_after=[3072, 2048])
+
+    stream, _ = cache.open_stream(key, source, resumable=True, size=len(DATA))
+
+    assert read_all(stream) == DATA
+    assert source.offsets == [0, 3072, 5120]
+    assert cache.stats()['resumes'] == 2
+    assert wait_until(lambda: cache.get(key) is not None)
+
+
+def test_partial_file_is_resumed_by_next_fill(tmp_path):
+    cache = MediaCache(str(tmp_path), retries=0)
+    key = media_key('youtube:abc', '251')
+
+    stream, _ = cache.open_stream(key, Source(fail_after=[4096]), resumable=True, size=len(DATA))
+    with pytest.raises(ConnectionError):
+        read_all(stream)
+    assert wait_until(lambda: not cache.is_filling(key))
+    assert os.path.getsize(cache._path(key, '.partial')) == 4096
+    assert cache.get(key) is None
+
+    # عملية الملء التالية (ولو بعد إعادة التشغيل) تكمل من آخر بايت محفوظ
+    cache = MediaCache(str(tmp_path), retries=0)
+    source = Source()
+    stream, started = cache.open_stream(key, source, resumable=True, size=len(DATA))
+    assert started
+    assert read_all(stream) == DATA
+    assert source.offsets == [4096]
+    assert wait_until(lambda: cache.get(key) is not None)
+    assert not os.path.exists(cache._path(key, '.partial'))
+
+
+def test_source_ending_early_is_not_committed(tmp_path):
+    cache = MediaCache(str(tmp_path), retries=0)
+    key = media_key('youtube:abc', '136')
+
+    stream, _ = cache.open_stream(key, Source(data=DATA[:6000]), resumable=True, size=len(DATA))
+    with pytest.raises(IncompleteMediaError):
+        read_all(stream)
+    assert wait_until(lambda: not cache.is_filling(key))
+    assert cache.get(key) is None
+    assert os.path.getsize(cache._path(key, '.partial')) == 6000
+
+
+def test_stale_part_files_are_removed_at_startup(tmp_path):
+    key = media_key('youtube:abc', '18')
+    part = tmp_path / key[:2] / (key + '.part')
+    partial = tmp_path / key[:2] / (key + '.partial')
+    # ملف تملؤه عملية أخرى تشترك في نفس المجلد الآن
+    filling = tmp_path / key[:2] / (media_key('youtube:abc', '22') + '.part')
+    part.parent.mkdir()
+    part.write_bytes(b'left over')
+    partial.write_bytes(b'kept')
+    filling.write_bytes(b'in progress')
+    old = time.time() - 7200
+    os.utime(part, (old, old))
+
+    MediaCache(str(tmp_path))
+
+    assert not part.exists()
+    assert partial.read_bytes() == b'kept'
+    assert filling.read_bytes() == b'in progress'
+
+
+def test_async_readers_share_one_fill(cache):
+    key = media_key('youtube:abc', '18')
+    source = Source()
+
+    async def read(stream):
+        return b''.join([chunk async for chunk in stream])
+
+    async def main():
+        first, started = cache.open_stream_async(key, source)
+        second, attached_started = cache.open_stream_async(key, Source(), start=1000)
+        assert started and not attached_started
+        return await asyncio.gather(read(first), read(second))
+
+    assert asyncio.run(main()) == [DATA, DATA[1000:]]
+    assert source.offsets == [0]
+    assert cache.get(key).size == len(DATA)
@@ -0,0 +1,123 @@
+"""اختبارات فهرس قائمة التشغيل: تعداد واحد يُستكمل صفحة بعد صفحة"""
+
+import threading
+
+import pytest
+
+from playlist import PlaylistIndex
+
+SIZE = 25
+
+
+class Enumeration:
+    """مصدر fetch_range يسجل كل تعداد يُفتح وعدد العناصر المقروءة منه"""
+
+    def __init__(self, size=SIZE, fail_at=None):
+        self.size = size
+        self.fail_at = fail_at
+        self.opened = []
+        self.pulled = 0
+        self.closed = 0
+
+    def __call__(self, start, end):
+        self.opened.append((start, end))
+        return self._generate(start, end)
+
+    def _generate(self, start, end):
+        try:
+            for number in range(start, min(end or self.size, self.size) + 1):
+                if number == self.fail_at:
+                    self.fail_at = None
+                    raise ConnectionError('connection reset by peer')
+                self.pulled += 1
+                yield {'id': f'v{number}', 'playlist_title': 'Mix', 'playlist_count': self.size}
+        finally:
+            self.closed += 1
+
+
+def ids(entries):
+    return [entry['id'] for entry in entries]
+
+
+def test_pages_continue_one_enumeration():
+    source = Enumeration()
+    index = PlaylistIndex(source)
+
+    for offset in range(0, 20, 5):
+        entries, has_more = index.page(offset, 5)
+        assert ids(entries) == [f'v{number}' for number in range(offset + 1, offset + 6)]
+        assert has_more
+
+    # الصفحات التالية تقرأ من نفس التعداد، فلا يُجلب أي عنصر مرتين
+    assert source.opened == [(1, None)]
+    assert index.title == 'Mix'
+    assert index.total == SIZE
+
+    entries, has_more = index.page(20, 10)
+    assert ids(entries) == [f'v{number}' for number in range(21, 26)]
+    assert not has_more
+    assert source.pulled == SIZE
+    # اكتمال التعداد يغلقه، والصفحات المعروفة تُخدم من الذاكرة
+    assert source.closed == 1
+    assert ids(index.page(0, 2)[0]) == ['v1', 'v2']
+    assert source.opened == [(1, None)]
+
+
+def test_has_more_is_false_when_page_ends_the_playlist():
+    index = PlaylistIndex(Enumeration(size=10))
+
+    assert index.page(0, 5)[1]
+    entries, has_more = index.page(5, 5)
+    assert ids(entries) == ['v6', 'v7', 'v8', 'v9', 'v10']
+    # عنصر واحد يُقرأ بعد النطاق يثبت أن القائمة انتهت، فلا صفحة تالية فارغة
+    assert not has_more
+    assert index.total == 10
+
+
+def test_failed_enumeration_resumes_after_known_entries():
+    source = Enumeration(fail_at=8)
+    index = PlaylistIndex(source)
+    index.page(0, 5)
+
+    with pytest.raises(ConnectionError):
+        index.page(5, 5)
+    entries, _ = index.page(5, 5)
+
+    assert ids(entries) == ['v6', 'v7', 'v8', 'v9', 'v10']
+    assert source.opened == [(1, None), (8, None)]
+
+
+def test_close_stops_live_enumeration():
+    source = Enumeration()
+    index = PlaylistIndex(source)
+    index.page(0, 5)
+
+    index.close()
+    assert source.closed == 1
+
+
+def test_known_pages_do_not_wait_for_running_fetch():
+    release = threading.Event()
+    reading = threading.Event()
+    source = Enumeration()
+    opened = source.__call__
+
+    def slow_source(start, end):
+        entries = opened(start, end)
+        for entry in entries:
+            if entry['id'] == 'v8':
+                reading.set()
+                release.wait(5)
+            yield entry
+
+    index = PlaylistIndex(slow_source)
+    index.page(0, 5)
+    fetcher = threading.Thread(target=index.page, args=(5, 5))
+    fetcher.start()
+    assert reading.wait(5)
+
+    # الصفحة الأولى معروفة فتُعاد فوراً رغم أن طلباً آخر ينتظر الشبكة
+    assert ids(index.page(0, 5)[0]) == ['v1', 'v2', 'v3', 'v4', 'v5']
+    release.set()
+    fetcher.join(5)
+    assert ids(index.page(5, 5)[0]) == ['v6', 'v7', 'v8', 'v9', 'v10']
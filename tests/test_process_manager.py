@@ -0,0 +1,84 @@
+"""اختبارات حد العمليات المتزامنة: الانتظار على حلقة asyncio في نفس طابور الـ threads"""
+
+import asyncio
+import threading
+
+import pytest
+
+from conftest import wait_until
+from process_manager import PRIORITY_HIGH, PRIORITY_LOW, AdmissionError, ProcessLimiter
+
+
+def test_async_waiter_gets_released_slot():
+    limiter = ProcessLimiter(max_processes=1, wait_timeout=5)
+    limiter.acquire()
+
+    async def main():
+        waiter = asyncio.ensure_future(limiter.acquire_async())
+        await asyncio.sleep(0.01)
+        assert limiter.waiting == 1 and not waiter.done()
+        # التحرير من thread آخر يمنح المكان للمنتظر على الحلقة
+        threading.Thread(target=limiter.release).start()
+        await asyncio.wait_for(waiter, 5)
+
+    asyncio.run(main())
+    assert limiter.stats()['active'] == 1
+    assert limiter.waiting == 0
+
+
+def test_sync_and_async_waiters_share_priority_order():
+    limiter = ProcessLimiter(max_processes=1, wait_timeout=5)
+    limiter.acquire()
+    order = []
+
+    def sync_waiter():
+        limiter.acquire(PRIORITY_LOW)
+        order.append('sync-low')
+        limiter.release()
+
+    async def main():
+        thread = threading.Thread(target=sync_waiter)
+        thread.start()
+        assert await asyncio.to_thread(wait_until, lambda: limiter.waiting == 1)
+        waiter = asyncio.ensure_future(limiter.acquire_async(PRIORITY_HIGH))
+        await asyncio.sleep(0.01)
+        limiter.release()
+        await asyncio.wait_for(waiter, 5)
+        order.append('async-high')
+        limiter.release()
+        await asyncio.to_thread(thread.join, 5)
+
+    asyncio.run(main())
+    assert order == ['async-high', 'sync-low']
+    assert limiter.stats()['active'] == 0
+
+
+def test_async_waiter_times_out_and_leaves_queue():
+    limiter = ProcessLimiter(max_processes=1, wait_timeout=0.05)
+    limiter.acquire()
+
+    with pytest.raises(AdmissionError):
+        asyncio.run(limiter.acquire_async())
+
+    assert limiter.waiting == 0
+    assert limiter.stats()['rejected'] == 1
+    limiter.release()
+    limiter.acquire()
+
+
+def test_cancelled_async_waiter_does_not_keep_slot():
+    limiter = ProcessLimiter(max_processes=1, wait_timeout=5)
+    limiter.acquire()
+
+    async def main():
+        waiter = asyncio.ensure_future(limiter.acquire_async())
+        await asyncio.sleep(0.01)
+        # انقطاع العميل أثناء الانتظار
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+    asyncio.run(main())
+    assert limiter.waiting == 0
+    limiter.release()
+    assert limiter.stats()['active'] == 0
@@ -0,0 +1,58 @@
+"""اختبارات بث التقدم (SSE): إنهاء البث للأعمال المنتهية أو غير المعروفة"""
+
+import asyncio
+import json
+import threading
+
+from progress import ProgressHub, final_events, sse_stream, sse_stream_async
+
+
+def events_of(text):
+    return [block.split('\n', 1)[0] for block in text.split('\n\n') if block.startswith('event:')]
+
+
+def test_stream_ends_when_job_finishes():
+    hub = ProgressHub()
+    hub.update('job-1', {'status': 'downloading', 'progress': 10})
+    stream = sse_stream(hub, ['job-1'], min_interval=0, heartbeat=5)
+
+    assert next(stream) == 'retry: 3000\n\n'
+    assert events_of(next(stream)) == ['event: progress']
+    threading.Timer(0.05, hub.update, ('job-1', {'status': 'completed', 'progress': 100})).start()
+    assert events_of(next(stream)) == ['event: progress', 'event: end']
+    assert list(stream) == []
+
+
+def test_unknown_job_stream_ends_after_pending_timeout():
+    hub = ProgressHub()
+    stream = sse_stream(hub, ['missing'], min_interval=0, heartbeat=5, pending_timeout=0.05)
+
+    # لا تعليقات keepalive كل heartbeat ثانية إلى الأبد، بل end بعد مهلة الانتظار
+    assert list(stream) == ['retry: 3000\n\n', 'event: end\ndata: {}\n\n']
+
+
+def test_job_started_after_subscribing_is_streamed():
+    hub = ProgressHub()
+    stream = sse_stream(hub, ['job-1'], min_interval=0, heartbeat=5, pending_timeout=5)
+    next(stream)
+
+    threading.Timer(0.05, hub.update, ('job-1', {'status': 'completed', 'progress': 100})).start()
+    assert events_of(next(stream)) == ['event: progress', 'event: end']
+
+
+def test_async_unknown_job_stream_ends_after_pending_timeout():
+    hub = ProgressHub()
+
+    async def main():
+        return [event async for event in sse_stream_async(hub, ['missing'], min_interval=0, heartbeat=5,
+                                                          pending_timeout=0.05)]
+
+    assert asyncio.run(main()) == ['retry: 3000\n\n', 'event: end\ndata: {}\n\n']
+
+
+def test_final_events_carry_stored_state():
+    text = final_events('job-1', {'status': 'completed', 'progress': 100})
+
+    assert events_of(text) == ['event: progress', 'event: end']
+    payload = json.loads(text.split('data: ', 1)[1].split('\n', 1)[0])
+    assert payload == {'status': 'completed', 'progress': 100, 'id': 'job-1'}
@@ -0,0 +1,105 @@
+"""اختبارات دمج الطلبات المتزامنة المتطابقة (SingleFlight)"""
+
+import threading
+
+import pytest
+
+from cache import SingleFlight
+from conftest import wait_until
+
+
+def run_concurrently(flight, key, fn, count):
+    """تشغيل count مستدعٍ بنفس المفتاح، وإرجاع (النتائج، الأخطاء)"""
+    results, errors = [], []
+
+    def call():
+        try:
+            results.append(flight.do(key, fn))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def extract():
+        calls.append(1)
+        release.wait(5)
+        return {'id': 'abc'}
+
+    threads, results, errors = run_concurrently(flight, 'youtube:abc', extract, 8)
+    assert wait_until(lambda: flight.stats()['coalesced'] == 7)
+    assert flight.stats()['in_flight'] == 1
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert errors == []
+    assert len(results) == 8
+    # جميع المنتظرين يحصلون على نفس الكائن
+    assert all(result is results[0] for result in results)
+    assert flight.stats() == {'in_flight': 0, 'executed': 1, 'coalesced': 7}
+
+
+def test_error_is_raised_to_every_waiter():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def extract():
+        release.wait(5)
+        raise ValueError('private video')
+
+    threads, results, errors = run_concurrently(flight, 'youtube:abc', extract, 4)
+    assert wait_until(lambda: flight.stats()['coalesced'] == 3)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == []
+    assert len(errors) == 4
+    assert all(error is errors[0] for error in errors)
+
+
+def test_finished_call_is_not_reused():
+    flight = SingleFlight()
+    values = iter([1, 2])
+
+    assert flight.do('key', lambda: next(values)) == 1
+    assert flight.do('key', lambda: next(values)) == 2
+    assert flight.stats() == {'in_flight': 0, 'executed': 2, 'coalesced': 0}
+
+    with pytest.raises(KeyError):
+        flight.do('key', lambda: {}['missing'])
+    # الخطأ لا يبقى مخزناً للطلب التالي
+    assert flight.do('key', lambda: 3) == 3
+
+
+def test_different_keys_run_independently():
+    flight = SingleFlight()
+    release = threading.Event()
+    started = []
+
+    def extract(key):
+        started.append(key)
+        release.wait(5)
+        return key
+
+    first, first_results, _ = run_concurrently(flight, 'a', lambda: extract('a'), 1)
+    second, second_results, _ = run_concurrently(flight, 'b', lambda: extract('b'), 1)
+    assert wait_until(lambda: len(started) == 2)
+    assert flight.stats()['in_flight'] == 2
+    release.set()
+    for thread in first + second:
+        thread.join(5)
+
+    assert first_results == ['a']
+    assert second_results == ['b']
+    assert flight.stats()['coalesced'] == 0
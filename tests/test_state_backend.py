@@ -0,0 +1,134 @@
+"""اختبارات خادم الحالة المشترك مع عميلين (عاملين) على منفذ مؤقت"""
+
+import socket
+
+import pytest
+
+from conftest import wait_until
+from progress import ProgressHub
+from state_backend import BackendError, NetworkBackend, StateServer, _exchange
+
+TOKEN = 'secret'
+
+
+@pytest.fixture
+def server():
+    server = StateServer('127.0.0.1', 0, token=TOKEN).start()
+    yield server
+    server.shutdown()
+
+
+def connect(server, token=TOKEN):
+    """عميل متصل ومشترك، مع محور تقدم وسجل لإشارات الإلغاء التي وصلته"""
+    backend = NetworkBackend(*server.address, token=token, timeout=2.0, reconnect_delay=0.05)
+    backend.hub = ProgressHub()
+    backend.cancelled = []
+    backend.start(backend.hub, on_cancel=backend.cancelled.append)
+    return backend
+
+
+@pytest.fixture
+def workers(server):
+    first, second = connect(server), connect(server)
+    assert wait_until(lambda: first.connected and second.connected)
+    yield first, second
+    first.close()
+    second.close()
+
+
+def test_progress_reaches_other_worker(workers):
+    first, second = workers
+    first.publish('job-1', {'status': 'downloading', 'progress': 40}, 'client-a')
+
+    assert wait_until(lambda: second.hub.get('job-1'))['progress'] == 40
+    assert second.hub.owner('job-1') == 'client-a'
+    assert second.get('job-1') == {'status': 'downloading', 'progress': 40}
+    # تحديثات العامل لا تُطبق على محوره مرة ثانية عند عودتها عبر الاشتراك
+    assert first.hub.get('job-1') is None
+
+
+def test_pending_updates_are_coalesced(workers):
+    first, second = workers
+    for progress in range(0, 101, 10):
+        first.publish('job-2', {'status': 'downloading', 'progress': progress})
+
+    assert wait_until(lambda: (second.hub.get('job-2') or {}).get('progress') == 100)
+    assert first.dropped == 0
+
+
+def test_batch_record_is_read_from_another_worker(workers):
+    first, second = workers
+    record = {'batch_id': 'batch-1', 'status': 'downloading', 'items': [{'index': 0, 'status': 'queued'}]}
+    first.put_record('batch', 'batch-1', record)
+
+    assert wait_until(lambda: second.get_record('batch', 'batch-1')) == record
+    assert second.get_record('batch', 'missing') is None
+
+
+def test_cancel_is_broadcast_to_every_worker(workers):
+    first, second = workers
+    second.cancel('batch-2')
+
+    assert wait_until(lambda: first.cancelled and second.cancelled)
+    assert first.cancelled == ['batch-2']
+    assert second.cancelled == ['batch-2']
+
+
+def test_invalid_token_is_rejected(server):
+    intruder = NetworkBackend(*server.address, token='wrong', timeout=2.0, reconnect_delay=0.05)
+    with pytest.raises(BackendError, match='invalid token'):
+        intruder.cancel('job-3')
+    assert intruder.get('job-3') is None
+    assert intruder.ping()['ok'] is False
+
+    anonymous = NetworkBackend(*server.address, timeout=2.0)
+    with pytest.raises(BackendError, match='authentication required'):
+        anonymous.cancel('job-3')
+
+
+def test_rejected_worker_never_subscribes(server):
+    intruder = connect(server, token='wrong')
+    try:
+        intruder.publish('job-4', {'status': 'completed'})
+        assert not wait_until(lambda: intruder.connected, timeout=0.3)
+        assert server._execute('ping', {})['subscribers'] == 0
+        assert server._execute('get', {'key': 'job-4'}) is None
+    finally:
+        intruder.close()
+
+
+def test_slow_subscriber_is_disconnected(server, workers):
+    first, second = workers
+    server.SUBSCRIBER_QUEUE_SIZE = 4
+    server.SEND_TIMEOUT = 0.2
+
+    # مشترك لا يقرأ أبداً: يمتلئ مخزن المقبس ثم طابوره
+    slow = socket.create_connection(server.address)
+    slow.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    rfile = slow.makefile('rb')
+    _exchange(slow, rfile, {'op': 'auth', 'token': TOKEN})
+    _exchange(slow, rfile, {'op': 'subscribe'})
+    assert wait_until(lambda: server._execute('ping', {})['subscribers'] == 3)
+
+    payload = 'x' * 256 * 1024
+    for index in range(64):
+        first.publish(f'job-{index}', {'status': 'downloading', 'message': payload})
+        if server._execute('ping', {})['subscribers'] < 3:
+            break
+        wait_until(lambda: not first._pending_progress, timeout=1.0)
+
+    assert wait_until(lambda: server._execute('ping', {})['subscribers'] == 2)
+    # بعد انتهاء مهلة الإرسال يغلق الخادم الاتصال، فيُرفض ما يرسله المشترك بعدها
+    assert wait_until(lambda: not still_open(slow))
+    slow.close()
+    # العمال الآخرون ما زالوا يستقبلون التحديثات
+    first.publish('after', {'status': 'completed'})
+    assert wait_until(lambda: second.hub.get('after'))
+
+
+def still_open(sock):
+    try:
+        sock.send(b'{"op": "ping"}\n')
+    except OSError:
+        return False
+    return True
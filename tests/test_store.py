@@ -0,0 +1,147 @@
+"""اختبارات مخزن الأعمال: الكتابة المؤجلة المجمعة، والاستعلام، والضغط"""
+
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import store
+from store import JobStore
+
+DAY = 86400
+
+
+@pytest.fixture
+def job_store(tmp_path):
+    # الكتابة الخلفية معطلة فعلياً حتى يتحكم كل اختبار بوقت flush
+    job_store = JobStore(str(tmp_path / 'jobs.db'), flush_interval=3600)
+    yield job_store
+    job_store.close()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """ساعة الحائط في وحدة المخزن، تُقدَّم يدوياً"""
+    now = SimpleNamespace(value=time.time())
+    monkeypatch.setattr(store, 'time', SimpleNamespace(time=lambda: now.value, monotonic=time.monotonic))
+    return now
+
+
+def history_item(index, created_at, **fields):
+    return dict({'id': f'h{index}', 'video_id': f'youtube:{index:011d}', 'title': f'Video {index}',
+                 'url': f'https://youtu.be/{index:011d}', 'quality': '18', 'download_path': f'Video {index}.mp4',
+                 'size': 1000 + index, 'created_at': created_at}, **fields)
+
+
+def test_updates_are_coalesced_until_flush(job_store):
+    for progress in (10, 50, 90):
+        job_store.record_job('job-1', {'status': 'downloading', 'progress': progress}, client_id='client-a')
+    job_store.record_job('job-2', {'status': 'completed', 'progress': 100})
+
+    # القراءة ترى الحالة المعلقة قبل كتابتها
+    assert job_store.get_job('job-1')['progress'] == 90
+    assert job_store.stats() == {'pending': 2, 'flushes': 0, 'rows_written': 0}
+
+    job_store.flush()
+    assert job_store.stats() == {'pending': 0, 'flushes': 1, 'rows_written': 2}
+    assert job_store.get_job('job-1') == {'status': 'downloading', 'progress': 90}
+
+    # flush دون تغييرات لا يفتح معاملة
+    job_store.flush()
+    assert job_store.stats()['flushes'] == 1
+
+
+def test_client_id_survives_updates_without_it(job_store):
+    job_store.record_job('job-1', {'status': 'downloading', 'progress': 0}, client_id='client-a')
+    job_store.flush()
+    job_store.record_job('job-1', {'status': 'completed', 'progress': 100})
+
+    items, total = job_store.query_jobs(client_id='client-a')
+    assert total == 1
+    assert items[0]['id'] == 'job-1'
+    assert items[0]['status'] == 'completed'
+    assert job_store.query_jobs(client_id='client-a', status='downloading') == ([], 0)
+
+
+def test_close_flushes_pending_writes(tmp_path):
+    path = str(tmp_path / 'jobs.db')
+    first = JobStore(path, flush_interval=3600)
+    first.record_job('job-1', {'status': 'completed'})
+    first.add_history(history_item(1, time.time()))
+    first.close()
+
+    reopened = JobStore(path, flush_interval=3600)
+    try:
+        assert reopened.get_job('job-1') == {'status': 'completed'}
+        assert reopened.query_history()[1] == 1
+    finally:
+        reopened.close()
+
+
+def test_history_queries(job_store):
+    now = time.time()
+    for index in range(5):
+        job_store.add_history(history_item(index, now - index * DAY))
+    job_store.add_history(history_item(9, now, title='100% free_speech'))
+
+    items, total = job_store.query_history(limit=2)
+    assert total == 6
+    assert [item['id'] for item in items] == ['h9', 'h0']
+
+    items, total = job_store.query_history(limit=2, offset=4)
+    assert [item['id'] for item in items] == ['h3', 'h4']
+
+    assert [item['id'] for item in job_store.query_history(video_id='youtube:00000000002')[0]] == ['h2']
+    assert [item['id'] for item in job_store.query_history(since=now - 2.5 * DAY, until=now - 0.5 * DAY)[0]] == ['h1', 'h2']
+    # % و _ في البحث حرفية
+    assert [item['id'] for item in job_store.query_history(search='100%')[0]] == ['h9']
+    assert job_store.query_history(search='free_s')[1] == 1
+    assert job_store.query_history(search='Video_')[1] == 0
+
+    job_store.add_history(history_item(10, now))
+    job_store.clear_history()
+    assert job_store.query_history() == ([], 0)
+
+
+def test_compaction_removes_expired_rows_and_reclaims_space(job_store, clock):
+    old = clock.value - 100 * DAY
+    clock.value = old
+    for index in range(500):
+        job_store.record_job(f'old-{index}', {'status': 'completed', 'message': 'x' * 1000})
+        job_store.add_history(history_item(index, old, title='x' * 1000))
+    clock.value = old + 100 * DAY
+    job_store.record_job('recent', {'status': 'completed'})
+    job_store.add_history(history_item(1000, clock.value))
+    job_store.flush()
+
+    connection = job_store._connection()
+    pages_before = connection.execute('PRAGMA page_count').fetchone()[0]
+
+    assert job_store.compact() == 1000
+
+    assert job_store.query_jobs()[1] == 1
+    assert job_store.get_job('recent') == {'status': 'completed'}
+    assert [item['id'] for item in job_store.query_history()[0]] == ['h1000']
+    assert connection.execute('PRAGMA freelist_count').fetchone()[0] == 0
+    assert connection.execute('PRAGMA page_count').fetchone()[0] < pages_before
+    assert os.path.getsize(job_store.path + '-wal') == 0
+    # لا شيء آخر تجاوز مدة الاحتفاظ
+    assert job_store.compact() == 0
+
+
+def test_retention_is_per_table(tmp_path, clock):
+    job_store = JobStore(str(tmp_path / 'jobs.db'), flush_interval=3600, job_retention=DAY,
+                         history_retention=30 * DAY)
+    try:
+        clock.value -= 2 * DAY
+        job_store.record_job('job-1', {'status': 'completed'})
+        job_store.add_history(history_item(1, clock.value))
+        job_store.flush()
+        clock.value += 2 * DAY
+
+        assert job_store.compact() == 1
+        assert job_store.get_job('job-1') is None
+        assert job_store.query_history()[1] == 1
+    finally:
+        job_store.close()
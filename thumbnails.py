@@ -0,0 +1,157 @@
+"""
+وكيل الصور المصغرة.
+
+كل صورة تُجلب من المصدر مرة واحدة إلى ذاكرة مؤقتة محدودة على القرص (MediaCache)، وتُنشأ
+منها عند أول طلب نسخة بحجم القائمة (list) أو بحجم صفحة الفيديو (detail) بصيغة WebP أو
+JPEG حسب ما يقبله المتصفح. الروابط موقعة بـ HMAC حتى لا يصبح المسار وكيلاً مفتوحاً لأي رابط.
+
+تغيير الحجم يحتاج Pillow (اختياري)؛ بدونه تُقدَّم الصورة الأصلية من الذاكرة المؤقتة.
+"""
+
+import hashlib
+import hmac
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from cache import TTLCache
+from media_cache import media_key
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# أقصى أبعاد كل حجم (العرض، الارتفاع) مع الحفاظ على نسبة الصورة
+SIZES = {'list': (320, 180), 'detail': (1280, 720)}
+FORMATS = {'webp': ('WEBP', 'image/webp'), 'jpeg': ('JPEG', 'image/jpeg')}
+MAX_SOURCE_BYTES = 10 * 1024 * 1024
+
+MAGIC_NUMBERS = ((b'\xff\xd8\xff', 'image/jpeg'), (b'\x89PNG', 'image/png'), (b'GIF8', 'image/gif'))
+
+
+class ThumbnailError(Exception):
+    """المصدر ليس صورة صالحة أو أكبر من الحد"""
+
+
+def sniff_mimetype(data):
+    for prefix, mimetype in MAGIC_NUMBERS:
+        if data.startswith(prefix):
+            return mimetype
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+
+def sign_source(secret, url):
+    return hmac.new(secret.encode('utf-8'), url.encode('utf-8'), hashlib.sha256).hexdigest()[:32]
+
+
+def verify_source(secret, url, signature):
+    return hmac.compare_digest(sign_source(secret, url), signature or '')
+
+
+def download_image(url, timeout=10):
+    """بايتات الصورة من المصدر (ThumbnailError إن لم تكن صورة أو تجاوزت الحد)"""
+    data = bytearray()
+    with requests.get(url, timeout=timeout, stream=True) as response:
+        response.raise_for_status()
+        for chunk in response.iter_content(64 * 1024):
+            data += chunk
+            if len(data) > MAX_SOURCE_BYTES:
+                raise ThumbnailError('thumbnail too large')
+    if sniff_mimetype(data) is None:
+        raise ThumbnailError('not an image')
+    return bytes(data)
+
+
+def resize_image(data, size, image_format):
+    """تصغير الصورة إلى حدود size بالصيغة المطلوبة"""
+    try:
+        image = Image.open(io.BytesIO(data))
+        # فك JPEG مباشرة بدقة أقل من الأصل عندما تكفي (أسرع بكثير من فك الصورة كاملة)
+        image.draft('RGB', size)
+        image = image.convert('RGB')
+        image.thumbnail(size, Image.LANCZOS)
+        output = io.BytesIO()
+        pil_format, _ = FORMATS[image_format]
+        if image_format == 'webp':
+            image.save(output, pil_format, quality=80, method=4)
+        else:
+            image.save(output, pil_format, quality=85, optimize=True, progressive=True)
+    except (OSError, ValueError) as e:
+        raise ThumbnailError(f'cannot resize thumbnail: {e}') from e
+    return output.getvalue()
+
+
+class ThumbnailStore:
+    def __init__(self, cache, workers=4, timeout=10, fetch=download_image):
+        self.cache = cache
+        self.timeout = timeout
+        self.fetch = fetch
+        self.resizing = Image is not None
+        self.warmed = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumbnail')
+        self._warming = set()
+        self._lock = threading.Lock()
+        # الصور التي فشل تصغيرها تُقدَّم كما هي دون إعادة المحاولة في كل طلب
+        self._unresizable = TTLCache(maxsize=4096, ttl=3600)
+
+    def variant(self, size, accept_webp):
+        """(الحجم، الصيغة) التي ستُقدَّم فعلاً؛ دون Pillow تُقدَّم الصورة الأصلية"""
+        if not self.resizing or size == 'original':
+            return 'original', None
+        return size, 'webp' if accept_webp else 'jpeg'
+
+    def _original(self, url):
+        return self.cache.fetch(media_key(url, 'thumbnail'), lambda: [self.fetch(url, self.timeout)],
+                                meta={'source': url})
+
+    def get(self, url, size='original', image_format=None):
+        """
+        CachedMedia للنسخة المطلوبة ونوعها (mimetype). الأصل والنسخ تُجهز مرة واحدة حتى مع
+        الطلبات المتزامنة؛ الصورة التي لا يمكن تصغيرها تُقدَّم كما هي.
+        """
+        if size != 'original' and url not in self._unresizable:
+            def producer():
+                with open(self._original(url).path, 'rb') as f:
+                    return [resize_image(f.read(), SIZES[size], image_format)]
+
+            key = media_key(url, 'thumbnail', {'size': size, 'format': image_format})
+            try:
+                return self.cache.fetch(key, producer, meta={'source': url}), FORMATS[image_format][1]
+            except ThumbnailError as e:
+                print(f"Thumbnail resize error ({url}): {e}")
+                self._unresizable.set(url, True)
+        original = self._original(url)
+        with open(original.path, 'rb') as f:
+            mimetype = sniff_mimetype(f.read(16)) or 'application/octet-stream'
+        return original, mimetype
+
+    def warm(self, urls, size='list', image_format='webp'):
+        """تجهيز نسخ صفحة كاملة (نتائج بحث أو قائمة تشغيل) في الخلفية"""
+        size, image_format = self.variant(size, image_format == 'webp')
+        for url in urls:
+            job = (url, size, image_format)
+            with self._lock:
+                if not url or job in self._warming:
+                    continue
+                self._warming.add(job)
+            self._executor.submit(self._warm_one, job)
+
+    def _warm_one(self, job):
+        try:
+            self.get(*job)
+            self.warmed += 1
+        except Exception as e:
+            print(f"Thumbnail warm-up error ({job[0]}): {e}")
+        finally:
+            with self._lock:
+                self._warming.discard(job)
+
+    def stats(self):
+        with self._lock:
+            warming = len(self._warming)
+        return dict(self.cache.stats(), resizing=self.resizing, warming=warming, warmed=self.warmed)
@@ -0,0 +1,126 @@
+"""
+تتبع مراحل الطلب (spans) مع أخذ عينات.
+
+- Tracer.trace(name): يبدأ تتبعاً للطلب الحالي ويجعله التتبع النشط (contextvars)، فتسجل
+  الدوال في أي وحدة مراحلها عبر span() دون تمرير التتبع كمعامل
+- span(name): مرحلة مؤقتة داخل التتبع النشط؛ لا تفعل شيئاً إن لم يوجد تتبع
+- تُسجَّل المراحل لكل طلب متتبَّع (بضع استدعاءات perf_counter)، ولا يُكتب إلى المخرج إلا
+  الطلبات المختارة بالعينة أو الأبطأ من slow_threshold
+"""
+
+import contextvars
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+
+_current = contextvars.ContextVar('trace', default=None)
+
+
+class Trace:
+    def __init__(self, name, sampled, **attributes):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.sampled = sampled
+        self.attributes = attributes
+        self.spans = []
+        self.started_at = datetime.now(timezone.utc)
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def span(self, name, **attributes):
+        start = time.perf_counter()
+        record = {'name': name, 'start_ms': round((start - self._start) * 1000, 3), **attributes}
+        try:
+            yield record
+        except BaseException as e:
+            record['error'] = type(e).__name__
+            raise
+        finally:
+            record['duration_ms'] = round((time.perf_counter() - start) * 1000, 3)
+            self.spans.append(record)
+
+    def elapsed(self):
+        return time.perf_counter() - self._start
+
+    def to_dict(self, duration):
+        return {
+            'trace_id': self.id,
+            'name': self.name,
+            'started_at': self.started_at.isoformat(),
+            'duration_ms': round(duration * 1000, 3),
+            'sampled': self.sampled,
+            'attributes': self.attributes,
+            'spans': sorted(self.spans, key=lambda s: s['start_ms']),
+        }
+
+
+class JsonLinesSink:
+    """كتابة كل تتبع كسطر JSON إلى ملف (أو stderr إن لم يُحدد ملف)"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self._lock:
+            if self.path:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(line)
+            else:
+                sys.stderr.write(line)
+                sys.stderr.flush()
+
+
+class Tracer:
+    def __init__(self, sink, sample_rate=0.01, slow_threshold=None):
+        self.sink = sink
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.emitted = 0
+
+    @contextmanager
+    def trace(self, name, **attributes):
+        trace = Trace(name, random.random() < self.sample_rate, **attributes)
+        token = _current.set(trace)
+        try:
+            yield trace
+        except BaseException as e:
+            trace.attributes['error'] = type(e).__name__
+            raise
+        finally:
+            _current.reset(token)
+            duration = trace.elapsed()
+            if trace.sampled or (self.slow_threshold is not None and duration >= self.slow_threshold):
+                self.emit(trace.to_dict(duration))
+
+    def emit(self, record):
+        try:
+            self.sink(record)
+            self.emitted += 1
+        except Exception as e:
+            print(f"Trace sink error: {e}")
+
+
+def current_trace():
+    return _current.get()
+
+
+def span(name, **attributes):
+    """مرحلة في التتبع النشط (أو سياق فارغ إن لم يكن هناك تتبع)"""
+    trace = _current.get()
+    if trace is None:
+        return nullcontext({})
+    return trace.span(name, **attributes)
+
+
+def annotate(**attributes):
+    """إضافة خصائص إلى التتبع النشط"""
+    trace = _current.get()
+    if trace is not None:
+        trace.attributes.update(attributes)
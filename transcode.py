@@ -0,0 +1,56 @@
+"""
+تحويل الصوت بـ ffmpeg.
+
+يعمل ffmpeg كمنزِّل yt-dlp (--external-downloader ffmpeg) فيقرأ الصوت ويحوله ويبثه
+إلى stdout في عملية واحدة لكل تحويل. يُقيَّد ffmpeg بـ thread واحد حتى يشغل كل تحويل
+نواة واحدة، فيكون عدد التحويلات المتزامنة هو عدد الأنوية المستخدمة.
+"""
+
+import re
+
+# صيغ الإخراج: (مرمّز ffmpeg، صيغة الحاوية، الامتداد، نوع المحتوى، معدل البت الافتراضي والأقصى
+# بالكيلوبت، خيارات إضافية). flac بلا فقد فلا يأخذ معدل بت.
+AUDIO_FORMATS = {
+    'mp3': {'codec': 'libmp3lame', 'muxer': 'mp3', 'ext': 'mp3', 'mimetype': 'audio/mpeg',
+            'bitrate': 320, 'max_bitrate': 320},
+    'opus': {'codec': 'libopus', 'muxer': 'opus', 'ext': 'opus', 'mimetype': 'audio/ogg',
+             'bitrate': 160, 'max_bitrate': 256},
+    # البث إلى أنبوب يحتاج MP4 مجزأ لأن الحاوية العادية تُكتب فهرستها في بداية الملف بعد الانتهاء
+    'm4a': {'codec': 'aac', 'muxer': 'ipod', 'ext': 'm4a', 'mimetype': 'audio/mp4',
+            'bitrate': 256, 'max_bitrate': 320, 'options': ['-movflags', '+frag_keyframe+empty_moov']},
+    'flac': {'codec': 'flac', 'muxer': 'flac', 'ext': 'flac', 'mimetype': 'audio/flac',
+             'bitrate': None, 'max_bitrate': None},
+}
+
+MIN_BITRATE = 32
+
+
+def parse_bitrate(audio_format, value):
+    """معدل البت بالكيلوبت من قيمة مثل 320k أو 320، أو None للصيغ بلا فقد"""
+    spec = AUDIO_FORMATS[audio_format]
+    if spec['bitrate'] is None:
+        return None
+    if value in (None, ''):
+        return spec['bitrate']
+    match = re.fullmatch(r'\s*(\d+)\s*k?\s*', str(value), re.IGNORECASE)
+    if not match:
+        raise ValueError(f'invalid bitrate: {value}')
+    return max(MIN_BITRATE, min(int(match.group(1)), spec['max_bitrate']))
+
+
+def transcode_args(audio_format, bitrate=None):
+    """وسائط yt-dlp التي تبث أفضل صوت بعد تحويله إلى الصيغة المطلوبة عبر stdout"""
+    spec = AUDIO_FORMATS[audio_format]
+    ffmpeg_args = ['-vn', '-threads', '1', '-c:a', spec['codec']]
+    if bitrate:
+        ffmpeg_args += ['-b:a', f'{bitrate}k']
+    ffmpeg_args += [*spec.get('options', []), '-f', spec['muxer']]
+    return ['-f', 'bestaudio/best', '--external-downloader', 'ffmpeg',
+            '--external-downloader-args', 'ffmpeg:' + ' '.join(ffmpeg_args), '-o', '-']
+
+
+def estimate_size(bitrate, duration):
+    """الحجم المتوقع من معدل البت ومدة الفيديو (غير معروف للصيغ بلا فقد)"""
+    if not bitrate or not duration:
+        return None
+    return int(bitrate * 1000 / 8 * duration)
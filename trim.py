@@ -0,0 +1,62 @@
+"""
+تقطيع الفيديو دون تحميله كاملاً.
+
+يجلب yt-dlp المقطع فقط (--download-sections) فيقرأ ffmpeg من المصدر الأجزاء التي
+تغطي الفترة المطلوبة. النسخ دون إعادة ترميز (stream copy) هو الافتراضي ويبدأ المقطع
+عند أقرب إطار مفتاحي قبل البداية؛ الوضع الدقيق يعيد الترميز ليقطع عند الوقت المحدد.
+
+عدة مقاطع متقاربة من نفس الفيديو تُجلب كنافذة واحدة ثم يُقص كل مقطع منها محلياً.
+"""
+
+# الإخراج إلى أنبوب يحتاج MP4 مجزأ (الفهرسة العادية تُكتب بعد انتهاء الملف)
+STREAMABLE_MP4 = ['-f', 'mp4', '-movflags', '+frag_keyframe+empty_moov']
+
+# إعادة الترميز في الوضع الدقيق
+PRECISE_CODECS = ['-c:v', 'libx264', '-preset', 'veryfast', '-c:a', 'aac']
+
+
+def clip_format_spec(video_format=None):
+    """
+    تعبير اختيار الصيغة للمقطع: الصيغة المختارة (مع أفضل صوت إن كانت مرئية فقط)،
+    أو أفضل صيغة مدمجة عند عدم الاختيار.
+    """
+    if video_format is None:
+        return 'best[ext=mp4]/best'
+    format_id = video_format['format_id']
+    if video_format.get('acodec') == 'none' and video_format.get('vcodec') != 'none':
+        audio = 'bestaudio[ext=m4a]' if video_format.get('ext') == 'mp4' else 'bestaudio[ext=webm]'
+        return f'{format_id}+{audio}/{format_id}+bestaudio'
+    return format_id
+
+
+def section_args(format_spec, start, end, precise=False):
+    """وسائط yt-dlp لبث الفترة [start, end] بالثواني فقط إلى stdout"""
+    args = ['-f', format_spec, '--download-sections', f'*{start:g}-{end:g}',
+            '--external-downloader-args', 'ffmpeg_o:' + ' '.join(STREAMABLE_MP4), '-o', '-']
+    if precise:
+        args.append('--force-keyframes-at-cuts')
+    return args
+
+
+def merge_windows(clips, max_gap):
+    """
+    دمج المقاطع [(start, end), ...] المتداخلة أو التي تفصلها max_gap ثانية أو أقل في نوافذ
+    جلب. تعيد [(start, end, [أرقام المقاطع])] مرتبة حسب البداية.
+    """
+    windows = []
+    for index in sorted(range(len(clips)), key=lambda i: clips[i]):
+        start, end = clips[index]
+        if windows and start - windows[-1][1] <= max_gap:
+            window = windows[-1]
+            window[1] = max(window[1], end)
+            window[2].append(index)
+        else:
+            windows.append([start, end, [index]])
+    return [tuple(window) for window in windows]
+
+
+def clip_command(ffmpeg, source, offset, duration, precise=False):
+    """أمر ffmpeg لقص مقطع من ملف نافذة مجلوبة وبثه إلى stdout"""
+    codecs = PRECISE_CODECS if precise else ['-c', 'copy']
+    return [ffmpeg, '-hide_banner', '-loglevel', 'error', '-ss', f'{offset:g}', '-i', source,
+            '-t', f'{duration:g}', *codecs, '-avoid_negative_ts', 'make_zero', *STREAMABLE_MP4, 'pipe:1']